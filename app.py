@@ -1,15 +1,40 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, abort, send_from_directory, g, got_request_exception, stream_with_context
 import json
 import os
 import glob
 import uuid
+import zipfile
 from werkzeug.utils import secure_filename
 import hashlib
-
-with open('config.json', 'r', encoding='utf-8') as f:
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+import scenario_graph
+import scenario_engine
+import image_pipeline
+import audio_pipeline
+import asset_fingerprints
+import asset_index
+import content_events
+import content_import
+import content_store
+import content_backends
+import content_snapshot
+import metrics
+import save_store
+import search_index
+import upload_sessions
+import voice_sprites
+import scenario_bundle
+from concurrent.futures import ProcessPoolExecutor
+
+# SWVNE_CONFIG points at another config file (the benchmarks run against generated content this way)
+with open(os.environ.get('SWVNE_CONFIG', 'config.json'), 'r', encoding='utf-8') as f:
     config = json.load(f)
 
-app = Flask(__name__, static_folder='static', template_folder='templates')
+app = Flask(__name__, static_folder=config.get('STATIC_FOLDER', 'static'), template_folder='templates')
 app.config['SECRET_KEY'] = config['SECRET_KEY']
 app.config['CONTENT_FOLDER'] = config['CONTENT_FOLDER']
 app.config['UPLOAD_FOLDER'] = config['UPLOAD_FOLDER']
@@ -20,6 +45,28 @@ ADMIN_PASSWORD_HASH = hashlib.sha256(ADMIN_PASSWORD.encode()).hexdigest()
 
 ALLOWED_EXTENSIONS = {'json'}
 
+# Cache-Control values per response policy; override any of them via "CACHE_CONTROL" in config.json
+CACHE_CONTROL_POLICIES = {
+    'content': 'public, no-cache',
+    'listing': 'public, no-cache',
+}
+CACHE_CONTROL_POLICIES.update(config.get('CACHE_CONTROL', {}))
+
+JSON_BODY_CACHE_SIZE = 64
+# Bodies estimated above this many bytes are streamed instead of built and cached in memory
+JSON_STREAM_THRESHOLD = config.get('JSON_STREAM_THRESHOLD', 4 * 1024 * 1024)
+STREAM_CHUNK_SIZE = 64 * 1024
+NDJSON_MIMETYPE = 'application/x-ndjson'
+MAX_LOOKAHEAD_STEPS = 10
+MAX_ASSETS_PER_PAGE = 500
+MAX_SCENARIOS_PER_PAGE = 500
+MAX_SEARCH_PER_PAGE = 100
+
+# Fingerprinted asset URLs never change meaning, so browsers and proxies may keep them for a year
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+IMAGE_VARIANT_WIDTHS = tuple(config.get('IMAGE_VARIANT_WIDTHS', image_pipeline.DEFAULT_WIDTHS))
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -28,7 +75,7 @@ def check_admin():
 
 def scan_audio_files(subfolder):
     """Сканирует папку static/audio и возвращает список путей."""
-    audio_dir = os.path.join(os.path.dirname(__file__), 'static', 'audio', subfolder)
+    audio_dir = os.path.join(app.static_folder, 'audio', subfolder)
     if not os.path.exists(audio_dir):
         return []
 
@@ -40,68 +87,538 @@ def scan_audio_files(subfolder):
     paths = [f"/static/audio/{subfolder}/{os.path.basename(f)}" for f in files]
     return sorted(paths)
 
+def conflict_response(conflict):
+    """409 for an edit made against an outdated version of the entity."""
+    return jsonify({
+        'success': False,
+        'error': 'Данные были изменены в другом окне или другим пользователем. Загрузите их заново и повторите.',
+        'conflict': True,
+        'current_version': conflict.current
+    }), 409
+
+def static_url_to_path(url):
+    """Maps a /static/... URL to a file path inside the static folder, or None."""
+    if not isinstance(url, str) or not url.startswith('/static/'):
+        return None
+    relative = url[len('/static/'):].split('?', 1)[0]
+    static_root = os.path.abspath(app.static_folder)
+    path = os.path.abspath(os.path.join(static_root, *relative.split('/')))
+    if not path.startswith(static_root + os.sep):
+        return None
+    return path
+
+def static_file_size(url):
+    """Size in bytes of a static asset, None if it does not exist."""
+    path = static_url_to_path(url)
+    if not path:
+        return None
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def fingerprint_variants(entry):
+    """Fingerprints the files a media pipeline wrote (the ``variants`` of its manifest entry),
+    so pages get their fingerprinted URLs without hashing them on request."""
+    for variant in entry.get('variants') or ():
+        fingerprints.update(variant['url'])
+
+_image_executor = None
+_image_executor_lock = threading.Lock()
+
+def schedule_image_derivatives(source_path, source_url):
+    """Queues WebP/AVIF derivatives of an uploaded image on the shared process pool."""
+    global _image_executor
+    if not image_pipeline.is_available():
+        return False
+    with _image_executor_lock:
+        if _image_executor is None:
+            _image_executor = ProcessPoolExecutor(max_workers=config.get('IMAGE_WORKERS'))
+    job = image_pipeline.build_job(app.static_folder, source_path, source_url, IMAGE_VARIANT_WIDTHS)
+
+    def on_done(future):
+        try:
+            entry = future.result()
+            image_pipeline.update_manifest(app.static_folder, [entry])
+            fingerprint_variants(entry)
+        except Exception as e:
+            print(f"[ERROR] Failed to build image derivatives for {source_url}: {e}")
+
+    _image_executor.submit(image_pipeline.process_image, *job).add_done_callback(on_done)
+    return True
+
+audio_jobs = audio_pipeline.AudioJobQueue(
+    app.static_folder,
+    encoder=audio_pipeline.find_encoder(config.get('AUDIO_ENCODER', 'ffmpeg')),
+    bitrates=config.get('AUDIO_BITRATES'),
+    loudness=config.get('AUDIO_LOUDNESS', audio_pipeline.DEFAULT_LOUDNESS),
+    workers=config.get('AUDIO_WORKERS', 2),
+    on_result=fingerprint_variants)
+
+voice_sprite_manifest = voice_sprites.SpriteManifest(app.static_folder)
+
+# Parsed content and asset data from `python content_snapshot.py`; whatever
+# changed since it was built is read from disk as usual
+snapshot_file = content_snapshot.SnapshotFile.open(
+    config.get('CONTENT_SNAPSHOT', 'content.snapshot') and
+    os.path.join(os.path.dirname(__file__), config.get('CONTENT_SNAPSHOT', 'content.snapshot')))
+
+fingerprints = asset_fingerprints.create_fingerprints(
+    app.static_folder,
+    grace_period=config.get('ASSET_FINGERPRINT_GRACE', asset_fingerprints.DEFAULT_GRACE_PERIOD))
+if snapshot_file:
+    snapshot_file.seed('fingerprints', fingerprints)
+fingerprints.build()
+
+assets_index = asset_index.AssetIndex(app.static_folder)
+if snapshot_file:
+    snapshot_file.seed('assets', assets_index)
+assets_index.scan()
 
 
 class VisualNovelManager:
-    def __init__(self, content_path):
+    CONTENT_TYPES = content_backends.CONTENT_TYPES
+
+    def __init__(self, content_path, check_interval=0, backend=None):
         self.content_path = content_path
+        self.check_interval = check_interval
+        self.backend = backend or content_backends.JsonFolderBackend(content_path)
         self.characters = {}
         self.scenes = {}
         self.voices = {}
         self.scenarios = {}
+        # Per content type: entity id -> {'version': content hash, 'size': serialized bytes}
+        self.meta = {content_type: {} for content_type in self.CONTENT_TYPES}
+        # Per content type: combined version hash and newest modification time (ns)
+        self.versions = {content_type: '' for content_type in self.CONTENT_TYPES}
+        self.modified_at = {content_type: 0 for content_type in self.CONTENT_TYPES}
+        # Per content type: backend revision the dicts above were built from
+        self._revisions = {content_type: None for content_type in self.CONTENT_TYPES}
+        self._checked_at = {content_type: 0.0 for content_type in self.CONTENT_TYPES}
+        # scenario id -> (scenario version, compiled graph)
+        self._compiled = {}
+        # (scenario id, steps) -> (content versions, lookahead manifest)
+        self._lookahead = {}
+        # scenario id -> frames of its nodes for /api/game/step, see get_frames
+        self._frames = {}
+        # scenario id -> voice lines that have a file, see get_voice
+        self._voice = {}
+        self._lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0,
+                      'scenarios_compiled': 0, 'compile_ms_total': 0.0, 'frames_rendered': 0}
         self.load_all_content()
 
     def load_all_content(self):
         """Сканирует папки и загружает весь контент из JSON файлов."""
-        self.characters = self._load_from_directory(os.path.join(self.content_path, 'characters'), 'characters')
-        self.scenes = self._load_from_directory(os.path.join(self.content_path, 'scenes'), 'scenes')
-        self.scenarios = self._load_from_directory(os.path.join(self.content_path, 'scenarios'), 'scenarios')
-        self.voices = self._load_from_directory(os.path.join(self.content_path, 'voices'), 'voices')
-
-        print(f"Loaded {len(self.characters)} characters, {len(self.scenes)} scenes, {len(self.scenarios)} scenarios.")
-
-    def _load_from_directory(self, dir_path, content_key):
-        """Вспомогательная функция для загрузки и объединения JSON из папки с улучшенной диагностикой."""
-        combined_data = {}
-        if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
-            return {}
-
-        for filepath in glob.glob(os.path.join(dir_path, '*.json')):
-            filename = os.path.basename(filepath)
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if content_key in data:
-                        for key in data[content_key]:
-                            if key in combined_data:
-                                print(f"[WARNING] Duplicate key '{key}' found in {filename}. It will overwrite the existing entry.")
-                        combined_data.update(data[content_key])
-                    else:
-                        print(f"[WARNING] File {filename} was skipped because it does not contain the top-level key '{content_key}'.")
-            except json.JSONDecodeError as e:
-                print(f"[ERROR] Failed to decode JSON from {filename}: {e}")
-            except Exception as e:
-                print(f"[ERROR] An unexpected error occurred while loading {filename}: {e}")
-        return combined_data
+        with self._lock:
+            for content_type in self.CONTENT_TYPES:
+                self.reload_content(content_type)
+
+        print(f"Loaded {len(self.characters)} characters, {len(self.scenes)} scenes, {len(self.scenarios)} scenarios "
+              f"({self.backend.name} backend).")
 
     def reload_content(self, content_type):
         """Перезагружает определенный тип контента."""
-        if content_type == 'characters':
-             self.characters = self._load_from_directory(os.path.join(self.content_path, 'characters'), 'characters')
-        elif content_type == 'scenes':
-             self.scenes = self._load_from_directory(os.path.join(self.content_path, 'scenes'), 'scenes')
-        elif content_type == 'scenarios':
-             self.scenarios = self._load_from_directory(os.path.join(self.content_path, 'scenarios'), 'scenarios')
-        elif content_type == 'voices':
-             self.voices = self._load_from_directory(os.path.join(self.content_path, 'voices'), 'voices')
+        if content_type not in self.CONTENT_TYPES:
+            return False
+        with self._lock:
+            self._checked_at[content_type] = time.monotonic()
+            started = time.perf_counter()
+            snapshot = self.backend.load(content_type)
+            if snapshot.revision == self._revisions[content_type]:
+                return False
+            # Swap in fresh dicts so readers holding the old ones are unaffected
+            setattr(self, content_type, snapshot.data)
+            self.meta[content_type] = snapshot.meta
+            versions = '|'.join(f"{key}:{value['version']}" for key, value in sorted(snapshot.meta.items()))
+            self.versions[content_type] = hashlib.sha1(versions.encode('utf-8')).hexdigest()[:16]
+            # A deleted file (or one copied in with an old mtime) changes the content without
+            # a newer mtime; Last-Modified must still move, so use the time it was noticed
+            if snapshot.modified_at > self.modified_at[content_type] or self._revisions[content_type] is None:
+                self.modified_at[content_type] = snapshot.modified_at
+            else:
+                self.modified_at[content_type] = time.time_ns()
+            self._revisions[content_type] = snapshot.revision
+            metrics.content_load_seconds.observe(time.perf_counter() - started, content_type=content_type)
+            return True
+
+    def refresh(self, content_types=None):
+        """Re-reads only the content that changed in the backend.
+
+        Checks are throttled to once per ``check_interval`` seconds per content type.
+        """
+        with self._lock:
+            for content_type in content_types or self.CONTENT_TYPES:
+                if time.monotonic() - self._checked_at[content_type] < self.check_interval:
+                    self.stats['hits'] += 1
+                elif self.reload_content(content_type):
+                    self.stats['misses'] += 1
+                else:
+                    self.stats['hits'] += 1
+        return self
+
+    def invalidate(self, content_type=None):
+        """Makes the next refresh ask the backend again, skipping the check interval.
+
+        The backend re-reads only what changed, and the dicts above are rebuilt only
+        if its revision moved."""
+        with self._lock:
+            for key in [content_type] if content_type else self.CONTENT_TYPES:
+                self.backend.invalidate(key)
+                self._checked_at[key] = 0.0
+            self.stats['invalidations'] += 1
+
+    def update_entity(self, content_type, entity_id, mutate, expected_version=None):
+        """Writes ``mutate(current value)`` as the new entity; raises VersionConflict
+        if it changed since ``expected_version``. Returns the new version."""
+        try:
+            return self.backend.update(content_type, entity_id, mutate, expected_version)
+        finally:
+            self.invalidate(content_type)
+
+    def put_entity(self, content_type, entity_id, value, expected_version=None):
+        return self.update_entity(content_type, entity_id, lambda current: value, expected_version)
+
+    def delete_entities(self, content_type, entity_ids):
+        try:
+            return self.backend.delete(content_type, entity_ids)
+        finally:
+            self.invalidate(content_type)
+
+    def get_compiled_scenario(self, scenario_id):
+        """Returns the compiled graph of a scenario, compiling it once per content version."""
+        scenario = self.scenarios.get(scenario_id)
+        if scenario is None:
+            return None
+        version = self.meta['scenarios'].get(scenario_id, {}).get('version', '')
+        with self._lock:
+            cached = self._compiled.get(scenario_id)
+            if cached and cached[0] == version:
+                return cached[1]
+        compiled = scenario_graph.compile_scenario(scenario_id, scenario)
+        compiled['version'] = version
+        with self._lock:
+            self._compiled[scenario_id] = (version, compiled)
+            self.stats['scenarios_compiled'] += 1
+            self.stats['compile_ms_total'] = round(self.stats['compile_ms_total'] + compiled['stats']['compile_ms'], 3)
+        if scenario_graph.has_errors(compiled):
+            for message in scenario_graph.summarize_issues(compiled):
+                print(f"[WARNING] Scenario '{scenario_id}': {message}")
+        return compiled
+
+    def get_asset_lookahead(self, scenario_id, steps):
+        """Returns the prefetch manifest for a scenario, rebuilt when the scenario,
+        characters or scenes change."""
+        compiled = self.get_compiled_scenario(scenario_id)
+        if compiled is None:
+            return None
+        voice = self.get_voice(scenario_id)
+        versions = (compiled['version'], self.versions['characters'], self.versions['scenes'], voice['version'])
+        with self._lock:
+            cached = self._lookahead.get((scenario_id, steps))
+            if cached and cached[0] == versions:
+                return cached[1]
+
+        started = time.perf_counter()
+        node_assets = scenario_graph.collect_node_assets(
+            scenario_id, compiled, self.characters, self.scenes,
+            voice_exists=lambda url: assets_index.get(url) is not None)
+        urls, lookahead = scenario_graph.build_asset_lookahead(compiled, node_assets, steps)
+        manifest = {
+            'scenario': scenario_id,
+            'version': compiled['version'],
+            'voice_version': voice['version'],
+            'steps': steps,
+            'assets': [{'url': url, 'size': static_file_size(url) or 0} for url in urls],
+            'nodes': {compiled['ids'][position]: entries for position, entries in enumerate(lookahead)},
+            'build_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+        with self._lock:
+            self._lookahead[(scenario_id, steps)] = (versions, manifest)
+        return manifest
+
+    def get_frames(self, scenario_id):
+        """The compiled graph of a scenario with its dialogue id -> position index and
+        ``render(position)``, which renders a node's frame once per version of the
+        scenario, characters, scenes and asset fingerprints."""
+        compiled = self.get_compiled_scenario(scenario_id)
+        if compiled is None:
+            return None
+        versions = (compiled['version'], self.versions['characters'], self.versions['scenes'], fingerprints.version,
+                    self.get_voice(scenario_id)['version'])
+        with self._lock:
+            cached = self._frames.get(scenario_id)
+            if cached and cached['versions'] == versions:
+                return cached
+
+        characters, scenes = self.characters, self.scenes
+        frames = {}
+
+        def render(position):
+            frame = frames.get(position)
+            if frame is None:
+                frame = fingerprints.rewrite(scenario_engine.render_frame(
+                    scenario_id, compiled, position, characters, scenes,
+                    voice_exists=lambda url: assets_index.get(url) is not None))
+                with self._lock:
+                    frames[position] = frame
+                    self.stats['frames_rendered'] += 1
+            return frame
+
+        cached = {
+            'versions': versions,
+            'compiled': compiled,
+            'index': {dialogue_id: position for position, dialogue_id in enumerate(compiled['ids'])},
+            'render': render,
+        }
+        with self._lock:
+            self._frames[scenario_id] = cached
+        return cached
+
+    def get_voice(self, scenario_id):
+        """The dialogues of a scenario that have a voice file (``{'lines': {dialogue id: asset entry},
+        'version': ...}``), looked up in the asset index once per scenario and index version."""
+        compiled = self.get_compiled_scenario(scenario_id)
+        if compiled is None:
+            return None
+        versions = (compiled['version'], assets_index.version)
+        with self._lock:
+            cached = self._voice.get(scenario_id)
+            if cached and cached['versions'] == versions:
+                return cached
+        lines = voice_sprites.find_lines(scenario_id, compiled['ids'], assets_index.get)
+        cached = {'versions': versions, 'lines': lines, 'version': voice_sprites.lines_version(lines)}
+        with self._lock:
+            self._voice[scenario_id] = cached
+        return cached
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats.update(self.backend.get_stats())
+        return stats
+
+content_dir = os.path.join(os.path.dirname(__file__), config.get('CONTENT_FOLDER', 'content'))
+
+_json_body_cache = OrderedDict()
+_json_body_cache_lock = threading.Lock()
+
+def sorted_items(mapping):
+    """Items in the order jsonify would write them."""
+    return sorted(mapping.items(), key=lambda item: item[0]) if app.json.sort_keys else mapping.items()
+
+def compact_json(value):
+    """Serializes like jsonify outside debug mode."""
+    return app.json.dumps(value, separators=(',', ':'))
+
+def json_object_pieces(items, wrapper_key=None):
+    """``{key: value, ...}`` (inside ``{wrapper_key: ...}`` if given) serialized one item at a time."""
+    dumps = compact_json
+    yield '{' + dumps(wrapper_key) + ':{' if wrapper_key else '{'
+    for position, (key, value) in enumerate(items):
+        yield (',' if position else '') + dumps(key) + ':' + dumps(value)
+    yield '}}\n' if wrapper_key else '}\n'  # jsonify ends with a newline too
+
+def json_array_pieces(values, wrapper_key):
+    """``{wrapper_key: [value, ...]}`` serialized one value at a time."""
+    dumps = compact_json
+    yield '{' + dumps(wrapper_key) + ':['
+    for position, value in enumerate(values):
+        yield (',' if position else '') + dumps(value)
+    yield ']}\n'
+
+def ndjson_pieces(records):
+    for record in records:
+        yield compact_json(record) + '\n'
+
+def wants_ndjson():
+    return request.args.get('format') == 'ndjson'
+
+def stream_response(pieces, mimetype='application/json'):
+    """Sends string pieces in ~64 KiB chunks (chunked transfer encoding, no Content-Length)."""
+    def generate():
+        buffer = []
+        size = 0
+        try:
+            for piece in pieces:
+                data = piece.encode('utf-8')
+                buffer.append(data)
+                size += len(data)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield b''.join(buffer)
+                    buffer = []
+                    size = 0
+            if buffer:
+                yield b''.join(buffer)
+        except Exception as e:
+            # The status line is long gone; aborting the connection is the only way to tell the client
+            print(f"[ERROR] Streaming {request.path} failed: {e}")
+            raise
+
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype)
+
+def cached_json_response(cache_key, version_parts, last_modified_ns, build_data, policy='content',
+                         stream=None, size_hint=0, mimetype='application/json'):
+    """Отдаёт JSON с ETag/Last-Modified и отвечает 304 без сериализации, если клиент актуален.
+
+    ``build_data`` is only called when the serialized body for this version is not cached yet.
+    ``stream`` returns the same document as string pieces; it is used instead (and nothing is
+    cached) when ``size_hint`` reaches JSON_STREAM_THRESHOLD or there is no ``build_data``.
+    """
+    etag = hashlib.sha1('|'.join([cache_key, *map(str, version_parts)]).encode('utf-8')).hexdigest()[:20]
+    last_modified = None
+    if last_modified_ns:
+        last_modified = datetime.fromtimestamp(last_modified_ns // 1_000_000_000, tz=timezone.utc)
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        not_modified = last_modified <= request.if_modified_since
+    else:
+        not_modified = False
 
-content_dir = os.path.join(os.path.dirname(__file__), 'content')
+    if not_modified:
+        metrics.json_cache_requests.inc(result='not_modified')
+        response = app.response_class(status=304)
+    else:
+        with _json_body_cache_lock:
+            body = _json_body_cache.get((cache_key, etag))
+            if body is not None:
+                _json_body_cache.move_to_end((cache_key, etag))
+        if body is None and stream and (build_data is None or size_hint >= JSON_STREAM_THRESHOLD):
+            metrics.json_cache_requests.inc(result='streamed')
+            response = stream_response(stream(), mimetype)
+        else:
+            metrics.json_cache_requests.inc(result='miss' if body is None else 'hit')
+            if body is None:
+                body = jsonify(build_data()).get_data()
+                with _json_body_cache_lock:
+                    _json_body_cache[(cache_key, etag)] = body
+                    while len(_json_body_cache) > JSON_BODY_CACHE_SIZE:
+                        _json_body_cache.popitem(last=False)
+            response = app.response_class(body, mimetype=mimetype)
+
+    response.set_etag(etag)
+    # Last-Modified has one-second resolution: a time in the last second could be followed
+    # by another change in that same second, which If-Modified-Since would then hide
+    if last_modified and time.time_ns() - last_modified_ns >= 1_000_000_000:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = CACHE_CONTROL_POLICIES.get(policy, 'no-cache')
+    return response
+
+# One manager per process, shared by all request threads
+content_backend = content_backends.create_backend(
+    config.get('CONTENT_BACKEND', 'json'),
+    content_dir,
+    os.path.join(os.path.dirname(__file__), config.get('CONTENT_DATABASE', 'content.sqlite3')),
+    batch_window=config.get('CONTENT_WRITE_BATCH_WINDOW', 0.05))
+if snapshot_file:
+    snapshot_file.seed('content', content_backend)
+    snapshot_file.close()
+content_manager = VisualNovelManager(
+    content_dir,
+    check_interval=config.get('CONTENT_CACHE_CHECK_INTERVAL', 1.0),
+    backend=content_backend)
+
+# One watcher per process feeds every /api/events stream
+change_feed = content_events.ChangeFeed(
+    content_manager, assets_index,
+    interval=config.get('CONTENT_WATCH_INTERVAL', 2.0),
+    max_clients=config.get('SSE_MAX_CLIENTS', 32),
+    max_duration=config.get('SSE_MAX_DURATION', 300))
+change_feed.start()
+
+profiler = metrics.RequestProfiler(
+    os.path.join(os.path.dirname(__file__), config.get('PROFILE_FOLDER', 'profiles')),
+    sample_rate=config.get('PROFILE_SAMPLE_RATE', 0.0),
+    threshold_ms=config.get('SLOW_REQUEST_MS', 1000),
+    keep=config.get('PROFILE_KEEP', 50))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.request_profiler = profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latency, bytes, errors and upload sizes per URL rule; see metrics.py."""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = metrics.route_label(request)
+    metrics.http_requests.inc(route=route, method=request.method, status=response.status_code)
+    metrics.http_request_seconds.observe(elapsed, route=route, method=request.method)
+    if response.content_length:
+        metrics.http_response_bytes.inc(response.content_length, route=route)
+    if response.status_code >= 500:
+        metrics.http_errors.inc(route=route, status=response.status_code)
+    if request.mimetype == 'multipart/form-data' or request.endpoint == 'upload_chunk':
+        metrics.upload_bytes.observe(request.content_length or 0, route=route)
+        metrics.upload_seconds.observe(elapsed, route=route)
+    profiler.finish(g.pop('request_profiler', None), route, request.method, elapsed)
+    return response
+
+def record_request_exception(sender, exception, **extra):
+    metrics.http_exceptions.inc(route=metrics.route_label(request), exception=type(exception).__name__)
+
+got_request_exception.connect(record_request_exception, app)
+
+metrics.REGISTRY.counter_callback(
+    'swvne_content_cache_lookups_total', 'Content manager freshness checks by outcome.',
+    lambda: {('hit',): content_manager.stats['hits'], ('miss',): content_manager.stats['misses']}, ('result',))
+metrics.REGISTRY.gauge_callback(
+    'swvne_content_cache_hit_ratio', 'Share of content manager lookups served without re-reading the backend.',
+    lambda: content_manager.get_stats()['hit_ratio'])
+metrics.REGISTRY.gauge_callback(
+    'swvne_content_entities', 'Loaded entities by content type.',
+    lambda: {(content_type,): len(content_manager.meta[content_type])
+             for content_type in content_manager.CONTENT_TYPES}, ('content_type',))
+metrics.REGISTRY.gauge_callback(
+    'swvne_json_cache_entries', 'Serialized JSON bodies held in memory.', lambda: len(_json_body_cache))
+metrics.REGISTRY.gauge_callback(
+    'swvne_assets', 'Indexed assets by type.',
+    lambda: {(asset_type,): count for asset_type, count in assets_index.get_stats()['assets'].items()},
+    ('asset_type',))
+metrics.REGISTRY.gauge_callback(
+    'swvne_sse_clients', 'Open /api/events streams.', lambda: change_feed.get_stats()['clients'])
+
+@app.after_request
+def notify_change_feed(response):
+    """Any successful write wakes the watcher, so editors see it without waiting for the next poll."""
+    if request.method != 'GET' and response.status_code < 400:
+        change_feed.notify()
+    return response
+
+# Built on the first search, then updated per changed scenario or character
+content_search = search_index.SearchIndex()
+
+def get_search_index():
+    content_search.sync(get_content_manager('scenarios', 'characters'))
+    return content_search
+
+saves = save_store.SaveStore(
+    os.path.join(os.path.dirname(__file__), config.get('SAVE_DATABASE', 'saves.sqlite3')),
+    max_slots=config.get('MAX_SAVE_SLOTS', save_store.MAX_SLOTS),
+    max_history=config.get('MAX_SAVE_HISTORY', save_store.MAX_HISTORY),
+    max_entry_bytes=config.get('MAX_SAVE_ENTRY_BYTES', save_store.MAX_ENTRY_BYTES),
+    max_variables_bytes=config.get('MAX_SAVE_VARIABLES_BYTES', save_store.MAX_VARIABLES_BYTES),
+    ttl=config.get('SAVE_TTL', save_store.DEFAULT_TTL))
+
+def get_content_manager(*content_types):
+    """Returns the shared manager with the requested content types up to date."""
+    return content_manager.refresh(content_types or None)
 
 @app.route('/')
 def index():
     scenario_to_start = request.args.get('scenario', None)
-    return render_template('game.html', scenario_to_start=scenario_to_start)
+    # Under asgi.py an open /api/events stream holds no thread, so the game can afford one;
+    # under WSGI every stream holds a server thread and the game keeps revalidating instead
+    live_events = 'asgi.scope' in request.environ
+    return render_template('game.html', scenario_to_start=scenario_to_start, live_events=live_events)
 
 @app.route('/admin')
 def admin_login():
@@ -154,20 +671,73 @@ def api_login():
     except Exception as e:
         return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
 
+def content_map_response(content_type):
+    """All entities of a type as ``{id: entity}``, or one ``{type, id, data}`` line each with
+    ``?format=ndjson``; large maps are streamed entity by entity."""
+    manager = get_content_manager(content_type)
+    entities = getattr(manager, content_type)  # swapped, never mutated, on reload
+    version_parts = [manager.versions[content_type]]
+    if wants_ndjson():
+        return cached_json_response(
+            f'content:{content_type}:ndjson', version_parts, manager.modified_at[content_type], None,
+            stream=lambda: ndjson_pieces({'type': content_type, 'id': entity_id, 'data': value}
+                                         for entity_id, value in entities.items()),
+            mimetype=NDJSON_MIMETYPE)
+    return cached_json_response(
+        f'content:{content_type}', version_parts, manager.modified_at[content_type], lambda: entities,
+        stream=lambda: json_object_pieces(sorted_items(entities)),
+        size_hint=sum(meta['size'] for meta in manager.meta[content_type].values()))
+
 @app.route('/api/content/characters')
 def get_characters():
-    manager = VisualNovelManager(content_dir)
-    return jsonify(manager.characters)
+    return content_map_response('characters')
 
 @app.route('/api/content/scenes')
 def get_scenes():
-    manager = VisualNovelManager(content_dir)
-    return jsonify(manager.scenes)
+    return content_map_response('scenes')
 
 @app.route('/api/content/scenarios')
 def get_scenarios():
-    manager = VisualNovelManager(content_dir)
-    return jsonify(manager.scenarios)
+    return content_map_response('scenarios')
+
+@app.route('/api/content/<content_type>/<entity_id>')
+def get_content_entity(content_type, entity_id):
+    """One character, scene or scenario, for clients that got a change event."""
+    if content_type not in ('characters', 'scenes', 'scenarios'):
+        return jsonify({'error': 'Неизвестный тип контента'}), 400
+    manager = get_content_manager(content_type)
+    entity = getattr(manager, content_type).get(entity_id)
+    if entity is None:
+        return jsonify({'error': 'Не найдено'}), 404
+    version = manager.meta[content_type].get(entity_id, {}).get('version', '')
+    return cached_json_response(f'content:{content_type}:{entity_id}', [version], manager.modified_at[content_type],
+                                lambda: {'id': entity_id, 'version': version, content_type: {entity_id: entity}})
+
+@app.route('/api/events')
+def content_events_stream():
+    """Server-Sent Events: one ``change`` event ({type, id, version}) per changed entity.
+
+    ``?types=`` limits the stream to some of characters, scenes, scenarios,
+    voices and assets; ``version`` is null for deleted entities. Streams end
+    after SSE_MAX_DURATION and the browser reconnects with Last-Event-ID.
+    Each open stream holds a server thread here; asgi.py serves this route on
+    its event loop instead (see content_events).
+    """
+    if not change_feed.acquire_client():
+        response = jsonify({'error': 'Слишком много подключений'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    types, last_event_id = content_events.stream_params(
+        request.args.get('types'), request.headers.get('Last-Event-ID', request.args.get('last_event_id')))
+
+    response = app.response_class(change_feed.stream(last_event_id, types), mimetype='text/event-stream')
+    # Runs whether or not the body was ever iterated
+    response.call_on_close(change_feed.release_client)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 def handle_upload(content_type):
     if not check_admin():
@@ -181,12 +751,13 @@ def handle_upload(content_type):
         return jsonify({'success': False, 'error': 'Недопустимый файл'})
 
     filename = secure_filename(file.filename)
-    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], content_type)
-    if not os.path.exists(upload_path):
-        os.makedirs(upload_path)
-
-    filepath = os.path.join(upload_path, filename)
-    file.save(filepath)
+    try:
+        # A file with the same name replaces the entities it brought in earlier
+        content_manager.backend.import_file(content_type, filename, file)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Недопустимый файл'})
+    finally:
+        content_manager.invalidate(content_type)
 
     return jsonify({'success': True, 'message': f'{content_type.capitalize()} загружены успешно'})
 
@@ -203,43 +774,335 @@ def admin_upload_scenarios():
     return handle_upload('scenarios')
 
 
+IMPORT_STAGING_DIR = os.path.join(os.path.dirname(__file__), '.import-staging')
+
+@app.route('/api/admin/content/import', methods=['POST'])
+def admin_import_bundle():
+    """Bulk import of a zip bundle (``bundle``) and/or many files (``files``), see content_import.
+
+    Nothing is written unless every file passes validation; ``?dry_run=1``
+    only validates. Reports the outcome of every file and the time spent.
+    """
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+
+    bundle = request.files.get('bundle')
+    uploads = request.files.getlist('files')
+    if not bundle and not uploads:
+        return jsonify({'success': False, 'error': 'Файлы не найдены'}), 400
+    dry_run = request.args.get('dry_run') in ('1', 'true')
+
+    manager = get_content_manager()
+    existing_ids = {content_type: list(getattr(manager, content_type)) for content_type in manager.CONTENT_TYPES}
+    committed = []
+    try:
+        with content_import.BundleImport(
+                content_manager.backend, app.static_folder, IMPORT_STAGING_DIR,
+                workers=config.get('IMPORT_WORKERS'),
+                max_files=config.get('IMPORT_MAX_FILES', content_import.MAX_FILES),
+                max_bytes=config.get('IMPORT_MAX_BYTES', content_import.MAX_BYTES)) as bundle_import:
+            try:
+                if bundle:
+                    bundle_import.add_zip(bundle.stream)
+                for upload in uploads:
+                    if upload.filename.lower().endswith('.zip'):
+                        bundle_import.add_zip(upload.stream)
+                    else:
+                        bundle_import.add_file(upload.filename, upload.stream)
+            except zipfile.BadZipFile:
+                return jsonify({'success': False, 'error': 'Повреждённый zip-архив'}), 400
+            except content_import.BundleTooLarge:
+                return jsonify({'success': False, 'error': 'Слишком много файлов или слишком большой архив'}), 413
+
+            valid = bundle_import.validate(existing_ids)
+            if valid and not dry_run:
+                committed = bundle_import.commit()
+            report = bundle_import.report()
+    except Exception as e:
+        print(f"[ERROR] Content import failed: {e}")
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
+    finally:
+        for content_type in {result['type'] for result in committed if result['kind'] == 'content'}:
+            content_manager.invalidate(content_type)
+
+    # Same follow-up work as the single-file uploads
+    for result in committed:
+        if result['kind'] != 'asset':
+            continue
+        url = result['target']
+        fingerprints.update(url)
+        assets_index.update(url)
+        if result['type'] in image_pipeline.SOURCE_FOLDERS:
+            schedule_image_derivatives(result['path'], url)
+        else:
+            audio_jobs.enqueue(result['path'], url, result['type'].split('/')[-1])
+
+    if not valid:
+        return jsonify({'success': False, 'error': 'Импорт отменён: в файлах есть ошибки', 'committed': False,
+                        **report}), 400
+    message = 'Проверка пройдена' if dry_run else f'Импортировано файлов: {len(committed)}'
+    return jsonify({'success': True, 'message': message, 'committed': not dry_run, **report})
+
 @app.route('/api/admin/content/export/<content_type>')
 def admin_export_content(content_type):
+    """The whole content type, streamed entity by entity; ``?format=ndjson`` gives one
+    ``{type, id, data}`` line per entity for tools that process it incrementally."""
     if not check_admin():
         return jsonify({'error': 'Доступ запрещен'}), 403
 
-    manager = VisualNovelManager(content_dir)
-
     try:
-        if content_type == 'characters':
-            data = {'characters': manager.characters}
-        elif content_type == 'scenes':
-            data = {'scenes': manager.scenes}
-        elif content_type == 'scenarios':
-            data = {'scenarios': manager.scenarios}
-        else:
+        if content_type not in ('characters', 'scenes', 'scenarios'):
             return jsonify({'error': 'Неизвестный тип контента'}), 400
 
-        return jsonify(data)
+        entities = getattr(get_content_manager(content_type), content_type)
+        if wants_ndjson():
+            return stream_response(ndjson_pieces({'type': content_type, 'id': entity_id, 'data': value}
+                                                 for entity_id, value in entities.items()), NDJSON_MIMETYPE)
+        return stream_response(json_object_pieces(sorted_items(entities), wrapper_key=content_type))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/content/bundle/<scenario_id>')
+def admin_export_bundle(scenario_id):
+    """Zip of a scenario with everything it references, see scenario_bundle.
+
+    ``?image_format=webp|avif|original`` and ``?max_width=`` pick the image
+    variants. The same content always yields the same file, named after its hash;
+    it is also reachable under /static/derivatives/bundles/ (X-Bundle-Url).
+    """
+    if not check_admin():
+        return jsonify({'error': 'Доступ запрещен'}), 403
+
+    try:
+        image_format = request.args.get('image_format', 'webp')
+        max_width = request.args.get('max_width', scenario_bundle.DEFAULT_MAX_WIDTH, type=int)
+        if image_format not in scenario_bundle.IMAGE_FORMATS or not max_width or max_width <= 0:
+            return jsonify({'error': 'Неверные параметры'}), 400
+
+        manager = get_content_manager('scenarios', 'characters', 'scenes')
+        if scenario_id not in manager.scenarios:
+            return jsonify({'error': 'Сценарий не найден'}), 404
+
+        bundle_dir = os.path.join(app.static_folder, image_pipeline.DERIVATIVES_FOLDER, scenario_bundle.BUNDLES_FOLDER)
+        path, digest = scenario_bundle.build_bundle(
+            app.static_folder, bundle_dir, scenario_id, manager.scenarios[scenario_id],
+            manager.characters, manager.scenes, image_format=image_format, max_width=max_width)
+
+        filename = os.path.basename(path)
+        response = send_from_directory(bundle_dir, filename, as_attachment=True, download_name=filename,
+                                       etag=digest[:20], max_age=0)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Bundle-Url'] = (f'/static/{image_pipeline.DERIVATIVES_FOLDER}/'
+                                            f'{scenario_bundle.BUNDLES_FOLDER}/{filename}')
+        return response
+    except Exception as e:
+        print(f"[ERROR] Failed to build bundle for {scenario_id}: {e}")
+        return jsonify({'error': 'Ошибка сервера'}), 500
+
+@app.route('/api/admin/content/cache-stats')
+def admin_content_cache_stats():
+    """Hit/miss counters of the shared content cache."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    return jsonify({'success': True, 'backend': content_manager.backend.name, 'stats': content_manager.get_stats(),
+                    'assets': assets_index.get_stats(), 'events': change_feed.get_stats(),
+                    'snapshot': snapshot_file.get_stats() if snapshot_file else None,
+                    'search': content_search.get_stats(), 'uploads': uploads.get_stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Metrics in the Prometheus text format, for an admin session or ``Authorization: Bearer <METRICS_TOKEN>``."""
+    token = config.get('METRICS_TOKEN')
+    authorized = check_admin() or bool(token) and hmac.compare_digest(
+        request.headers.get('Authorization', '').encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+    if not authorized:
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    response = app.response_class(metrics.REGISTRY.render(), mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/admin/audio/jobs')
+def admin_audio_jobs():
+    """Состояние очереди перекодирования аудио."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    return jsonify({'success': True, 'stats': audio_jobs.get_stats(), 'jobs': audio_jobs.list_jobs(100)})
+
+@app.route('/api/admin/audio/transcode', methods=['POST'])
+def admin_audio_transcode():
+    """Queues every voice, BGM and SFX file that has no up-to-date Opus version."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    if not audio_jobs.is_available():
+        return jsonify({'success': False, 'error': 'Аудиокодер не найден'}), 503
+
+    manifest = audio_pipeline.load_manifest(app.static_folder)
+    job_ids = []
+    for path, source_url, kind in audio_pipeline.find_sources(app.static_folder):
+        entry = manifest['audio'].get(source_url)
+        if entry and entry['hash'] == audio_pipeline.file_hash(path):
+            continue
+        job_ids.append(audio_jobs.enqueue(path, source_url, kind))
+    return jsonify({'success': True, 'queued': len(job_ids), 'jobs': job_ids})
+
+@app.route('/api/admin/audio/voice-sprites', methods=['POST'])
+def admin_voice_sprites():
+    """Queues a voice sprite build for every scenario (or ``{"scenarios": [...]}``) whose
+    voice lines changed since its sprite was built."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещен'}), 403
+    data = request.get_json(silent=True) or {}
+    manager = get_content_manager('scenarios')
+    scenario_ids = data.get('scenarios') or sorted(manager.scenarios)
+    if not isinstance(scenario_ids, list) or any(scenario_id not in manager.scenarios for scenario_id in scenario_ids):
+        return jsonify({'success': False, 'error': 'Сценарий не найден'}), 404
+
+    assets_index.scan()
+    job_ids = []
+    for scenario_id in scenario_ids:
+        voice = manager.get_voice(scenario_id)
+        sprite = voice_sprite_manifest.get(scenario_id)
+        built = sprite['version'] if sprite else voice_sprites.lines_version({})
+        if built == voice['version']:  # up to date, or no voice lines and no sprite
+            continue
+        job_ids.append(audio_jobs.enqueue_task(
+            scenario_id, 'voice_sprite',
+            lambda scenario_id=scenario_id, lines=voice['lines']: voice_sprites.build_sprite(
+                app.static_folder, scenario_id, lines, audio_jobs.encoder, audio_jobs.bitrates['voice'],
+                audio_jobs.loudness)))
+    return jsonify({'success': True, 'queued': len(job_ids), 'jobs': job_ids})
+
+def get_player_id(create=False):
+    """Opaque id that links the session to its save slots."""
+    player_id = session.get('save_id')
+    if player_id is None and create:
+        player_id = save_store.new_player_id()
+        session['save_id'] = player_id
+        # Saves outlive the browser session
+        session.permanent = True
+    return player_id
+
+def migrate_session_save():
+    """Moves a save made before the server-side store out of the session cookie."""
+    saved_game = session.pop('saved_game', None)
+    if isinstance(saved_game, dict):
+        saves.save(get_player_id(create=True), save_store.DEFAULT_SLOT,
+                   saved_game.get('currentScenario'), saved_game.get('currentDialogue'),
+                   saved_game.get('variables') or {}, saved_game.get('history') or [])
+
+MAX_STEP_VARIABLES = 1000
+
+@app.route('/api/game/step', methods=['POST'])
+def game_step():
+    """Runs one step of a scenario on the server.
+
+    Takes ``{scenario, node, variables, choice}``: the dialogue on screen (null to
+    start), the player's variables and the index of the chosen option (null to
+    click through). Returns the next frame (text, speaker, sprites with pose URLs,
+    background, audio and the choices available) and the updated variables;
+    ``frame`` is null and ``end`` true when the scenario is over.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('scenario'), str):
+        return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
+    node = data.get('node')
+    variables = data.get('variables') or {}
+    choice = data.get('choice')
+    if node is not None and not isinstance(node, str) or not isinstance(variables, dict) or \
+            len(variables) > MAX_STEP_VARIABLES or \
+            choice is not None and (not isinstance(choice, int) or isinstance(choice, bool)):
+        return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
+
+    try:
+        manager = get_content_manager('scenarios', 'characters', 'scenes')
+        frames = manager.get_frames(data['scenario'])
+        if frames is None:
+            return jsonify({'success': False, 'error': 'Сценарий не найден'}), 404
+        position = None
+        if node is not None:
+            position = frames['index'].get(node)
+            if position is None:
+                return jsonify({'success': False, 'error': 'Диалог не найден'}), 404
+
+        frame, variables = scenario_engine.step(frames['compiled'], position, variables, choice, frames['render'])
+        return jsonify({'success': True, 'frame': frame, 'variables': variables, 'end': frame is None})
+
+    except scenario_engine.StepError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"[ERROR] Game step failed in {data['scenario']}: {e}")
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
+
 @app.route('/api/game/save', methods=['POST'])
 def save_game():
-    session['saved_game'] = request.json
-    return jsonify({'success': True, 'message': 'Игра сохранена в сессии'})
+    """Saves the game into a slot.
+
+    ``history`` holds only the entries after ``history_base``, which together
+    with ``base_revision`` comes from the previous save or load response.
+    A 409 with ``resync`` asks the client to send the full history.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
+
+    slot = data.get('slot') or save_store.DEFAULT_SLOT
+    if not save_store.is_valid_slot(slot):
+        return jsonify({'success': False, 'error': 'Недопустимое имя слота'}), 400
+
+    history = data.get('history') or []
+    variables = data.get('variables') or {}
+    history_base = data.get('history_base', 0)
+    if not isinstance(history, list) or not isinstance(variables, dict) or not isinstance(history_base, int) \
+            or isinstance(history_base, bool) or history_base < 0:
+        return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
+
+    migrate_session_save()
+    try:
+        result = saves.save(get_player_id(create=True), slot, data.get('currentScenario'), data.get('currentDialogue'),
+                            variables, history, history_base, data.get('base_revision'))
+    except save_store.StaleBase:
+        return jsonify({'success': False, 'error': 'Сохранение устарело', 'resync': True}), 409
+    except save_store.TooManySlots:
+        return jsonify({'success': False, 'error': f'Не больше {saves.max_slots} слотов сохранения'}), 400
+    except save_store.SaveTooLarge:
+        return jsonify({'success': False, 'error': 'Сохранение слишком большое'}), 413
+
+    return jsonify({'success': True, 'message': 'Игра сохранена', **result})
 
 @app.route('/api/game/load', methods=['GET'])
 def load_game():
-    saved_game = session.get('saved_game', {})
+    """Loads ``?slot=`` or, without it, the most recently saved slot."""
+    slot = request.args.get('slot')
+    if slot is not None and not save_store.is_valid_slot(slot):
+        return jsonify({'success': False, 'error': 'Недопустимое имя слота'}), 400
+
+    migrate_session_save()
+    player_id = get_player_id()
+    saved_game = saves.load(player_id, slot) if player_id else None
     if not saved_game:
         return jsonify({'currentDialogue': 'start', 'variables': {}, 'history': [], 'currentScenario': None})
     return jsonify(saved_game)
 
+@app.route('/api/game/slots', methods=['GET'])
+def list_save_slots():
+    migrate_session_save()
+    player_id = get_player_id()
+    return jsonify({'success': True, 'slots': saves.list_slots(player_id) if player_id else []})
+
+@app.route('/api/game/slots/<slot>', methods=['DELETE'])
+def delete_save_slot(slot):
+    if not save_store.is_valid_slot(slot):
+        return jsonify({'success': False, 'error': 'Недопустимое имя слота'}), 400
+    player_id = get_player_id()
+    if not player_id or not saves.delete(player_id, slot):
+        return jsonify({'success': False, 'error': 'Слот не найден'}), 404
+    return jsonify({'success': True, 'message': 'Сохранение удалено'})
+
 @app.route('/scenario-creator')
 def scenario_creator():
     """Отдает страницу визуального редактора сценариев."""
-    manager = VisualNovelManager(content_dir)
+    manager = get_content_manager('characters', 'scenes')
 
     characters_data = manager.characters
     scenes_data = manager.scenes
@@ -272,6 +1135,9 @@ def save_scenario():
         if not scenario_data or 'scenarios' not in scenario_data:
             return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
 
+        # Version of the scenario the editor loaded; absent for old clients (no check)
+        expected_version = scenario_data.pop('expected_version', None)
+
         scenario_id = list(scenario_data['scenarios'].keys())[0]
         if not scenario_id:
             return jsonify({'success': False, 'error': 'ID сценария не найден'}), 400
@@ -280,68 +1146,281 @@ def save_scenario():
         if not scenario_id.replace('_', '').replace('-', '').isalnum() or len(scenario_id) > 50:
             return jsonify({'success': False, 'error': 'Недопустимые символы в ID сценария'}), 400
 
+        scenario_body = scenario_data['scenarios'][scenario_id]
+        if not isinstance(scenario_body, dict) or not isinstance(scenario_body.get('dialogues', {}), dict):
+            return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
+
         # SECURITY: Use secure_filename for additional protection
         safe_scenario_id = secure_filename(scenario_id)
         if not safe_scenario_id:
             return jsonify({'success': False, 'error': 'Недопустимый ID сценария'}), 400
 
-        scenarios_dir = os.path.join(content_dir, 'scenarios')
-        if not os.path.exists(scenarios_dir):
-            os.makedirs(scenarios_dir)
-        file_path = os.path.join(scenarios_dir, f'{safe_scenario_id}.json')
+        try:
+            version = content_manager.put_entity('scenarios', scenario_id, scenario_body, expected_version)
+        except content_store.VersionConflict as conflict:
+            return conflict_response(conflict)
 
-        # SECURITY: Validate that the path is within the expected directory
-        if not os.path.abspath(file_path).startswith(os.path.abspath(scenarios_dir)):
-            return jsonify({'success': False, 'error': 'Недопустимый путь к файлу'}), 400
+        # Compile right away so broken links show up in the editor instead of at play time
+        compiled = scenario_graph.compile_scenario(scenario_id, scenario_body)
 
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(scenario_data, f, ensure_ascii=False, indent=2)
-
-        return jsonify({'success': True, 'message': f'Сценарий "{safe_scenario_id}" сохранен успешно'})
+        return jsonify({
+            'success': True,
+            'message': f'Сценарий "{safe_scenario_id}" сохранен успешно',
+            'version': version,
+            'warnings': scenario_graph.summarize_issues(compiled),
+            'stats': compiled['stats']
+        })
 
     except Exception as e:
         return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
 
 @app.route('/api/scenarios/list')
 def list_scenarios():
-    """Get list of available scenarios."""
+    """Get list of available scenarios.
+
+    Optional query parameters: ``q`` (full-text search over titles, descriptions,
+    authors and dialogue, best matches first), ``page``/``per_page`` and
+    ``format=ndjson`` (one summary per line, ignores the others).
+    """
     try:
-        manager = VisualNovelManager(content_dir)
-        scenarios_list = []
-
-        for scenario_id, scenario_data in manager.scenarios.items():
-            scenarios_list.append({
-                'id': scenario_id,
-                'title': scenario_data.get('title', scenario_id),
-                'description': scenario_data.get('description', ''),
-                'author': scenario_data.get('author', ''),
-            })
+        manager = get_content_manager('scenarios')
+        scenarios = manager.scenarios
+
+        def summaries(scenario_ids=None):
+            for scenario_id in scenarios if scenario_ids is None else scenario_ids:
+                scenario_data = scenarios[scenario_id]
+                yield {
+                    'id': scenario_id,
+                    'title': scenario_data.get('title', scenario_id),
+                    'description': scenario_data.get('description', ''),
+                    'author': scenario_data.get('author', ''),
+                }
+
+        if wants_ndjson():
+            return cached_json_response('scenarios:list:ndjson', [manager.versions['scenarios']],
+                                        manager.modified_at['scenarios'], None, policy='listing',
+                                        stream=lambda: ndjson_pieces(summaries()), mimetype=NDJSON_MIMETYPE)
+
+        search = request.args.get('q', '').strip()
+        per_page = request.args.get('per_page', type=int)
+        page = max(1, request.args.get('page', 1, type=int))
+        if search or per_page is not None:
+            per_page = max(1, min(per_page or 50, MAX_SCENARIOS_PER_PAGE))
+
+            def build():
+                if search:
+                    hits, _, complete = get_search_index().search(
+                        search, hit_types=('scenarios', 'dialogues'), limit=None, max_matches=None)
+                    scenario_ids = list(dict.fromkeys(owner for _, _, _, owner, _ in hits if owner in scenarios))
+                else:
+                    scenario_ids, complete = list(scenarios), True
+                return {
+                    'scenarios': list(summaries(scenario_ids[(page - 1) * per_page:page * per_page])),
+                    'total': len(scenario_ids),
+                    'total_exact': complete,
+                    'page': page,
+                    'per_page': per_page,
+                }
+
+            query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items()))
+            return cached_json_response(f'scenarios:list:{query}', [manager.versions['scenarios']],
+                                        manager.modified_at['scenarios'], build, policy='listing')
 
-        return jsonify({'scenarios': scenarios_list})
+        size_hint = sum(len(scenario_id) + len(str(scenario_data.get('title', ''))) +
+                        len(str(scenario_data.get('description', ''))) + 64
+                        for scenario_id, scenario_data in scenarios.items())
+        return cached_json_response('scenarios:list', [manager.versions['scenarios']],
+                                    manager.modified_at['scenarios'], lambda: {'scenarios': list(summaries())},
+                                    policy='listing', stream=lambda: json_array_pieces(summaries(), 'scenarios'),
+                                    size_hint=size_hint)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/search')
+def search_content():
+    """Full-text search for the editors: ranked, paged hits with scenario and dialogue ids.
+
+    Query parameters: ``q``, ``type`` (comma-separated scenarios/dialogues/characters,
+    default all), ``scenario`` (only hits inside one scenario) and ``page``/``per_page``.
+    """
+    try:
+        search = request.args.get('q', '').strip()
+        if not search:
+            return jsonify({'success': False, 'error': 'Пустой запрос'}), 400
+        hit_types = [hit_type for hit_type in request.args.get('type', '').split(',')
+                     if hit_type in search_index.HIT_TYPES] or None
+        scenario_id = request.args.get('scenario') or None
+        per_page = max(1, min(request.args.get('per_page', 20, type=int), MAX_SEARCH_PER_PAGE))
+        page = max(1, request.args.get('page', 1, type=int))
+
+        manager = get_content_manager('scenarios', 'characters')
+
+        def build():
+            started = time.perf_counter()
+            hits, total, complete = get_search_index().search(
+                search, hit_types, scenario_id, offset=(page - 1) * per_page, limit=per_page)
+            results = []
+            for _, score, kind, owner, dialogue_id in hits:
+                field = search_index.KIND_NAMES[kind]
+                if kind == search_index.KIND_CHARACTER:
+                    character = manager.characters.get(owner, {})
+                    results.append({'type': 'character', 'character': owner, 'field': 'name', 'score': round(score, 3),
+                                    'snippet': character.get('name', owner)})
+                    continue
+                scenario = manager.scenarios.get(owner, {})
+                hit = {'type': 'dialogue' if dialogue_id else 'scenario', 'scenario': owner,
+                       'scenario_title': scenario.get('title', owner), 'field': field, 'score': round(score, 3)}
+                if dialogue_id:
+                    dialogue = (scenario.get('dialogues') or {}).get(dialogue_id) or {}
+                    hit['dialogue'] = dialogue_id
+                    hit['snippet'] = search_index.snippet(search_index.dialogue_text(dialogue), search)
+                else:
+                    hit['snippet'] = search_index.snippet(scenario.get(field, ''), search)
+                results.append(hit)
+            return {'success': True, 'query': search, 'hits': results, 'total': total, 'total_exact': complete,
+                    'page': page, 'per_page': per_page, 'took_ms': round((time.perf_counter() - started) * 1000, 3)}
+
+        query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items()))
+        return cached_json_response(f'search:{query}', [manager.versions['scenarios'], manager.versions['characters']],
+                                    max(manager.modified_at['scenarios'], manager.modified_at['characters']),
+                                    build, policy='listing')
+
+    except Exception as e:
+        print(f"[ERROR] Search failed: {e}")
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
+
+@app.route('/api/scenarios/index')
+def scenarios_index():
+    """Lightweight scenario index for the game menu (no dialogues)."""
+    try:
+        manager = get_content_manager('scenarios')
+        scenarios_meta = manager.meta['scenarios']
+
+        def build():
+            scenarios_list = []
+            for scenario_id, scenario_data in manager.scenarios.items():
+                meta = scenarios_meta.get(scenario_id, {})
+                scenarios_list.append({
+                    'id': scenario_id,
+                    'title': scenario_data.get('title', scenario_id),
+                    'description': scenario_data.get('description', ''),
+                    'author': scenario_data.get('author', ''),
+                    'size': meta.get('size', 0),
+                    'version': meta.get('version', ''),
+                })
+            return {'scenarios': scenarios_list}
+
+        return cached_json_response('scenarios:index', [manager.versions['scenarios']],
+                                    manager.modified_at['scenarios'], build, policy='listing')
+
+    except Exception as e:
+        return jsonify({'error': 'Ошибка сервера'}), 500
+
 @app.route('/api/scenarios/load/<scenario_id>')
 def load_scenario(scenario_id):
-    """Load specific scenario data."""
+    """Load specific scenario data.
+
+    With ``?include=refs`` the response also carries only the characters and
+    scenes that the scenario references, so the game can start it right away,
+    and ``voice``: the dialogues that have a voice line and, once built, the
+    scenario's voice sprite (see voice_sprites).
+    ``?format=compiled`` replaces the raw dialogues with the indexed graph
+    from scenario_graph (pre-parsed conditions, integer edges).
+    """
     try:
         # SECURITY: Validate scenario_id to prevent path traversal
         if not scenario_id.replace('_', '').replace('-', '').isalnum() or len(scenario_id) > 50:
             return jsonify({'error': 'Недопустимые символы в ID сценария'}), 400
 
-        manager = VisualNovelManager(content_dir)
+        include_refs = request.args.get('include') == 'refs'
+        compiled = request.args.get('format') == 'compiled'
+        if include_refs:
+            manager = get_content_manager('scenarios', 'characters', 'scenes')
+        else:
+            manager = get_content_manager('scenarios')
 
         if scenario_id not in manager.scenarios:
             return jsonify({'error': 'Сценарий не найден'}), 404
 
-        scenario_data = {
-            'scenarios': {
-                scenario_id: manager.scenarios[scenario_id]
+        scenario = manager.scenarios[scenario_id]
+        scenario_version = manager.meta['scenarios'].get(scenario_id, {}).get('version', '')
+        voice = sprite = None
+        if include_refs:
+            voice = manager.get_voice(scenario_id)
+            sprite = voice_sprite_manifest.get(scenario_id)
+            # A sprite built from other voice files than the current ones is not used
+            if sprite and sprite['version'] != voice['version']:
+                sprite = None
+
+        def build():
+            scenario_data = {
+                'scenarios': {
+                    scenario_id: manager.get_compiled_scenario(scenario_id) if compiled else scenario
+                },
+                # Editors send it back on save to detect concurrent edits
+                'version': scenario_version
             }
-        }
 
-        return jsonify(scenario_data)
+            if include_refs:
+                character_ids, scene_ids = scenario_graph.collect_refs(scenario)
+                scenario_data['characters'] = {
+                    char_id: manager.characters[char_id] for char_id in sorted(character_ids) if char_id in manager.characters
+                }
+                scenario_data['scenes'] = {
+                    scene_id: manager.scenes[scene_id] for scene_id in sorted(scene_ids) if scene_id in manager.scenes
+                }
+                scenario_data['voice'] = {'lines': list(voice['lines']), 'sprite': sprite and {
+                    'lines': sprite['lines'],
+                    'variants': [{key: variant[key] for key in ('url', 'format', 'codec', 'size', 'duration')}
+                                 for variant in sprite['variants']],
+                }}
+                # Only the game asks for refs, so only its copy gets fingerprinted URLs;
+                # editors keep the plain paths they save back
+                scenario_data = fingerprints.rewrite(scenario_data)
+            return scenario_data
+
+        version_parts = [scenario_id, scenario_version]
+        last_modified = manager.modified_at['scenarios']
+        if compiled:
+            version_parts += ['compiled', scenario_graph.GRAPH_FORMAT_VERSION]
+        if include_refs:
+            version_parts += ['refs', manager.versions['characters'], manager.versions['scenes'], fingerprints.version,
+                              voice['version'], sprite['variants'][0]['url'] if sprite else '-']
+            last_modified = max(last_modified, manager.modified_at['characters'], manager.modified_at['scenes'],
+                                fingerprints.modified_at, assets_index.modified_at, voice_sprite_manifest.modified_at)
+
+        return cached_json_response(f'scenarios:load:{scenario_id}', version_parts, last_modified, build)
+
+    except Exception as e:
+        return jsonify({'error': 'Ошибка сервера'}), 500
+
+@app.route('/api/scenarios/lookahead/<scenario_id>')
+def scenario_asset_lookahead(scenario_id):
+    """Assets reachable within ``?steps=K`` dialogues from every node, for client prefetch.
+
+    ``assets`` is a table of {url, size}; ``nodes`` maps each dialogue id to
+    [asset index, distance] pairs, nearest first.
+    """
+    try:
+        # SECURITY: Validate scenario_id to prevent path traversal
+        if not scenario_id.replace('_', '').replace('-', '').isalnum() or len(scenario_id) > 50:
+            return jsonify({'error': 'Недопустимые символы в ID сценария'}), 400
+
+        steps = max(1, min(request.args.get('steps', 3, type=int), MAX_LOOKAHEAD_STEPS))
+        manager = get_content_manager('scenarios', 'characters', 'scenes')
+
+        if scenario_id not in manager.scenarios:
+            return jsonify({'error': 'Сценарий не найден'}), 404
+
+        manifest = manager.get_asset_lookahead(scenario_id, steps)
+        return cached_json_response(
+            f'scenarios:lookahead:{scenario_id}:{steps}',
+            [manifest['version'], manager.versions['characters'], manager.versions['scenes'], fingerprints.version,
+             manifest['voice_version']],
+            max(manager.modified_at['scenarios'], manager.modified_at['characters'], manager.modified_at['scenes'],
+                fingerprints.modified_at, assets_index.modified_at),
+            lambda: fingerprints.rewrite(manifest))
 
     except Exception as e:
         return jsonify({'error': 'Ошибка сервера'}), 500
@@ -359,6 +1438,10 @@ def save_character():
         if not character_data:
             return jsonify({'success': False, 'error': 'Неверные данные персонажа'}), 400
 
+        # expected_version guards one entity, so one character is saved per request
+        if len(character_data) > 1:
+            return jsonify({'success': False, 'error': 'За один запрос сохраняется один персонаж'}), 400
+
         character_id = list(character_data.keys())[0]
         if not character_id:
             return jsonify({'success': False, 'error': 'ID персонажа не найден'}), 400
@@ -367,26 +1450,14 @@ def save_character():
         if not character_id.replace('_', '').replace('-', '').isalnum() or len(character_id) > 50:
             return jsonify({'success': False, 'error': 'Недопустимые символы в ID персонажа'}), 400
 
-        # Create characters directory if it doesn't exist
-        characters_dir = os.path.join(content_dir, 'characters')
-        if not os.path.exists(characters_dir):
-            os.makedirs(characters_dir)
-
-        # Load existing characters
-        chars_file = os.path.join(characters_dir, 'chars.json')
-        existing_data = {'characters': {}}
-        if os.path.exists(chars_file):
-            with open(chars_file, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-
-        # Update with new character
-        existing_data['characters'].update(character_data)
+        expected_version = request.json.get('expected_version')
+        try:
+            version = content_manager.put_entity('characters', character_id, character_data[character_id],
+                                                 expected_version)
+        except content_store.VersionConflict as conflict:
+            return conflict_response(conflict)
 
-        # Save to characters file
-        with open(chars_file, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
-
-        return jsonify({'success': True, 'message': f'Персонаж "{character_id}" сохранён успешно'})
+        return jsonify({'success': True, 'message': f'Персонаж "{character_id}" сохранён успешно', 'version': version})
 
     except Exception as e:
         return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
@@ -403,73 +1474,97 @@ def upload_character_image():
             return jsonify({'success': False, 'error': 'Файл не найден'}), 400
 
         file = request.files['image']
-        character_id = request.form.get('character_id')
-        pose_name = request.form.get('pose_name')
-
-        if not character_id or not pose_name:
-            return jsonify({'success': False, 'error': 'Не указан ID персонажа или название позы'}), 400
-
-        # SECURITY: Validate inputs
-        if not character_id.replace('_', '').replace('-', '').isalnum() or len(character_id) > 50:
-            return jsonify({'success': False, 'error': 'Недопустимые символы в ID персонажа'}), 400
-
-        if not pose_name.replace('_', '').isalnum() or len(pose_name) > 20:
-            return jsonify({'success': False, 'error': 'Недопустимые символы в названии позы'}), 400
-
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'Файл не выбран'}), 400
-
-        # SECURITY: Validate file extension
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'webp'}
-        file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        if file_ext not in allowed_extensions:
-            return jsonify({'success': False, 'error': 'Недопустимый формат файла. Используйте PNG, JPG, JPEG или WEBP'}), 400
-
-        # Create character images directory
-        safe_character_id = secure_filename(character_id)
-        safe_pose_name = secure_filename(pose_name)
-
-        character_dir = os.path.join('static', 'character_images', safe_character_id)
-        os.makedirs(character_dir, exist_ok=True)
-
-        # Save with .png extension for consistency
-        filename = f"{safe_pose_name}.png"
-        filepath = os.path.join(character_dir, filename)
-
-        # SECURITY: Validate that the path is within the expected directory
-        if not os.path.abspath(filepath).startswith(os.path.abspath(character_dir)):
-            return jsonify({'success': False, 'error': 'Недопустимый путь к файлу'}), 400
-
-        file.save(filepath)
-
-        # Return the relative path for the frontend
-        relative_path = f"/static/character_images/{safe_character_id}/{filename}"
-
-        return jsonify({
-            'success': True,
-            'message': 'Изображение загружено успешно',
-            'path': relative_path
-        })
+        target, error = check_character_image_upload(
+            request.form.get('character_id'), request.form.get('pose_name'), file.filename)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        return store_character_image(file, target)
 
     except Exception as e:
         return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
 
+def check_character_image_upload(character_id, pose_name, filename):
+    """Validates a pose image upload; returns ``(target, None)`` or ``(None, error message)``."""
+    if not character_id or not pose_name:
+        return None, 'Не указан ID персонажа или название позы'
+
+    # SECURITY: Validate inputs
+    if not character_id.replace('_', '').replace('-', '').isalnum() or len(character_id) > 50:
+        return None, 'Недопустимые символы в ID персонажа'
+
+    if not pose_name.replace('_', '').isalnum() or len(pose_name) > 20:
+        return None, 'Недопустимые символы в названии позы'
+
+    if not filename:
+        return None, 'Файл не выбран'
+
+    # SECURITY: Validate file extension
+    allowed_extensions = {'png', 'jpg', 'jpeg', 'webp'}
+    file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if file_ext not in allowed_extensions:
+        return None, 'Недопустимый формат файла. Используйте PNG, JPG, JPEG или WEBP'
+
+    safe_character_id = secure_filename(character_id)
+    safe_pose_name = secure_filename(pose_name)
+    character_dir = os.path.join(app.static_folder, 'character_images', safe_character_id)
+
+    # Save with .png extension for consistency
+    filename = f"{safe_pose_name}.png"
+    filepath = os.path.join(character_dir, filename)
+
+    # SECURITY: Validate that the path is within the expected directory
+    if not os.path.abspath(filepath).startswith(os.path.abspath(character_dir)):
+        return None, 'Недопустимый путь к файлу'
+
+    return {
+        'filepath': filepath,
+        'relative_path': f"/static/character_images/{safe_character_id}/{filename}",
+        'file_ext': file_ext,
+    }, None
+
+def store_character_image(file, target):
+    """Saves a validated pose image (anything with ``save()``) and queues its derivatives."""
+    filepath, relative_path = target['filepath'], target['relative_path']
+    content_store.atomic_write_file(filepath, file)
+
+    # The file is always named .png, so make sure it really is one
+    if target['file_ext'] != 'png':
+        try:
+            image_pipeline.normalize_to_png(filepath)
+        except Exception as e:
+            os.remove(filepath)
+            fingerprints.remove(relative_path)
+            return jsonify({'success': False, 'error': 'Не удалось прочитать изображение'}), 400
+    fingerprints.update(relative_path)
+
+    return jsonify({
+        'success': True,
+        'message': 'Изображение загружено успешно',
+        'path': relative_path,
+        'derivatives_queued': schedule_image_derivatives(filepath, relative_path)
+    })
+
 @app.route('/api/characters/list')
 def list_characters():
     """Get list of existing characters."""
     try:
-        manager = VisualNovelManager(content_dir)
-        characters_list = []
-
-        for char_id, char_data in manager.characters.items():
-            characters_list.append({
-                'id': char_id,
-                'name': char_data.get('name', char_id),
-                'color': char_data.get('color', '#000000'),
-                'poses': list(char_data.get('poses', {}).keys()) if 'poses' in char_data else []
-            })
-
-        return jsonify({'characters': characters_list})
+        manager = get_content_manager('characters')
+        characters_meta = manager.meta['characters']
+
+        def build():
+            characters_list = []
+            for char_id, char_data in manager.characters.items():
+                characters_list.append({
+                    'id': char_id,
+                    'name': char_data.get('name', char_id),
+                    'color': char_data.get('color', '#000000'),
+                    'poses': list(char_data.get('poses', {}).keys()) if 'poses' in char_data else [],
+                    'version': characters_meta.get(char_id, {}).get('version', '')
+                })
+            return {'characters': characters_list}
+
+        return cached_json_response('characters:list', [manager.versions['characters']],
+                                    manager.modified_at['characters'], build, policy='listing')
 
     except Exception as e:
         return jsonify({'error': 'Ошибка сервера'}), 500
@@ -482,67 +1577,155 @@ def asset_editor():
 
 @app.route('/api/assets/list')
 def list_assets():
-    """Get list of available assets (BGM, SFX, scenes)."""
+    """Get list of available assets (BGM, SFX, scenes).
+
+    Optional query parameters: ``type`` (comma-separated bgm/sfx/locations),
+    ``q`` (name substring), ``sort`` (name, size or mtime; ``-`` prefix for
+    descending) and ``page``/``per_page``. Without ``per_page`` every asset is returned.
+    """
     try:
-        assets = {
-            'bgm': [],
-            'sfx': [],
-            'locations': []
-        }
+        manager = get_content_manager('scenes')
+
+        types = [asset_type for asset_type in request.args.get('type', 'bgm,sfx,locations').split(',')
+                 if asset_type in asset_index.ASSET_TYPES]
+        search = request.args.get('q', '').strip()
+        sort = request.args.get('sort', 'name')
+        per_page = request.args.get('per_page', type=int)
+        page = max(1, request.args.get('page', 1, type=int))
+        if per_page is not None:
+            per_page = max(1, min(per_page, MAX_ASSETS_PER_PAGE))
+
+        def build():
+            assets = {}
+            totals = {}
+            for asset_type in types:
+                if asset_type == 'locations':
+                    # Locations are the scenes whose background is an uploaded image
+                    scenes_meta = manager.meta['scenes']
+                    entries = []
+                    for location_id, location_info in manager.scenes.items():
+                        background_path = location_info.get('background', '')
+                        if not background_path.startswith('/static/locations/'):
+                            continue
+                        entry = assets_index.get(background_path)
+                        if entry is None:
+                            continue
+                        entry = dict(entry, id=location_id, name=location_info.get('name', location_id),
+                                     filename=entry['name'],
+                                     version=scenes_meta.get(location_id, {}).get('version', ''))
+                        if search and search.lower() not in entry['name'].lower() \
+                                and search.lower() not in entry['filename'].lower():
+                            continue
+                        entries.append(entry)
+                    descending = sort.startswith('-')
+                    field = sort.lstrip('-') if sort.lstrip('-') in asset_index.SORT_FIELDS else 'name'
+                    entries.sort(key=lambda entry: (entry[field], entry['name']), reverse=descending)
+                    total = len(entries)
+                    if per_page:
+                        entries = entries[(page - 1) * per_page:page * per_page]
+                else:
+                    total, entries = assets_index.query(asset_type, search, sort,
+                                                        offset=(page - 1) * per_page if per_page else 0,
+                                                        limit=per_page)
+                assets[asset_type] = [{key: value for key, value in entry.items() if key != 'mtime_ns'}
+                                      for entry in entries]
+                totals[asset_type] = total
+
+            data = {'success': True, 'assets': assets}
+            if per_page:
+                data.update({'total': totals, 'page': page, 'per_page': per_page})
+            return data
+
+        query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items()))
+        return cached_json_response(f'assets:list:{query}', [assets_index.version, manager.versions['scenes']],
+                                    max(manager.modified_at['scenes'], assets_index.modified_at), build,
+                                    policy='listing')
 
-        # Scan BGM files
-        bgm_dir = os.path.join('static', 'audio', 'bgm')
-        if os.path.exists(bgm_dir):
-            for filename in os.listdir(bgm_dir):
-                if filename.lower().endswith(('.mp3', '.ogg', '.wav')):
-                    filepath = os.path.join(bgm_dir, filename)
-                    assets['bgm'].append({
-                        'name': filename,
-                        'path': f'/static/audio/bgm/{filename}',
-                        'size': os.path.getsize(filepath)
-                    })
-
-        # Scan SFX files
-        sfx_dir = os.path.join('static', 'audio', 'sfx')
-        if os.path.exists(sfx_dir):
-            for filename in os.listdir(sfx_dir):
-                if filename.lower().endswith(('.mp3', '.ogg', '.wav')):
-                    filepath = os.path.join(sfx_dir, filename)
-                    assets['sfx'].append({
-                        'name': filename,
-                        'path': f'/static/audio/sfx/{filename}',
-                        'size': os.path.getsize(filepath)
-                    })
-
-        # Load location files from content/scenes/locations.json
-        locations_json_path = os.path.join(content_dir, 'scenes', 'locations.json')
-        if os.path.exists(locations_json_path):
+    except Exception as e:
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
+
+@app.route('/api/assets/variants')
+def list_image_variants():
+    """Image derivatives (format, width, size) and transcoded audio per source URL.
+
+    With ``?scenario=<id>`` only assets that scenario shows or plays are returned.
+    """
+    try:
+        version_parts = []
+        last_modified = 0
+        for path in (image_pipeline.manifest_path(app.static_folder), audio_pipeline.manifest_path(app.static_folder)):
             try:
-                with open(locations_json_path, 'r', encoding='utf-8') as f:
-                    locations_data = json.load(f)
-
-                for location_id, location_info in locations_data.get('scenes', {}).items():
-                    background_path = location_info.get('background', '')
-                    if background_path.startswith('/static/locations/'):
-                        filename = background_path.split('/')[-1]
-                        filepath = os.path.join('static', 'locations', filename)
-
-                        if os.path.exists(filepath):
-                            assets['locations'].append({
-                                'id': location_id,
-                                'name': location_info.get('name', location_id),
-                                'filename': filename,
-                                'path': background_path,
-                                'size': os.path.getsize(filepath)
-                            })
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"Error reading locations.json: {e}")
-
-        return jsonify({'success': True, 'assets': assets})
+                st = os.stat(path)
+            except OSError:
+                version_parts.append('-')
+                continue
+            version_parts.append(f'{st.st_mtime_ns}:{st.st_size}')
+            last_modified = max(last_modified, st.st_mtime_ns)
+
+        scenario_id = request.args.get('scenario')
+        wanted = None
+        if scenario_id:
+            manager = get_content_manager('scenarios', 'characters', 'scenes')
+            compiled = manager.get_compiled_scenario(scenario_id)
+            if compiled is None:
+                return jsonify({'success': False, 'error': 'Сценарий не найден'}), 404
+            node_assets = scenario_graph.collect_node_assets(scenario_id, compiled, manager.characters, manager.scenes,
+                                                             voice_exists=lambda url: True)
+            wanted = {url for urls in node_assets for url in urls}
+            version_parts += [compiled['version'], manager.versions['characters'], manager.versions['scenes']]
+            last_modified = max(last_modified, manager.modified_at['scenarios'], manager.modified_at['characters'],
+                                manager.modified_at['scenes'])
+
+        def build():
+            images = image_pipeline.load_manifest(app.static_folder)['images']
+            audio = audio_pipeline.load_manifest(app.static_folder)['audio']
+            if wanted is not None:
+                images = {url: entry for url, entry in images.items() if url in wanted}
+                audio = {url: entry for url, entry in audio.items() if url in wanted}
+            return fingerprints.rewrite({
+                'success': True,
+                'images': {
+                    url: [{key: variant[key] for key in ('url', 'format', 'width', 'size')} for variant in entry['variants']]
+                    for url, entry in images.items()
+                },
+                'audio': {
+                    url: [{key: variant[key] for key in ('url', 'format', 'codec', 'size', 'duration')} for variant in entry['variants']]
+                    for url, entry in audio.items()
+                },
+            })
+
+        version_parts.append(fingerprints.version)
+        last_modified = max(last_modified, fingerprints.modified_at)
+        return cached_json_response(f'assets:variants:{scenario_id or ""}', version_parts, last_modified, build,
+                                    policy='listing')
 
     except Exception as e:
         return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
 
+@app.route('/assets/<fingerprint>/<path:filename>')
+def fingerprinted_asset(fingerprint, filename):
+    """Serves an asset by content fingerprint with immutable caching.
+
+    Retired fingerprints (file replaced or deleted) redirect to the current
+    URL until their grace period ends.
+    """
+    url, is_current = fingerprints.resolve(fingerprint)
+    if url is None or url.rsplit('/', 1)[-1] != filename:
+        abort(404)
+
+    # Re-check mtime/size so a file changed outside the app is never served under an old fingerprint
+    if is_current and fingerprints.update(url) == fingerprint:
+        response = send_from_directory(app.static_folder, url[len('/static/'):], max_age=ASSET_MAX_AGE)
+        response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+        return response
+
+    current_url = fingerprints.url_for(url)
+    if current_url == url:
+        abort(404)
+    response = redirect(current_url, code=302)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/assets/upload', methods=['POST'])
 def upload_asset():
     """Upload asset file (audio or image)."""
@@ -555,97 +1738,215 @@ def upload_asset():
             return jsonify({'success': False, 'error': 'Файл не найден'}), 400
 
         file = request.files['file']
-        asset_type = request.form.get('type')  # 'bgm', 'sfx', or 'scenes'
+        target, error = check_asset_upload(request.form.get('type'), file.filename)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        return store_asset(file, target)
 
-        if not asset_type or asset_type not in ['bgm', 'sfx', 'locations']:
-            return jsonify({'success': False, 'error': 'Неверный тип ресурса'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
 
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'Файл не выбран'}), 400
+def check_asset_upload(asset_type, filename):
+    """Validates an asset upload; returns ``(target, None)`` or ``(None, error message)``."""
+    if not asset_type or asset_type not in ['bgm', 'sfx', 'locations']:
+        return None, 'Неверный тип ресурса'
 
-        # SECURITY: Validate file extension based on type
-        if asset_type in ['bgm', 'sfx']:
-            allowed_extensions = {'mp3', 'ogg', 'wav'}
-            target_dir = os.path.join('static', 'audio', asset_type)
-        else:  # locations
-            allowed_extensions = {'png', 'jpg', 'jpeg', 'webp'}
-            target_dir = os.path.join('static', 'locations')
-
-        file_ext = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
-        if file_ext not in allowed_extensions:
-            return jsonify({'success': False, 'error': f'Недопустимый формат файла для {asset_type}'}), 400
-
-        # SECURITY: Use secure_filename and additional sanitization
-        safe_filename = secure_filename(file.filename)
-        if not safe_filename:
-            return jsonify({'success': False, 'error': 'Недопустимое имя файла'}), 400
+    if not filename:
+        return None, 'Файл не выбран'
 
-        # Create target directory if it doesn't exist
-        os.makedirs(target_dir, exist_ok=True)
+    # SECURITY: Validate file extension based on type
+    if asset_type in ['bgm', 'sfx']:
+        allowed_extensions = {'mp3', 'ogg', 'wav'}
+        target_dir = os.path.join(app.static_folder, 'audio', asset_type)
+    else:  # locations
+        allowed_extensions = {'png', 'jpg', 'jpeg', 'webp'}
+        target_dir = os.path.join(app.static_folder, 'locations')
 
-        filepath = os.path.join(target_dir, safe_filename)
+    file_ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if file_ext not in allowed_extensions:
+        return None, f'Недопустимый формат файла для {asset_type}'
 
-        # SECURITY: Validate that the path is within the expected directory
-        if not os.path.abspath(filepath).startswith(os.path.abspath(target_dir)):
-            return jsonify({'success': False, 'error': 'Недопустимый путь к файлу'}), 400
+    # SECURITY: Use secure_filename and additional sanitization
+    safe_filename = secure_filename(filename)
+    if not safe_filename:
+        return None, 'Недопустимое имя файла'
 
-        # Check if file already exists
-        if os.path.exists(filepath):
-            return jsonify({'success': False, 'error': 'Файл с таким именем уже существует'}), 400
+    filepath = os.path.join(target_dir, safe_filename)
 
-        file.save(filepath)
+    # SECURITY: Validate that the path is within the expected directory
+    if not os.path.abspath(filepath).startswith(os.path.abspath(target_dir)):
+        return None, 'Недопустимый путь к файлу'
 
-        # Return the relative path
-        if asset_type in ['bgm', 'sfx']:
-            relative_path = f'/static/audio/{asset_type}/{safe_filename}'
-        else:
-            relative_path = f'/static/locations/{safe_filename}'
+    # Check if file already exists
+    if os.path.exists(filepath):
+        return None, 'Файл с таким именем уже существует'
 
-            # For locations, also update content/scenes/locations.json
-            try:
-                locations_json_path = os.path.join(content_dir, 'scenes', 'locations.json')
+    return {'type': asset_type, 'filepath': filepath, 'filename': safe_filename}, None
 
-                # Load existing locations
-                locations_data = {'scenes': {}}
-                if os.path.exists(locations_json_path):
-                    with open(locations_json_path, 'r', encoding='utf-8') as f:
-                        locations_data = json.load(f)
+def store_asset(file, target):
+    """Saves a validated asset (anything with ``save()``) and runs the follow-up work:
+    audio variants or image derivatives plus a location entry, fingerprints and the asset index."""
+    asset_type, filepath, safe_filename = target['type'], target['filepath'], target['filename']
+    content_store.atomic_write_file(filepath, file)
 
+    # Return the relative path
+    audio_job = None
+    if asset_type in ['bgm', 'sfx']:
+        relative_path = f'/static/audio/{asset_type}/{safe_filename}'
+        audio_job = audio_jobs.enqueue(filepath, relative_path, asset_type)
+    else:
+        relative_path = f'/static/locations/{safe_filename}'
+        schedule_image_derivatives(filepath, relative_path)
+
+        # For locations, also add a scene entry (content/scenes/locations.json)
+        try:
+            location = {
+                'name': os.path.splitext(safe_filename)[0].replace('_', ' ').title(),
+                'background': relative_path
+            }
+            while True:
                 # Generate unique location ID as UUID (limited to 30 characters)
                 location_id = str(uuid.uuid4()).replace('-', '')[:30]
+                try:
+                    # An empty expected version means the ID must not be taken yet
+                    content_manager.put_entity('scenes', location_id, location, expected_version='')
+                    break
+                except content_store.VersionConflict:
+                    continue
 
-                # Ensure unique ID (though UUID collision is extremely unlikely)
-                while location_id in locations_data['scenes']:
-                    location_id = str(uuid.uuid4()).replace('-', '')[:30]
+        except Exception as e:
+            print(f"Error updating locations.json: {e}")
+            # Don't fail the upload if JSON update fails
 
-                # Add new location entry
-                locations_data['scenes'][location_id] = {
-                    'name': os.path.splitext(safe_filename)[0].replace('_', ' ').title(),
-                    'background': relative_path
-                }
+    fingerprints.update(relative_path)
+    assets_index.update(relative_path)
+
+    return jsonify({
+        'success': True,
+        'message': 'Файл загружен успешно',
+        'path': relative_path,
+        'name': safe_filename,
+        'size': os.path.getsize(filepath),
+        'audio_job': audio_job
+    })
+
+uploads = upload_sessions.UploadSessions(
+    os.path.join(os.path.dirname(__file__), '.upload-staging'),
+    chunk_size=config.get('UPLOAD_CHUNK_SIZE', upload_sessions.DEFAULT_CHUNK_SIZE),
+    max_size=config.get('UPLOAD_MAX_SIZE', upload_sessions.DEFAULT_MAX_SIZE),
+    ttl=config.get('UPLOAD_TTL', upload_sessions.DEFAULT_TTL))
+
+def check_chunked_upload(info, filename):
+    """The same checks as the single-request upload of this kind."""
+    if info.get('kind') == 'character_image':
+        return check_character_image_upload(info.get('character_id'), info.get('pose_name'), filename)
+    if info.get('kind') == 'asset':
+        return check_asset_upload(info.get('type'), filename)
+    return None, 'Неверный тип загрузки'
+
+def upload_status(meta):
+    return {'success': True, 'upload_id': meta['id'], 'offset': meta['received'], 'size': meta['size'],
+            'chunk_size': meta['chunk_size']}
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Starts a chunked upload: ``{kind: 'asset', type, filename, size, sha256?}`` or
+    ``{kind: 'character_image', character_id, pose_name, filename, size, sha256?}``.
+
+    Then PUT chunk ``n`` (``chunk_size`` bytes, the last one shorter) to
+    ``/api/uploads/<id>/chunks/<n>`` and POST ``/api/uploads/<id>/finalize``.
+    After an error, GET ``/api/uploads/<id>`` gives the offset to resume from.
+    """
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещён', 'requires_auth': True}), 403
 
-                # Create directory if it doesn't exist
-                os.makedirs(os.path.dirname(locations_json_path), exist_ok=True)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('filename'), str):
+        return jsonify({'success': False, 'error': 'Неверный формат данных'}), 400
+    info = {key: data.get(key) for key in ('kind', 'type', 'character_id', 'pose_name')}
+    _, error = check_chunked_upload(info, data['filename'])
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
 
-                # Save updated locations.json
-                with open(locations_json_path, 'w', encoding='utf-8') as f:
-                    json.dump(locations_data, f, ensure_ascii=False, indent=2)
+    try:
+        meta = uploads.create(data['filename'], data.get('size'), info, data.get('sha256'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Неверный размер файла'}), 400
+    except OSError as e:
+        print(f"[ERROR] Failed to start upload of {data['filename']}: {e}")
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
+    return jsonify(upload_status(meta))
 
-            except Exception as e:
-                print(f"Error updating locations.json: {e}")
-                # Don't fail the upload if JSON update fails
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Offset to resume an interrupted upload from."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещён', 'requires_auth': True}), 403
+    try:
+        return jsonify(upload_status(uploads.get(upload_id)))
+    except upload_sessions.UnknownUpload:
+        return jsonify({'success': False, 'error': 'Загрузка не найдена'}), 404
 
-        return jsonify({
-            'success': True,
-            'message': 'Файл загружен успешно',
-            'path': relative_path,
-            'name': safe_filename,
-            'size': os.path.getsize(filepath)
-        })
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Appends one chunk, sent as the raw request body."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещён', 'requires_auth': True}), 403
+    try:
+        meta = uploads.write_chunk(upload_id, index, request.stream, request.content_length)
+        return jsonify(upload_status(meta))
+    except upload_sessions.UnknownUpload:
+        return jsonify({'success': False, 'error': 'Загрузка не найдена'}), 404
+    except upload_sessions.OffsetMismatch as mismatch:
+        return jsonify({'success': False, 'error': 'Неверный номер части', 'offset': mismatch.offset}), 409
+    except upload_sessions.InvalidChunk:
+        return jsonify({'success': False, 'error': 'Неверный размер части'}), 400
+    except Exception as e:
+        print(f"[ERROR] Failed to write chunk {index} of upload {upload_id}: {e}")
+        return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """Checks the received file and stores it like the single-request upload would."""
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещён', 'requires_auth': True}), 403
+    try:
+        upload = uploads.complete(upload_id)
+    except upload_sessions.UnknownUpload:
+        return jsonify({'success': False, 'error': 'Загрузка не найдена'}), 404
+    except upload_sessions.UploadIncomplete as incomplete:
+        return jsonify({'success': False, 'error': 'Файл загружен не полностью', 'offset': incomplete.offset}), 409
+    except upload_sessions.ChecksumMismatch:
+        uploads.discard(upload_id)
+        return jsonify({'success': False, 'error': 'Контрольная сумма не совпадает, загрузите файл заново'}), 400
 
+    try:
+        # Checked again: the target may have been taken while the chunks were coming in
+        target, error = check_chunked_upload(upload.info, upload.filename)
+        if error:
+            uploads.discard(upload_id)
+            return jsonify({'success': False, 'error': error}), 400
+        if upload.info.get('kind') == 'character_image':
+            response = store_character_image(upload, target)
+        else:
+            response = store_asset(upload, target)
+        uploads.discard(upload_id, completed=True)
+        return response
     except Exception as e:
+        print(f"[ERROR] Failed to finalize upload {upload_id}: {e}")
         return jsonify({'success': False, 'error': 'Ошибка сервера'}), 500
 
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def cancel_upload(upload_id):
+    if not check_admin():
+        return jsonify({'success': False, 'error': 'Доступ запрещён', 'requires_auth': True}), 403
+    try:
+        uploads.get(upload_id)
+    except upload_sessions.UnknownUpload:
+        return jsonify({'success': False, 'error': 'Загрузка не найдена'}), 404
+    uploads.discard(upload_id)
+    return jsonify({'success': True})
+
 @app.route('/api/assets/delete', methods=['POST'])
 def delete_asset():
     """Delete asset file."""
@@ -667,10 +1968,10 @@ def delete_asset():
         # SECURITY: Validate path format
         if asset_type in ['bgm', 'sfx']:
             expected_prefix = f'/static/audio/{asset_type}/'
-            base_dir = os.path.join('static', 'audio', asset_type)
+            base_dir = os.path.join(app.static_folder, 'audio', asset_type)
         else:
             expected_prefix = '/static/locations/'
-            base_dir = os.path.join('static', 'locations')
+            base_dir = os.path.join(app.static_folder, 'locations')
 
         if not asset_path.startswith(expected_prefix):
             return jsonify({'success': False, 'error': 'Недопустимый путь к файлу'}), 400
@@ -692,29 +1993,31 @@ def delete_asset():
             return jsonify({'success': False, 'error': 'Файл не найден'}), 404
 
         os.remove(full_path)
+        fingerprints.remove(asset_path)
+        assets_index.remove(asset_path)
+
+        if asset_type in ['bgm', 'sfx']:
+            try:
+                audio_pipeline.remove_derivatives(app.static_folder, asset_path)
+            except Exception as e:
+                print(f"Error removing derivatives of {asset_path}: {e}")
 
         # For locations, also remove from content/scenes/locations.json
         if asset_type == 'locations':
             try:
-                locations_json_path = os.path.join(content_dir, 'scenes', 'locations.json')
-
-                if os.path.exists(locations_json_path):
-                    with open(locations_json_path, 'r', encoding='utf-8') as f:
-                        locations_data = json.load(f)
-
-                    # Find and remove the location entry that matches this path
-                    scenes_to_remove = []
-                    for location_id, location_info in locations_data.get('scenes', {}).items():
-                        if location_info.get('background') == asset_path:
-                            scenes_to_remove.append(location_id)
-
-                    # Remove found entries
-                    for location_id in scenes_to_remove:
-                        del locations_data['scenes'][location_id]
+                image_pipeline.remove_derivatives(app.static_folder, asset_path)
+            except Exception as e:
+                print(f"Error removing derivatives of {asset_path}: {e}")
 
-                    # Save updated locations.json
-                    with open(locations_json_path, 'w', encoding='utf-8') as f:
-                        json.dump(locations_data, f, ensure_ascii=False, indent=2)
+            try:
+                # Find and remove the location entries that match this path
+                manager = get_content_manager('scenes')
+                scenes_to_remove = [
+                    location_id for location_id, location_info in manager.scenes.items()
+                    if location_info.get('background') == asset_path
+                ]
+                if scenes_to_remove:
+                    content_manager.delete_entities('scenes', scenes_to_remove)
 
             except Exception as e:
                 print(f"Error updating locations.json during deletion: {e}")
@@ -749,28 +2052,25 @@ def update_location_name():
         if not location_id.isalnum() or len(location_id) > 30:
             return jsonify({'success': False, 'error': 'Недопустимый ID локации'}), 400
 
-        locations_json_path = os.path.join(content_dir, 'scenes', 'locations.json')
-
-        if not os.path.exists(locations_json_path):
-            return jsonify({'success': False, 'error': 'Файл локаций не найден'}), 404
-
-        # Load existing locations
-        with open(locations_json_path, 'r', encoding='utf-8') as f:
-            locations_data = json.load(f)
-
-        if location_id not in locations_data.get('scenes', {}):
+        if location_id not in get_content_manager('scenes').scenes:
             return jsonify({'success': False, 'error': 'Локация не найдена'}), 404
 
-        # Update the name
-        locations_data['scenes'][location_id]['name'] = new_name
+        def rename(location):
+            if location is None:
+                raise KeyError(location_id)
+            return dict(location, name=new_name)
 
-        # Save updated locations.json
-        with open(locations_json_path, 'w', encoding='utf-8') as f:
-            json.dump(locations_data, f, ensure_ascii=False, indent=2)
+        try:
+            version = content_manager.update_entity('scenes', location_id, rename, data.get('expected_version'))
+        except KeyError:
+            return jsonify({'success': False, 'error': 'Локация не найдена'}), 404
+        except content_store.VersionConflict as conflict:
+            return conflict_response(conflict)
 
         return jsonify({
             'success': True,
-            'message': 'Имя локации обновлено успешно'
+            'message': 'Имя локации обновлено успешно',
+            'version': version
         })
 
     except Exception as e:
@@ -779,7 +2079,7 @@ def update_location_name():
 @app.route('/character-creator')
 def character_creator():
     """Отдаёт страницу редактора персонажей."""
-    manager = VisualNovelManager(content_dir)
+    manager = get_content_manager('voices')
     voices_data = manager.voices
     voices_json = json.dumps(voices_data)
 
@@ -0,0 +1,358 @@
+"""ASGI entry point for serving many slow connections.
+
+    uvicorn asgi:application --workers 4      (or hypercorn, granian, ...)
+
+This is an adapter around ``app.wsgi_app``, not an async rewrite of the app.
+The views (the content, asset and save APIs included) are the same
+synchronous Flask views as under ``python app.py`` or a WSGI server, and each
+one holds a view thread while it runs, as it would under WSGI. What changes
+is who waits on the network: under WSGI a thread is held while a 160 MB
+upload trickles in or a slow client downloads BGM; here the event loop does
+the waiting and threads only run views. So slow connections no longer starve
+the server, but the number of views running at once is still ``ASGI_THREADS``
+per worker, and a view that waits on disk or SQLite still waits on a thread.
+
+- Request bodies are received on the event loop into a spooled temporary file
+  (kept in memory up to ``ASGI_BODY_SPOOL_BYTES``, then on disk); the view is
+  called once the body is complete. Bodies over ``MAX_CONTENT_LENGTH`` get 413
+  before a thread is involved.
+- File responses (static files, fingerprinted assets, bundles) are sent from
+  the event loop: with the server's zero-copy extension when it offers one
+  (``http.response.zerocopysend``, ``http.response.pathsend``), otherwise in
+  chunks read on the stream pool. Range requests (audio seeking) included.
+- Other bodies (streamed JSON) are pulled one chunk at a time on the stream
+  pool, and the next chunk is produced only after the client took the
+  previous one, so a slow connection buffers one chunk at most.
+- The /api/events feed is served on the event loop itself
+  (``ChangeFeed.stream_async``): an idle stream holds no thread, so up to
+  ``ASGI_SSE_MAX_CLIENTS`` of them are allowed and the game subscribes too.
+
+Views run on ``ASGI_THREADS`` threads and response bodies on
+``ASGI_STREAM_THREADS``, so long-lived streams never take the threads views
+need.
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import tempfile
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import content_events
+from app import app, change_feed, config
+
+VIEW_THREADS = config.get('ASGI_THREADS', 16)
+STREAM_THREADS = config.get('ASGI_STREAM_THREADS', 64)
+BODY_SPOOL_BYTES = config.get('ASGI_BODY_SPOOL_BYTES', 1024 * 1024)
+FILE_CHUNK_SIZE = 64 * 1024
+EVENTS_PATH = '/api/events'
+
+# Streams here cost a connection and a few objects, not a thread
+change_feed.max_clients = config.get('ASGI_SSE_MAX_CLIENTS', 1000)
+
+_view_pool = ThreadPoolExecutor(max_workers=VIEW_THREADS, thread_name_prefix='asgi-view')
+_stream_pool = ThreadPoolExecutor(max_workers=STREAM_THREADS, thread_name_prefix='asgi-stream')
+_DONE = object()
+
+
+class FileBody:
+    """``wsgi.file_wrapper``: lets ``send_file`` hand the open file to the adapter
+    instead of reading it on a view thread. Iterating it (other middleware) still works."""
+
+    def __init__(self, file, buffer_size=FILE_CHUNK_SIZE):
+        self.file = file
+        self.buffer_size = buffer_size
+
+    def seekable(self):
+        return hasattr(self.file, 'seek')
+
+    def seek(self, *args):
+        return self.file.seek(*args)
+
+    def tell(self):
+        return self.file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.buffer_size)
+        if data:
+            return data
+        raise StopIteration()
+
+    def close(self):
+        self.file.close()
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+def _file_range(app_iter):
+    """(file, offset, count or None) if the response is a file on disk, else None."""
+    file_body, offset, count = app_iter, 0, None
+    # A Range response wraps the file body (werkzeug.wsgi._RangeWrapper)
+    if isinstance(getattr(app_iter, 'iterable', None), FileBody) and isinstance(getattr(app_iter, 'start_byte', None), int):
+        file_body, offset, count = app_iter.iterable, app_iter.start_byte, app_iter.byte_range
+    if not isinstance(file_body, FileBody) or not isinstance(getattr(file_body.file, 'name', None), str):
+        return None  # in-memory files (BytesIO) are iterated like any body
+    return file_body.file, offset, count
+
+
+def build_environ(scope, body, body_size):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1') or '/',
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(body_size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileBody,
+        'asgi.scope': scope,
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1] or 80)
+    client = scope.get('client')
+    if client:
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = client[0], str(client[1])
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def receive_body(scope, receive):
+    """The whole request body in a spooled file, and its size."""
+    limit = app.config.get('MAX_CONTENT_LENGTH')
+    for name, value in scope.get('headers', []):
+        if name == b'content-length' and limit is not None and value.isdigit() and int(value) > limit:
+            raise RequestTooLarge()
+
+    loop = asyncio.get_running_loop()
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    size = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionResetError('client disconnected during upload')
+            chunk = message.get('body', b'')
+            if chunk:
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise RequestTooLarge()
+                if size > BODY_SPOOL_BYTES:
+                    # Past the in-memory part every write goes to disk
+                    await loop.run_in_executor(_stream_pool, body.write, chunk)
+                else:
+                    body.write(chunk)
+            if not message.get('more_body', False):
+                break
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    return body, size
+
+
+def call_view(environ):
+    """Runs the Flask app on a view thread; returns (status, headers, app_iter)."""
+    response = {}
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and response:
+            raise exc_info[1].with_traceback(exc_info[2])
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+        return written.append
+
+    app_iter = app.wsgi_app(environ, start_response)
+    if written:
+        app_iter = written + list(app_iter)
+    return response['status'], response['headers'], app_iter
+
+
+async def send_file(send, scope, file, offset, count):
+    extensions = scope.get('extensions') or {}
+    loop = asyncio.get_running_loop()
+    size = await loop.run_in_executor(_stream_pool, lambda: os.fstat(file.fileno()).st_size)
+    if count is None:
+        count = size - offset
+
+    if 'http.response.zerocopysend' in extensions:
+        await send({'type': 'http.response.zerocopysend', 'file': file, 'offset': offset, 'count': count})
+        return
+    if 'http.response.pathsend' in extensions and offset == 0 and count == size:
+        await send({'type': 'http.response.pathsend', 'path': os.path.abspath(file.name)})
+        return
+
+    def read_chunk(position, length):
+        file.seek(position)
+        return file.read(length)
+
+    position, end = offset, offset + count
+    while position < end:
+        chunk = await loop.run_in_executor(_stream_pool, read_chunk, position, min(FILE_CHUNK_SIZE, end - position))
+        if not chunk:
+            break
+        position += len(chunk)
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': position < end})
+    if position < end or count == 0:
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def send_iterable(send, app_iter, context, disconnected):
+    loop = asyncio.get_running_loop()
+    iterator = iter(app_iter)
+    while not disconnected.is_set():
+        chunk = await loop.run_in_executor(_stream_pool, context.run, next, iterator, _DONE)
+        if chunk is _DONE:
+            break
+        if chunk:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+            return
+
+
+async def send_error(send, status, message, headers=()):
+    body = ('{"error":"%s","success":false}\n' % message).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                            *headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_events(scope, receive, send):
+    """/api/events without a view thread; same parameters and frames as the Flask view."""
+    query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    last_event_id = query.get('last_event_id', [None])[0]
+    for name, value in scope.get('headers', []):
+        if name == b'last-event-id':
+            last_event_id = value.decode('latin-1')
+    types, last_event_id = content_events.stream_params(query.get('types', [None])[0], last_event_id)
+
+    if not change_feed.acquire_client():
+        await send_error(send, 503, 'Слишком много подключений', [(b'retry-after', b'30')])
+        return
+    stream = change_feed.stream_async(last_event_id, types)
+    disconnected = asyncio.Event()
+    watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ]})
+        if scope['method'] != 'HEAD':
+            while True:
+                frame = asyncio.ensure_future(stream.__anext__())
+                # A client that leaves is noticed at once, not at the next heartbeat
+                await asyncio.wait({frame, watcher}, return_when=asyncio.FIRST_COMPLETED)
+                if not frame.done():
+                    frame.cancel()
+                    # Let the generator finish its cancellation before it is closed below
+                    await asyncio.wait({frame})
+                    return
+                try:
+                    chunk = frame.result()
+                except StopAsyncIteration:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    except OSError:  # the client went away while a frame was sent
+        pass
+    finally:
+        watcher.cancel()
+        await stream.aclose()
+        change_feed.release_client()
+
+
+async def handle_http(scope, receive, send):
+    if scope['path'] == EVENTS_PATH and scope['method'] in ('GET', 'HEAD'):
+        await handle_events(scope, receive, send)
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        body, body_size = await receive_body(scope, receive)
+    except RequestTooLarge:
+        await send_error(send, 413, 'Файл слишком большой')
+        return
+    except ConnectionResetError:
+        return
+
+    app_iter = None
+    # Body generators (stream_with_context) set context variables on one pool thread and
+    # reset them on another; running every step in one context keeps them consistent
+    context = contextvars.copy_context()
+    disconnected = asyncio.Event()
+    watcher = None
+    try:
+        status, headers, app_iter = await loop.run_in_executor(
+            _view_pool, context.run, call_view, build_environ(scope, body, body_size))
+        watcher = asyncio.ensure_future(watch_disconnect(receive, disconnected))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        file_range = _file_range(app_iter) if scope['method'] != 'HEAD' else None
+        if file_range is not None:
+            await send_file(send, scope, *file_range)
+        elif scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        else:
+            await send_iterable(send, app_iter, context, disconnected)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if app_iter is not None and hasattr(app_iter, 'close'):
+            # Generators clean up (SSE unsubscribes, stream_with_context pops its context) on close
+            try:
+                await loop.run_in_executor(_stream_pool, context.run, app_iter.close)
+            except (RuntimeError, ValueError) as e:  # cancelled while a chunk was still being produced
+                print(f"[WARNING] Response body of {scope['path']} not closed: {e}")
+        body.close()
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            _view_pool.shutdown(wait=False)
+            _stream_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+    else:
+        # No websocket routes
+        await send({'type': 'websocket.close', 'code': 1000})
@@ -0,0 +1,183 @@
+"""Content-fingerprinted URLs for static game assets.
+
+``/static/locations/baku.webp`` becomes ``/assets/<fingerprint>/baku.webp``,
+where the fingerprint is derived from the file's path and content. Such URLs
+never change meaning, so they are served with ``immutable`` caching. When a
+file is replaced or deleted its old fingerprint is retired and keeps
+redirecting to the current URL for a grace period.
+"""
+import hashlib
+import os
+import threading
+import time
+
+FINGERPRINT_LENGTH = 16
+URL_PREFIX = '/assets'
+DEFAULT_GRACE_PERIOD = 7 * 24 * 3600
+# Voice lines are addressed by scenario/dialogue id on the client
+GAME_SKIP_PREFIXES = ('/static/audio/voice/game_voice/',)
+
+
+class AssetFingerprints:
+    def __init__(self, static_root, grace_period=DEFAULT_GRACE_PERIOD, folders=None, skip_prefixes=()):
+        self.static_root = os.path.abspath(static_root)
+        self.grace_period = grace_period
+        # Only asset folders; js/css are versioned with the code
+        self.folders = folders or ('audio', 'character_images', 'locations', 'derivatives')
+        # URLs the client derives on its own and therefore must stay unchanged
+        self.skip_prefixes = tuple(skip_prefixes)
+        self.version = 0
+        # Last-Modified of anything with rewritten URLs (ns), see _touch
+        self.modified_at = 0
+        self._built = False
+        self._by_url = {}       # url -> (fingerprint, mtime_ns, size)
+        self._by_fingerprint = {}  # fingerprint -> url
+        self._retired = {}      # fingerprint -> (url, retired_at)
+        self._lock = threading.RLock()
+
+    def _touch(self, mtime_ns=0):
+        """Moves ``modified_at`` to a changed file's mtime, or to now once build() is done
+        and the change brought no newer mtime (a deletion, a copy keeping an old mtime)."""
+        if mtime_ns > self.modified_at:
+            self.modified_at = mtime_ns
+        elif self._built:
+            self.modified_at = time.time_ns()
+
+    def _path(self, url):
+        if not isinstance(url, str) or not url.startswith('/static/'):
+            return None
+        path = os.path.abspath(os.path.join(self.static_root, *url[len('/static/'):].split('/')))
+        if not path.startswith(self.static_root + os.sep):
+            return None
+        return path
+
+    def _hash(self, url, path):
+        digest = hashlib.sha256(url.encode('utf-8'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:FINGERPRINT_LENGTH]
+
+    def build(self):
+        """Fingerprints every file in the asset folders (done once at startup)."""
+        started = time.perf_counter()
+        count = 0
+        for folder in self.folders:
+            for dirpath, _, filenames in os.walk(os.path.join(self.static_root, folder)):
+                for filename in filenames:
+                    relative = os.path.relpath(os.path.join(dirpath, filename), self.static_root)
+                    if self.update('/static/' + relative.replace(os.sep, '/')):
+                        count += 1
+        self._built = True
+        print(f"Fingerprinted {count} assets in {time.perf_counter() - started:.2f}s.")
+        return count
+
+    def export_cache(self):
+        """``{url: (fingerprint, mtime_ns, size)}`` of every fingerprinted asset (see content_snapshot)."""
+        with self._lock:
+            return dict(self._by_url)
+
+    def seed_cache(self, state):
+        """Adopts fingerprints from ``export_cache`` for files whose mtime and size still match,
+        so build() does not hash them again."""
+        for url, (fingerprint, mtime_ns, size) in state.items():
+            if url.startswith(self.skip_prefixes):
+                continue
+            path = self._path(url)
+            try:
+                st = os.stat(path) if path else None
+            except OSError:
+                continue
+            if st is None or (st.st_mtime_ns, st.st_size) != (mtime_ns, size):
+                continue
+            with self._lock:
+                if url not in self._by_url:
+                    self._by_url[url] = (fingerprint, mtime_ns, size)
+                    self._by_fingerprint[fingerprint] = url
+                    self.version += 1  # as if update() had hashed it
+                    self._touch(mtime_ns)
+
+    def update(self, url):
+        """(Re)fingerprints one asset after it was written; retires its previous fingerprint."""
+        path = self._path(url)
+        if not path or url.startswith(self.skip_prefixes) or not os.path.isfile(path):
+            self.remove(url)
+            return None
+        st = os.stat(path)
+        with self._lock:
+            current = self._by_url.get(url)
+            if current and current[1:] == (st.st_mtime_ns, st.st_size):
+                return current[0]
+        fingerprint = self._hash(url, path)
+        with self._lock:
+            current = self._by_url.get(url)
+            if current and current[0] != fingerprint:
+                self._retire(current[0], url)
+            self._by_url[url] = (fingerprint, st.st_mtime_ns, st.st_size)
+            self._by_fingerprint[fingerprint] = url
+            self._retired.pop(fingerprint, None)
+            if not current or current[0] != fingerprint:
+                self.version += 1
+                self._touch(st.st_mtime_ns)
+        return fingerprint
+
+    def remove(self, url):
+        with self._lock:
+            current = self._by_url.pop(url, None)
+            if current:
+                self._retire(current[0], url)
+                self.version += 1
+                self._touch()
+
+    def _retire(self, fingerprint, url):
+        self._by_fingerprint.pop(fingerprint, None)
+        self._retired[fingerprint] = (url, time.time())
+        cutoff = time.time() - self.grace_period
+        for old, (_, retired_at) in list(self._retired.items()):
+            if retired_at < cutoff:
+                del self._retired[old]
+
+    def url_for(self, url):
+        """Fingerprinted URL of a /static/... asset, or the URL unchanged if it has no fingerprint.
+
+        Never hashes: files are fingerprinted where they are written (``update``),
+        so one that was not yet is served from /static/ meanwhile.
+        """
+        if not isinstance(url, str) or not url.startswith('/static/') or url.startswith(self.skip_prefixes):
+            return url
+        with self._lock:
+            current = self._by_url.get(url)
+        if current is None:
+            return url
+        return f"{URL_PREFIX}/{current[0]}/{url.rsplit('/', 1)[-1]}"
+
+    def rewrite(self, data):
+        """Returns a copy of JSON-like data with every asset URL (values and keys) fingerprinted."""
+        if isinstance(data, str):
+            return self.url_for(data) if data.startswith('/static/') else data
+        if isinstance(data, dict):
+            return {self.rewrite(key): self.rewrite(value) for key, value in data.items()}
+        if isinstance(data, list):
+            return [self.rewrite(item) for item in data]
+        return data
+
+    def resolve(self, fingerprint):
+        """Returns (static url, is_current) for a fingerprint, or (None, False) if unknown/expired."""
+        with self._lock:
+            url = self._by_fingerprint.get(fingerprint)
+            if url:
+                return url, True
+            retired = self._retired.get(fingerprint)
+            if retired and retired[1] >= time.time() - self.grace_period:
+                return retired[0], False
+        return None, False
+
+    def get_stats(self):
+        with self._lock:
+            return {'assets': len(self._by_url), 'retired': len(self._retired), 'version': self.version,
+                    'modified_at': self.modified_at}
+
+
+def create_fingerprints(static_root, grace_period=DEFAULT_GRACE_PERIOD):
+    """The fingerprints of the game's assets; the app and content_snapshot must build the same ones."""
+    return AssetFingerprints(static_root, grace_period=grace_period, skip_prefixes=GAME_SKIP_PREFIXES)
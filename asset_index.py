@@ -0,0 +1,240 @@
+"""In-memory index of the uploadable assets (BGM, SFX, location images and voice lines).
+
+Built once at startup; afterwards only files whose mtime or size changed are
+hashed and probed again. Uploads and deletes update it directly; the content
+watcher (content_events) rescans it to pick up changes made by other workers
+or by hand.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import audio_pipeline
+import image_pipeline
+
+try:
+    from PIL import Image
+except ImportError:  # dimensions are simply left out without Pillow
+    Image = None
+
+# Asset type -> (folder under static/, accepted extensions)
+ASSET_TYPES = {
+    'bgm': ('audio/bgm', ('.mp3', '.ogg', '.wav')),
+    'sfx': ('audio/sfx', ('.mp3', '.ogg', '.wav')),
+    'locations': ('locations', image_pipeline.SOURCE_EXTENSIONS),
+    # Voice lines, named <scenario>_<dialogue>.wav; see voice_sprites
+    'voice': ('audio/voice/game_voice', ('.wav',)),
+}
+SORT_FIELDS = ('name', 'size', 'mtime')
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+class AssetIndex:
+    def __init__(self, static_root):
+        self.static_root = os.path.abspath(static_root)
+        self.version = 0
+        # Last-Modified of anything built from the index (ns), see _touch
+        self.modified_at = 0
+        self._entries = {asset_type: {} for asset_type in ASSET_TYPES}  # type -> url -> entry
+        self._lock = threading.RLock()
+        self.stats = {'scans': 0, 'files_probed': 0, 'scan_ms_total': 0.0}
+
+    def _touch(self, mtime_ns=0):
+        """Moves ``modified_at`` to a changed file's mtime, or to now once the index is
+        built and the change brought no newer mtime (a deletion, a copy keeping an old mtime)."""
+        if mtime_ns > self.modified_at:
+            self.modified_at = mtime_ns
+        elif self.stats['scans']:
+            self.modified_at = time.time_ns()
+
+    def _url(self, asset_type, filename):
+        return f'/static/{ASSET_TYPES[asset_type][0]}/{filename}'
+
+    def _probe(self, asset_type, path, url, st, audio_durations):
+        entry = {
+            'name': os.path.basename(path),
+            'path': url,
+            'type': asset_type,
+            'size': st.st_size,
+            'mtime': round(st.st_mtime, 3),
+            'mtime_ns': st.st_mtime_ns,
+            'hash': content_hash(path),
+        }
+        if asset_type == 'locations':
+            if Image is not None:
+                try:
+                    with Image.open(path) as image:  # reads the header only
+                        entry['width'], entry['height'] = image.size
+                except Exception:
+                    pass
+        else:
+            # WAV headers are cheap to read; other formats reuse what the transcoder probed
+            duration = audio_pipeline.probe_duration(path) if path.lower().endswith('.wav') else None
+            entry['duration'] = duration if duration is not None else audio_durations.get(url)
+        return entry
+
+    def _audio_durations(self):
+        manifest = audio_pipeline.load_manifest(self.static_root)['audio']
+        return {url: item.get('duration') for url, item in manifest.items()}
+
+    def scan(self):
+        """Brings the index in line with the disk; returns the number of changed entries.
+
+        Files are listed, hashed and probed without holding the lock, so readers
+        are not blocked while a large upload is hashed; the lock is only taken to
+        swap in the result.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            known = {asset_type: dict(entries) for asset_type, entries in self._entries.items()}
+        audio_durations = None
+        probed = {asset_type: {} for asset_type in ASSET_TYPES}
+        removed = {asset_type: [] for asset_type in ASSET_TYPES}
+        files_probed = 0
+        for asset_type, (folder, extensions) in ASSET_TYPES.items():
+            directory = os.path.join(self.static_root, *folder.split('/'))
+            entries = known[asset_type]
+            seen = set()
+            try:
+                filenames = os.listdir(directory)
+            except OSError:
+                filenames = []
+            for filename in filenames:
+                if not filename.lower().endswith(extensions):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                url = self._url(asset_type, filename)
+                seen.add(url)
+                current = entries.get(url)
+                if current and current['mtime_ns'] == st.st_mtime_ns and current['size'] == st.st_size:
+                    continue
+                if audio_durations is None:
+                    audio_durations = self._audio_durations()
+                try:
+                    probed[asset_type][url] = self._probe(asset_type, path, url, st, audio_durations)
+                except OSError:
+                    continue
+                files_probed += 1
+            removed[asset_type] = [url for url in entries if url not in seen]
+
+        changed = 0
+        with self._lock:
+            for asset_type, entries in self._entries.items():
+                before = known[asset_type]
+                # Skip entries that update() or remove() changed while this scan ran
+                for url, entry in probed[asset_type].items():
+                    if entries.get(url) is before.get(url):
+                        entries[url] = entry
+                        self._touch(entry['mtime_ns'])
+                        changed += 1
+                for url in removed[asset_type]:
+                    if url in entries and entries[url] is before[url]:
+                        del entries[url]
+                        self._touch()
+                        changed += 1
+            if changed:
+                self.version += 1
+            self.stats['scans'] += 1
+            self.stats['files_probed'] += files_probed
+            self.stats['scan_ms_total'] = round(self.stats['scan_ms_total'] + (time.perf_counter() - started) * 1000, 3)
+        return changed
+
+    def folder_stamp(self):
+        """mtimes of the asset folders: they change when a file is added, removed or
+        renamed over (every upload here is), not when one is edited in place."""
+        stamp = []
+        for folder, _ in ASSET_TYPES.values():
+            try:
+                stamp.append(os.stat(os.path.join(self.static_root, *folder.split('/'))).st_mtime_ns)
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def update(self, url):
+        """Re-indexes one asset after an upload (or removes it if the file is gone)."""
+        for asset_type, (folder, extensions) in ASSET_TYPES.items():
+            prefix = f'/static/{folder}/'
+            if url.startswith(prefix) and '/' not in url[len(prefix):]:
+                break
+        else:
+            return None
+        path = os.path.join(self.static_root, *url[len('/static/'):].split('/'))
+        try:
+            st = os.stat(path)
+            entry = self._probe(asset_type, path, url, st, self._audio_durations())
+        except OSError:
+            return self.remove(url)
+        with self._lock:
+            self._entries[asset_type][url] = entry
+            self.stats['files_probed'] += 1
+            self.version += 1
+            self._touch(entry['mtime_ns'])
+        return entry
+
+    def remove(self, url):
+        with self._lock:
+            for entries in self._entries.values():
+                if entries.pop(url, None) is not None:
+                    self.version += 1
+                    self._touch()
+        return None
+
+    def get(self, url):
+        with self._lock:
+            for entries in self._entries.values():
+                if url in entries:
+                    return entries[url]
+        return None
+
+    def query(self, asset_type, search=None, sort='name', offset=0, limit=None):
+        """Entries of one type filtered by a name substring and sorted; returns (total, page)."""
+        descending = sort.startswith('-')
+        field = sort.lstrip('-')
+        if field not in SORT_FIELDS:
+            field = 'name'
+        with self._lock:
+            entries = list(self._entries[asset_type].values())
+        if search:
+            needle = search.lower()
+            entries = [entry for entry in entries if needle in entry['name'].lower()]
+        entries.sort(key=lambda entry: (entry[field], entry['name']), reverse=descending)
+        total = len(entries)
+        return total, entries[offset:offset + limit if limit else None]
+
+    def entries(self):
+        with self._lock:
+            return [entry for entries in self._entries.values() for entry in entries.values()]
+
+    def export_cache(self):
+        return self.entries()
+
+    def seed_cache(self, entries):
+        """Adopts entries saved earlier (see content_snapshot); the next scan() re-probes
+        only the files whose mtime or size changed and drops the ones that are gone."""
+        with self._lock:
+            for entry in entries:
+                if entry.get('type') in self._entries:
+                    self._entries[entry['type']].setdefault(entry['path'], entry)
+                    self._touch(entry.get('mtime_ns', 0))
+            if entries:
+                self.version += 1  # as if scan() had probed them
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['version'] = self.version
+            stats['modified_at'] = self.modified_at
+            stats['assets'] = {asset_type: len(entries) for asset_type, entries in self._entries.items()}
+            return stats
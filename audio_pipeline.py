@@ -0,0 +1,337 @@
+"""Voice, BGM and SFX transcoding to Opus/OGG.
+
+Work goes through ``AudioJobQueue``: a few worker threads that each drive the
+local encoder binary (ffmpeg by default), normalize loudness and record duration
+and size in static/derivatives/audio.json. Originals are never touched, so the
+game falls back to them until a job has finished.
+
+Batch run over the existing tree:
+
+    python audio_pipeline.py [--workers N] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+import wave
+
+SOURCE_FOLDERS = {
+    'voice': os.path.join('audio', 'voice', 'game_voice'),
+    'bgm': os.path.join('audio', 'bgm'),
+    'sfx': os.path.join('audio', 'sfx'),
+}
+SOURCE_EXTENSIONS = ('.wav', '.mp3', '.ogg', '.m4a')
+DEFAULT_BITRATES = {'voice': '32k', 'bgm': '96k', 'sfx': '64k'}
+DEFAULT_LOUDNESS = -16
+DERIVATIVES_FOLDER = 'derivatives'
+MANIFEST_NAME = 'audio.json'
+OUTPUT_FORMAT = 'ogg'
+
+_manifest_lock = threading.Lock()
+
+
+def find_encoder(name='ffmpeg'):
+    """Full path of the encoder binary, or None when it is not installed."""
+    return shutil.which(name)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_duration(path, encoder=None):
+    """Duration in seconds via ffprobe (next to the encoder), or the wave module for .wav."""
+    probe = None
+    if encoder:
+        candidate = os.path.join(os.path.dirname(encoder), 'ffprobe')
+        probe = candidate if os.path.exists(candidate) else shutil.which('ffprobe')
+    if probe:
+        try:
+            output = subprocess.run(
+                [probe, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+                capture_output=True, text=True, timeout=30, check=True).stdout.strip()
+            return round(float(output), 3)
+        except (subprocess.SubprocessError, ValueError):
+            pass
+    if path.lower().endswith('.wav'):
+        try:
+            with wave.open(path, 'rb') as f:
+                return round(f.getnframes() / float(f.getframerate()), 3)
+        except (wave.Error, EOFError):
+            return None
+    return None
+
+
+def transcode(encoder, source_path, output_path, bitrate, loudness=DEFAULT_LOUDNESS):
+    """Encodes one file to Opus in an OGG container with EBU R128 loudness normalization."""
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    temp_path = f'{output_path}.tmp.{OUTPUT_FORMAT}'
+    command = [
+        encoder, '-y', '-hide_banner', '-loglevel', 'error',
+        '-i', source_path,
+        '-vn', '-af', f'loudnorm=I={loudness}:TP=-1.5:LRA=11',
+        '-c:a', 'libopus', '-b:a', bitrate, '-vbr', 'on',
+        temp_path,
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=600)
+    if result.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError(result.stderr.strip() or f'encoder exited with {result.returncode}')
+    os.replace(temp_path, output_path)
+
+
+def derivative_target(static_root, source_url, content_hash):
+    """Output path and URL for a /static/... source: derivatives mirror the source tree."""
+    relative = source_url[len('/static/'):]
+    relative_dir, filename = os.path.split(relative)
+    stem = os.path.splitext(filename)[0]
+    output_name = f'{stem}.{content_hash[:16]}.{OUTPUT_FORMAT}'
+    output_path = os.path.join(static_root, DERIVATIVES_FOLDER, *relative_dir.split('/'), output_name)
+    return output_path, f'/static/{DERIVATIVES_FOLDER}/{relative_dir}/{output_name}'
+
+
+def manifest_path(static_root):
+    return os.path.join(static_root, DERIVATIVES_FOLDER, MANIFEST_NAME)
+
+
+def load_manifest(static_root):
+    path = manifest_path(static_root)
+    if not os.path.exists(path):
+        return {'audio': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[ERROR] Failed to read audio manifest: {e}")
+        return {'audio': {}}
+
+
+def update_manifest(static_root, entries=(), removed=()):
+    """Merges entries (and drops removed source URLs) into the manifest atomically."""
+    with _manifest_lock:
+        manifest = load_manifest(static_root)
+        for entry in entries:
+            previous = manifest['audio'].get(entry['source'])
+            if previous and previous['hash'] != entry['hash']:
+                _remove_variant_files(static_root, previous)
+            manifest['audio'][entry['source']] = entry
+        for source_url in removed:
+            manifest['audio'].pop(source_url, None)
+        path = manifest_path(static_root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+        return manifest
+
+
+def _remove_variant_files(static_root, entry):
+    for variant in entry['variants']:
+        path = os.path.join(static_root, *variant['url'][len('/static/'):].split('/'))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def remove_derivatives(static_root, source_url):
+    """Deletes the transcoded files of a source and its manifest entry."""
+    entry = load_manifest(static_root)['audio'].get(source_url)
+    if entry:
+        _remove_variant_files(static_root, entry)
+        update_manifest(static_root, removed=[source_url])
+
+
+def process_audio(encoder, static_root, source_path, source_url, kind, bitrate, loudness=DEFAULT_LOUDNESS):
+    """Transcodes one source and returns its manifest entry."""
+    started = time.perf_counter()
+    content_hash = file_hash(source_path)
+    output_path, output_url = derivative_target(static_root, source_url, content_hash)
+    if not os.path.exists(output_path):
+        transcode(encoder, source_path, output_path, bitrate, loudness)
+    return {
+        'source': source_url,
+        'kind': kind,
+        'hash': content_hash,
+        'source_size': os.path.getsize(source_path),
+        'duration': probe_duration(source_path, encoder),
+        'variants': [{
+            'url': output_url,
+            'format': OUTPUT_FORMAT,
+            'codec': 'opus',
+            'bitrate': bitrate,
+            'size': os.path.getsize(output_path),
+            'duration': probe_duration(output_path, encoder),
+        }],
+        'process_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def find_sources(static_root):
+    """Yields (path, url, kind) for every source audio file."""
+    for kind, folder in SOURCE_FOLDERS.items():
+        root = os.path.join(static_root, folder)
+        if not os.path.isdir(root):
+            continue
+        for filename in sorted(os.listdir(root)):
+            if filename.lower().endswith(SOURCE_EXTENSIONS):
+                relative = f"{folder.replace(os.sep, '/')}/{filename}"
+                yield os.path.join(root, filename), f'/static/{relative}', kind
+
+
+class AudioJobQueue:
+    """Background transcoding with a fixed number of worker threads.
+
+    Threads are enough here: the heavy lifting happens in the encoder subprocess.
+    """
+
+    def __init__(self, static_root, encoder=None, bitrates=None, loudness=DEFAULT_LOUDNESS, workers=2,
+                 max_finished=500, on_result=None):
+        self.static_root = static_root
+        # Called with the result of every job that succeeded, on the worker thread
+        self.on_result = on_result
+        self.encoder = encoder or find_encoder()
+        self.bitrates = dict(DEFAULT_BITRATES, **(bitrates or {}))
+        self.loudness = loudness
+        self.workers = workers
+        self.max_finished = max_finished
+        self.jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def is_available(self):
+        return self.encoder is not None
+
+    def _start(self):
+        if self._threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'audio-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, source_path, source_url, kind):
+        """Queues a transcode and returns the job id, or None when no encoder is installed."""
+        if not self.is_available():
+            return None
+
+        def task():
+            entry = process_audio(self.encoder, self.static_root, source_path, source_url, kind,
+                                  self.bitrates.get(kind, DEFAULT_BITRATES['sfx']), self.loudness)
+            update_manifest(self.static_root, [entry])
+            return entry
+
+        return self.enqueue_task(source_url, kind, task)
+
+    def enqueue_task(self, source, kind, task):
+        """Queues ``task()`` on the same workers (its return value is the job result);
+        unlike ``enqueue`` this works without an encoder. Returns the job id."""
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._start()
+            self.jobs[job_id] = {'id': job_id, 'source': source, 'kind': kind, 'status': 'queued',
+                                 'queued_at': time.time(), 'error': None, 'result': None}
+            self._trim_finished()
+        self._queue.put((job_id, source, task))
+        return job_id
+
+    def _trim_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job_id, source, task = self._queue.get()
+            with self._lock:
+                self.jobs[job_id]['status'] = 'running'
+            try:
+                result = task()
+                if self.on_result is not None and result is not None:
+                    self.on_result(result)
+                with self._lock:
+                    self.jobs[job_id].update(status='done', result=result)
+            except Exception as e:
+                print(f"[ERROR] Audio job {job_id} for {source} failed: {e}")
+                with self._lock:
+                    self.jobs[job_id].update(status='failed', error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """Blocks until every queued job has finished."""
+        self._queue.join()
+
+    def list_jobs(self, limit=100):
+        """Newest jobs first, without their full results."""
+        with self._lock:
+            jobs = sorted(self.jobs.values(), key=lambda job: job['queued_at'], reverse=True)[:limit]
+            return [{key: value for key, value in job.items() if key != 'result'} for job in jobs]
+
+    def get_stats(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return {'encoder': self.encoder, 'workers': self.workers, 'jobs': counts}
+
+
+def process_tree(static_root, encoder=None, bitrates=None, loudness=DEFAULT_LOUDNESS, workers=None, force=False):
+    """Transcodes every voice, BGM and SFX file whose content changed since the last run."""
+    started = time.perf_counter()
+    job_queue = AudioJobQueue(static_root, encoder, bitrates, loudness, workers=workers or os.cpu_count() or 2)
+    if not job_queue.is_available():
+        raise RuntimeError('Audio encoder (ffmpeg) was not found')
+
+    manifest = load_manifest(static_root)
+    skipped = 0
+    for path, source_url, kind in find_sources(static_root):
+        entry = manifest['audio'].get(source_url)
+        if not force and entry and entry['hash'] == file_hash(path):
+            skipped += 1
+            continue
+        job_queue.enqueue(path, source_url, kind)
+    job_queue.wait()
+
+    finished = list(job_queue.jobs.values())
+    done = [job['result'] for job in finished if job['status'] == 'done']
+    return {
+        'processed': len(done),
+        'skipped': skipped,
+        'errors': [{'source': job['source'], 'error': job['error']} for job in finished if job['status'] == 'failed'],
+        'bytes_in': sum(entry['source_size'] for entry in done),
+        'bytes_out': sum(variant['size'] for entry in done for variant in entry['variants']),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcode voice, BGM and SFX to Opus/OGG.')
+    parser.add_argument('--static', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    parser.add_argument('--encoder', default='ffmpeg', help='encoder binary name or path')
+    parser.add_argument('--loudness', type=float, default=DEFAULT_LOUDNESS, help='target integrated loudness, LUFS')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='re-encode even if the source hash is unchanged')
+    for kind, bitrate in DEFAULT_BITRATES.items():
+        parser.add_argument(f'--{kind}-bitrate', default=bitrate)
+    args = parser.parse_args()
+
+    bitrates = {kind: getattr(args, f'{kind}_bitrate') for kind in DEFAULT_BITRATES}
+    report = process_tree(args.static, find_encoder(args.encoder), bitrates, args.loudness,
+                          workers=args.workers, force=args.force)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""Benchmarks for the content manager and the main API routes.
+
+Generate synthetic content, then run the load scenarios against it:
+
+    python -m benchmarks.generate --preset medium --out /tmp/swvne-bench
+    python -m benchmarks.run --root /tmp/swvne-bench --mode client --mode http
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Results are written as JSON (one file per run, named after the commit), so
+runs can be compared across commits.
+"""
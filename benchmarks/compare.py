@@ -0,0 +1,63 @@
+"""Side-by-side comparison of two benchmarks.run result files.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 10]
+
+Prints throughput and p95 per scenario with the relative change, and exits
+with status 1 if any p95 got worse by more than ``--threshold`` percent.
+"""
+import argparse
+import json
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def format_change(value):
+    return '     n/a' if value is None else f'{value:+7.1f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help='p95 regression (percent) that fails the run')
+    args = parser.parse_args()
+
+    baseline, candidate = load(args.baseline), load(args.candidate)
+    print(f"baseline {baseline['meta']['commit']}  ->  candidate {candidate['meta']['commit']}")
+    old_results = {(result['mode'], result['concurrency'], result['name']): result for result in baseline['results']}
+
+    regressions = []
+    for result in candidate['results']:
+        key = (result['mode'], result['concurrency'], result['name'])
+        old = old_results.get(key)
+        if old is None:
+            continue
+        rps_change = change(old['throughput_rps'], result['throughput_rps'])
+        p95_change = change(old['latency_ms']['p95'], result['latency_ms']['p95'])
+        print(f"{key[0]:6} c={key[1]:<3} {key[2]:24} "
+              f"{result['throughput_rps']:>10} req/s {format_change(rps_change)}   "
+              f"p95 {result['latency_ms']['p95']:>9} ms {format_change(p95_change)}")
+        if p95_change is not None and p95_change > args.threshold:
+            regressions.append(key)
+
+    for field in sorted(set(baseline.get('manager') or {}) & set(candidate.get('manager') or {})):
+        old, new = baseline['manager'][field], candidate['manager'][field]
+        if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+            print(f"manager {field:32} {new:>12} {format_change(change(old, new))}")
+
+    if regressions:
+        print(f'{len(regressions)} scenario(s) regressed by more than {args.threshold}% at p95')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""Synthetic content at a configurable scale.
+
+Writes ``<out>/content`` (characters, scenes, voices and one file per
+scenario, like the real tree) and ``<out>/static`` (a small PNG per location
+and pose, short WAVs for BGM and SFX) plus a ``config.json`` pointing the app
+at them. The same arguments and seed always produce the same tree.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+import wave
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PRESETS = {
+    'small': {'scenarios': 100, 'dialogues': 50, 'characters': 50, 'scenes': 50, 'audio': 100},
+    'medium': {'scenarios': 1000, 'dialogues': 100, 'characters': 500, 'scenes': 500, 'audio': 1000},
+    # 1M dialogue nodes
+    'large': {'scenarios': 10000, 'dialogues': 100, 'characters': 2000, 'scenes': 2000, 'audio': 4000},
+}
+POSES = ('neutral', 'happy', 'sad', 'angry')
+CHARACTERS_PER_FILE = 500
+WORDS = ('космос', 'ракета', 'звезда', 'орбита', 'инженер', 'полёт', 'Калуга', 'мечта', 'старт',
+         'the', 'station', 'signal', 'launch', 'window', 'night', 'engine', 'crew', 'silence')
+
+# Minimal valid PNG (1x1) used when Pillow is not installed
+FALLBACK_PNG = bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de'
+    '0000000c4944415408d763f8ffff3f0005fe02fea7d6a4a00000000049454e44ae426082')
+
+
+def png_bytes(index):
+    if Image is None:
+        return FALLBACK_PNG
+    buffer = io.BytesIO()
+    # Distinct colors, so every file has its own content hash
+    Image.new('RGB', (16, 9), (index % 256, (index // 256) % 256, (index // 65536) % 256)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def wav_bytes(index, frames=2205):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(22050)
+        f.writeframes(index.to_bytes(4, 'little') + bytes(frames * 2 - 4))
+    return buffer.getvalue()
+
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_json(path, data):
+    write_file(path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def make_scenario(rng, scenario_id, dialogues, character_ids, scene_ids, bgm_urls, sfx_urls):
+    """A mostly linear chain with a choice (and a variable effect) every tenth node
+    and a condition now and then, like hand-written scenarios."""
+    nodes = {}
+    ids = [f'd{position}' for position in range(dialogues)]
+    for position, dialogue_id in enumerate(ids):
+        on_screen = [{'id': char_id, 'position': place, 'pose': rng.choice(POSES)}
+                     for char_id, place in zip(rng.sample(character_ids, min(2, len(character_ids))),
+                                               ('left', 'right'))]
+        node = {
+            'scene': rng.choice(scene_ids),
+            'characters_on_screen': on_screen,
+            'character': on_screen[0]['id'] if on_screen else '',
+            'text': sentence(rng),
+        }
+        following = ids[position + 1] if position + 1 < len(ids) else None
+        if position % 10 == 9 and following:
+            jump = ids[min(position + 5, len(ids) - 1)]
+            node['choices'] = [
+                {'text': sentence(rng, 4), 'next': following, 'set': {'trust': '+1'}},
+                {'text': sentence(rng, 4), 'next': jump, 'set': {'trust': '-1'}, 'condition': 'trust >= 0'},
+            ]
+        elif following:
+            node['next'] = following
+        if position % 25 == 0 and bgm_urls:
+            node['bgm'] = rng.choice(bgm_urls)
+        if position % 7 == 3 and sfx_urls:
+            node['sfx'] = rng.choice(sfx_urls)
+        nodes[dialogue_id] = node
+    return {
+        'title': f'Сценарий {scenario_id}',
+        'description': sentence(rng, 20),
+        'author': 'benchmarks.generate',
+        'start_dialogue': ids[0],
+        'dialogues': nodes,
+    }
+
+
+def generate(out, scenarios, dialogues, characters, scenes, audio, seed=1):
+    """Writes the tree and returns its counts and how long it took."""
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    content = os.path.join(out, 'content')
+    static = os.path.join(out, 'static')
+
+    scene_ids = [f'scene_{index}' for index in range(scenes)]
+    write_json(os.path.join(content, 'scenes', 'locations.json'), {'scenes': {
+        scene_id: {'name': f'Локация {index}', 'background': f'/static/locations/{scene_id}.png'}
+        for index, scene_id in enumerate(scene_ids)}})
+    for index, scene_id in enumerate(scene_ids):
+        write_file(os.path.join(static, 'locations', f'{scene_id}.png'), png_bytes(index))
+
+    character_ids = [f'char_{index}' for index in range(characters)]
+    for start in range(0, characters, CHARACTERS_PER_FILE):
+        write_json(os.path.join(content, 'characters', f'chars_{start // CHARACTERS_PER_FILE:04d}.json'), {'characters': {
+            char_id: {
+                'name': f'Персонаж {char_id}',
+                'color': '#%06x' % rng.randrange(0x1000000),
+                'voice': 'Synthetic',
+                'poses': {pose: f'/static/character_images/{char_id}/{pose}.png' for pose in POSES},
+            } for char_id in character_ids[start:start + CHARACTERS_PER_FILE]}})
+    for index, char_id in enumerate(character_ids):
+        for offset, pose in enumerate(POSES):
+            write_file(os.path.join(static, 'character_images', char_id, f'{pose}.png'),
+                       png_bytes(scenes + index * len(POSES) + offset))
+
+    write_json(os.path.join(content, 'voices', 'voices.json'), {'voices': {
+        'Synthetic': {'name': 'Synthetic', 'gender': 'F', 'example': ''}}})
+
+    bgm_urls = []
+    sfx_urls = []
+    for index in range(audio):
+        kind, urls = ('bgm', bgm_urls) if index % 2 == 0 else ('sfx', sfx_urls)
+        filename = f'{kind}_{index}.wav'
+        write_file(os.path.join(static, 'audio', kind, filename), wav_bytes(index))
+        urls.append(f'/static/audio/{kind}/{filename}')
+
+    for index in range(scenarios):
+        scenario_id = f'scenario_{index:05d}'
+        write_json(os.path.join(content, 'scenarios', f'{scenario_id}.json'), {'scenarios': {
+            scenario_id: make_scenario(rng, scenario_id, dialogues, character_ids, scene_ids, bgm_urls, sfx_urls)}})
+
+    write_json(os.path.join(out, 'config.json'), {
+        'SECRET_KEY': 'benchmark',
+        'CONTENT_FOLDER': os.path.abspath(content),
+        'STATIC_FOLDER': os.path.abspath(static),
+        'UPLOAD_FOLDER': os.path.abspath(content),
+        'MAX_CONTENT_LENGTH': 169148416,
+        'CONTENT_CACHE_CHECK_INTERVAL': 1.0,
+        'CONTENT_WATCH_INTERVAL': 0,
+        'SAVE_DATABASE': os.path.abspath(os.path.join(out, 'saves.sqlite3')),
+        'CONTENT_DATABASE': os.path.abspath(os.path.join(out, 'content.sqlite3')),
+        # Build with `python content_snapshot.py --content <out>/content --static <out>/static --output <this>`
+        'CONTENT_SNAPSHOT': os.path.abspath(os.path.join(out, 'content.snapshot')),
+        'ADMIN_PASS': 'benchmark',
+        'debug': False,
+        'host': '127.0.0.1',
+        'port': 5000,
+    })
+
+    return {
+        'scenarios': scenarios,
+        'dialogues': scenarios * dialogues,
+        'characters': characters,
+        'scenes': scenes,
+        'images': scenes + characters * len(POSES),
+        'audio': audio,
+        'seed': seed,
+        'generate_s': round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic SWVNE content for benchmarks.')
+    parser.add_argument('--out', required=True, help='folder to write content/, static/ and config.json to')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    for key in PRESETS['small']:
+        parser.add_argument(f'--{key}', type=int, default=None, help='overrides the preset')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sizes = dict(PRESETS[args.preset])
+    sizes.update({key: getattr(args, key) for key in sizes if getattr(args, key) is not None})
+    summary = generate(args.out, seed=args.seed, **sizes)
+    write_json(os.path.join(args.out, 'summary.json'), summary)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
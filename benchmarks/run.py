@@ -0,0 +1,328 @@
+"""Load scenarios against the main routes, plus content manager timings.
+
+Runs every scenario through the Flask test client (``--mode client``: no
+network, measures the app itself) and/or a local threaded HTTP server
+(``--mode http``: adds the WSGI server and sockets), at one or more
+concurrency levels. Reports throughput, p50/p95/p99 latency, response bytes
+and peak memory, and writes everything to one JSON file.
+
+The app is imported with ``SWVNE_CONFIG`` pointing at the config written by
+benchmarks.generate, so it serves the generated content, not the real tree.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from benchmarks import generate
+
+# name -> (needs admin, path builder(rng, ids), send the ETag of a first response back)
+SCENARIOS = {
+    'content_characters': (False, lambda rng, ids: '/api/content/characters', False),
+    'content_characters_304': (False, lambda rng, ids: '/api/content/characters', True),
+    'content_scenes': (False, lambda rng, ids: '/api/content/scenes', False),
+    'content_scenarios': (False, lambda rng, ids: '/api/content/scenarios', False),
+    'content_entity': (False, lambda rng, ids: f"/api/content/characters/{rng.choice(ids['characters'])}", False),
+    'scenarios_list': (False, lambda rng, ids: '/api/scenarios/list', False),
+    'scenarios_index': (False, lambda rng, ids: '/api/scenarios/index', False),
+    'scenario_load': (False, lambda rng, ids: f"/api/scenarios/load/{rng.choice(ids['scenarios'])}?include=refs&format=compiled", False),
+    'scenario_lookahead': (False, lambda rng, ids: f"/api/scenarios/lookahead/{rng.choice(ids['scenarios'])}", False),
+    'characters_list': (False, lambda rng, ids: '/api/characters/list', False),
+    'assets_list': (True, lambda rng, ids: f"/api/assets/list?type=locations&page={rng.randint(1, 5)}&per_page=100", False),
+    'assets_search': (True, lambda rng, ids: f"/api/assets/list?type=bgm&q={rng.randint(0, 99)}&sort=-size", False),
+    'asset_variants': (False, lambda rng, ids: f"/api/assets/variants?scenario={rng.choice(ids['scenarios'])}", False),
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB elsewhere
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ClientTarget:
+    """Requests through the Flask test client; one client (and session) per thread."""
+    mode = 'client'
+
+    def __init__(self, app, admin_password):
+        self.app = app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self.app.test_client()
+            with client.session_transaction() as session:
+                session['admin_logged_in'] = True
+            self._local.client = client
+        return client
+
+    def get(self, path, headers=None):
+        response = self._client().get(path, headers=headers or {})
+        body = response.get_data()
+        return response.status_code, response.headers.get('ETag'), len(body)
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """Requests over real sockets to a threaded werkzeug server on a free local port."""
+    mode = 'http'
+
+    def __init__(self, app, admin_password):
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, name='bench-http', daemon=True).start()
+        self.cookie = self._login(admin_password)
+
+    def _login(self, password):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        connection.request('POST', '/api/auth/login', body=json.dumps({'password': password}),
+                           headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        return (response.getheader('Set-Cookie') or '').split(';', 1)[0]
+
+    def get(self, path, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            connection.request('GET', path, headers={'Cookie': self.cookie, **(headers or {})})
+            response = connection.getresponse()
+            body = response.read()
+            return response.status, response.getheader('ETag'), len(body)
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_scenario(target, name, ids, requests, concurrency, seed, trace_memory):
+    admin, build_path, revalidate = SCENARIOS[name]
+    rng = random.Random(f'{seed}:{name}')
+    paths = [build_path(rng, ids) for _ in range(requests)]
+
+    headers = None
+    warmup = max(1, min(10, requests // 20))
+    for path in paths[:warmup]:
+        status, etag, _ = target.get(path)
+        if revalidate and etag:
+            headers = {'If-None-Match': etag}
+
+    latencies = []
+    statuses = {}
+    total_bytes = 0
+    lock = threading.Lock()
+
+    def one(path):
+        nonlocal total_bytes
+        started = time.perf_counter()
+        status, _, size = target.get(path, headers)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            total_bytes += size
+
+    if trace_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(one, paths))
+    else:
+        for path in paths:
+            one(path)
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'name': name,
+        'mode': target.mode,
+        'admin': admin,
+        'concurrency': concurrency,
+        'requests': requests,
+        'wall_s': round(wall, 4),
+        'throughput_rps': round(requests / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'bytes': total_bytes,
+        'peak_traced_kb': tracemalloc.get_traced_memory()[1] // 1024 if trace_memory else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def bench_manager(app_module, sample, trace_memory):
+    """Cold load, no-op refresh, one-file reload and compile times of a fresh VisualNovelManager."""
+    import asset_index
+    import content_backends
+
+    results = {}
+    content_dir = app_module.content_dir
+    if trace_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    manager = app_module.VisualNovelManager(content_dir, check_interval=0,
+                                            backend=content_backends.JsonFolderBackend(content_dir))
+    results['cold_load_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    if trace_memory:
+        results['cold_load_peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+
+    started = time.perf_counter()
+    for _ in range(20):
+        manager.refresh()
+    results['refresh_noop_ms'] = round((time.perf_counter() - started) * 1000 / 20, 3)
+
+    # Touch one scenario file: only that file should be parsed again
+    scenario_id = next(iter(manager.scenarios))
+    path = os.path.join(content_dir, 'scenarios', f'{scenario_id}.json')
+    if os.path.exists(path):
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        started = time.perf_counter()
+        manager.refresh()
+        results['refresh_one_file_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    scenario_ids = list(manager.scenarios)[:sample]
+    started = time.perf_counter()
+    for scenario_id in scenario_ids:
+        manager.get_compiled_scenario(scenario_id)
+    elapsed = (time.perf_counter() - started) * 1000
+    results['compile_ms_per_scenario'] = round(elapsed / len(scenario_ids), 3) if scenario_ids else None
+
+    index = asset_index.AssetIndex(app_module.app.static_folder)
+    started = time.perf_counter()
+    index.scan()
+    results['asset_scan_cold_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    started = time.perf_counter()
+    index.scan()
+    results['asset_scan_warm_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    results['assets'] = index.get_stats()['assets']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark SWVNE against generated content.')
+    parser.add_argument('--root', required=True, help='folder written by benchmarks.generate')
+    parser.add_argument('--generate', choices=sorted(generate.PRESETS), default=None,
+                        help='generate content of this preset into --root first')
+    parser.add_argument('--mode', action='append', choices=('client', 'http'), default=None)
+    parser.add_argument('--concurrency', action='append', type=int, default=None)
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), default=None)
+    parser.add_argument('--compile-sample', type=int, default=100, help='scenarios to compile in the manager benchmark')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='track Python allocation peaks per scenario (slows everything down)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='result file (default: benchmarks/results/<time>-<commit>.json)')
+    args = parser.parse_args()
+
+    content_summary = None
+    if args.generate:
+        content_summary = generate.generate(args.root, seed=args.seed, **generate.PRESETS[args.generate])
+    elif os.path.exists(os.path.join(args.root, 'summary.json')):
+        with open(os.path.join(args.root, 'summary.json'), encoding='utf-8') as f:
+            content_summary = json.load(f)
+    config_path = os.path.join(args.root, 'config.json')
+    if not os.path.exists(config_path):
+        parser.error(f'{config_path} not found; run benchmarks.generate first or pass --generate')
+    os.environ['SWVNE_CONFIG'] = os.path.abspath(config_path)
+
+    if args.trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    import app as app_module
+    startup = {'import_ms': round((time.perf_counter() - started) * 1000, 3), 'peak_rss_kb': peak_rss_kb()}
+    if args.trace_memory:
+        startup['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+
+    manager = app_module.content_manager
+    ids = {'characters': sorted(manager.characters), 'scenarios': sorted(manager.scenarios)}
+    results = []
+    for mode in args.mode or ['client']:
+        target = (ClientTarget if mode == 'client' else HttpTarget)(app_module.app, app_module.ADMIN_PASSWORD)
+        try:
+            for concurrency in args.concurrency or [1]:
+                for name in args.scenario or SCENARIOS:
+                    result = run_scenario(target, name, ids, args.requests, concurrency, args.seed, args.trace_memory)
+                    results.append(result)
+                    print(f"{mode:6} c={concurrency:<3} {name:24} {result['throughput_rps']:>10} req/s  "
+                          f"p50 {result['latency_ms']['p50']:>9} ms  p99 {result['latency_ms']['p99']:>9} ms  "
+                          f"{result['statuses']}")
+        finally:
+            target.close()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key != 'output'},
+        },
+        'content': content_summary,
+        'startup': startup,
+        'manager': bench_manager(app_module, args.compile_sample, args.trace_memory),
+        'results': results,
+    }
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results',
+                              f"{stamp}-{report['meta']['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
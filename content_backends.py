@@ -0,0 +1,558 @@
+"""Storage backends for characters, scenes, scenarios and voices.
+
+``JsonFolderBackend`` is the original layout: every ``content/<type>/*.json``
+file holds ``{"<type>": {id: entity}}`` and the files of a type are merged in
+name order. ``SqliteBackend`` keeps one row per entity in a WAL-mode database,
+so saving one character is a single-row upsert instead of a file rewrite.
+
+Both return the same merged dicts in the same order, so API responses do not
+depend on the backend: by source file name, then in the order entities were
+added to that file (a new scenario lands between its neighbours by file name,
+a new character at the end of chars.json). Converting between them:
+
+    python content_backends.py import [--content content] [--database content.sqlite3]
+    python content_backends.py export [--database content.sqlite3] [--content exported]
+"""
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import content_store
+import metrics
+
+CONTENT_TYPES = ('characters', 'scenes', 'scenarios', 'voices')
+# File a new entity goes to when it does not exist in any file yet
+DEFAULT_SOURCES = {
+    'characters': 'chars.json',
+    'scenes': 'locations.json',
+    'voices': 'voices.json',
+}
+
+
+def default_source(content_type, entity_id):
+    """Scenarios get a file each, the other types share one."""
+    return DEFAULT_SOURCES.get(content_type) or f'{entity_id}.json'
+
+
+def entity_meta(value):
+    """{'version': content hash, 'size': serialized bytes} of one entity."""
+    encoded = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return {'version': hashlib.sha1(encoded).hexdigest()[:16], 'size': len(encoded)}
+
+
+class Snapshot:
+    """Everything loaded for one content type; ``revision`` changes whenever the data does."""
+    __slots__ = ('data', 'meta', 'modified_at', 'revision')
+
+    def __init__(self, data, meta, modified_at, revision):
+        self.data = data
+        self.meta = meta
+        self.modified_at = modified_at
+        self.revision = revision
+
+
+class JsonFolderBackend:
+    name = 'json'
+
+    def __init__(self, content_path, batch_window=0.05):
+        self.content_path = content_path
+        self.writer = content_store.ContentStore(batch_window=batch_window)
+        # Per content type: filepath -> (mtime_ns, size, parsed section, section meta)
+        self._files = {content_type: {} for content_type in CONTENT_TYPES}
+        self._snapshots = {}
+        self._lock = threading.RLock()
+        self.stats = {'files_parsed': 0}
+
+    def _dir(self, content_type):
+        return os.path.join(self.content_path, content_type)
+
+    def load(self, content_type):
+        """Returns the Snapshot of a content type; only added or modified files are parsed again."""
+        with self._lock:
+            dir_path = self._dir(content_type)
+            if not os.path.exists(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+
+            cached_files = self._files[content_type]
+            current = {}
+            for filepath in sorted(glob.glob(os.path.join(dir_path, '*.json'))):
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                current[filepath] = (st.st_mtime_ns, st.st_size)
+
+            snapshot = self._snapshots.get(content_type)
+            if snapshot and current.keys() == cached_files.keys() and all(
+                    cached_files[path][:2] == signature for path, signature in current.items()):
+                return snapshot
+
+            files = {}
+            for filepath, signature in current.items():
+                cached = cached_files.get(filepath)
+                if cached and cached[:2] == signature:
+                    files[filepath] = cached
+                    continue
+
+                filename = os.path.basename(filepath)
+                section = {}
+                started = time.perf_counter()
+                try:
+                    with open(filepath, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                        if content_type in data:
+                            section = data[content_type]
+                        else:
+                            print(f"[WARNING] File {filename} was skipped because it does not contain the top-level key '{content_type}'.")
+                except json.JSONDecodeError as e:
+                    print(f"[ERROR] Failed to decode JSON from {filename}: {e}")
+                except Exception as e:
+                    print(f"[ERROR] An unexpected error occurred while loading {filename}: {e}")
+                metrics.content_parse_seconds.observe(time.perf_counter() - started, backend=self.name,
+                                                      content_type=content_type)
+                self.stats['files_parsed'] += 1
+                files[filepath] = (signature[0], signature[1], section,
+                                   {key: entity_meta(value) for key, value in section.items()})
+
+            combined_data = {}
+            combined_meta = {}
+            for filepath, (_, _, section, section_meta) in files.items():
+                for key in section:
+                    if key in combined_data:
+                        print(f"[WARNING] Duplicate key '{key}' found in {os.path.basename(filepath)}. It will overwrite the existing entry.")
+                combined_data.update(section)
+                combined_meta.update(section_meta)
+
+            self._files[content_type] = files
+            # Entity versions too: a rewrite within the mtime resolution keeps the signature
+            signatures = '|'.join([f'{path}:{mtime}:{size}' for path, (mtime, size) in current.items()]
+                                  + [f"{key}:{meta['version']}" for key, meta in combined_meta.items()])
+            snapshot = Snapshot(combined_data, combined_meta,
+                                max((entry[0] for entry in files.values()), default=0),
+                                hashlib.sha1(signatures.encode('utf-8')).hexdigest())
+            self._snapshots[content_type] = snapshot
+            return snapshot
+
+    def invalidate(self, content_type, paths=()):
+        """Drops the merged snapshot and the parsed ``paths``; load() still checks the
+        mtime and size of every other file, so only changed files are parsed again."""
+        with self._lock:
+            for path in paths:
+                self._files[content_type].pop(path, None)
+            self._snapshots.pop(content_type, None)
+
+    def _owner_file(self, content_type, entity_id):
+        """File the entity is read from (the last one defining it wins the merge)."""
+        self.load(content_type)
+        with self._lock:
+            owner = None
+            for filepath, (_, _, section, _) in self._files[content_type].items():
+                if entity_id in section:
+                    owner = filepath
+            return owner
+
+    def update(self, content_type, entity_id, mutate, expected_version=None):
+        """Replaces an entity with ``mutate(current value or None)``; returns its new version."""
+        path = (self._owner_file(content_type, entity_id)
+                or os.path.join(self._dir(content_type), default_source(content_type, entity_id)))
+
+        def apply(data):
+            section = data.setdefault(content_type, {})
+            current = section.get(entity_id)
+            content_store.check_version(entity_id, current, expected_version)
+            value = mutate(current)
+            section[entity_id] = value
+            return entity_meta(value)['version']
+
+        try:
+            return self.writer.update(path, apply, default={content_type: {}})
+        finally:
+            self.invalidate(content_type, [path])
+
+    def delete(self, content_type, entity_ids):
+        """Removes entities from whichever files define them; returns the removed ids."""
+        by_file = {}
+        self.load(content_type)
+        with self._lock:
+            for filepath, (_, _, section, _) in self._files[content_type].items():
+                for entity_id in entity_ids:
+                    if entity_id in section:
+                        by_file.setdefault(filepath, []).append(entity_id)
+
+        removed = []
+        try:
+            for filepath, ids in by_file.items():
+                def apply(data, ids=ids):
+                    section = data.get(content_type, {})
+                    found = [entity_id for entity_id in ids if entity_id in section]
+                    for entity_id in found:
+                        del section[entity_id]
+                    return found
+                removed.extend(self.writer.update(filepath, apply, default={content_type: {}}))
+        finally:
+            self.invalidate(content_type, by_file)
+        return sorted(set(removed))
+
+    def import_file(self, content_type, filename, stream):
+        """Stores an uploaded content file as-is; its entities replace those of a same-named file."""
+        path = os.path.join(self._dir(content_type), filename)
+        try:
+            content_store.atomic_write_file(path, stream)
+        finally:
+            self.invalidate(content_type, [path])
+
+    def import_files(self, files):
+        """Writes several parsed content files, ``(content_type, filename, section)`` each: all or none.
+
+        Every file is written to a temp file first; the renames happen under the
+        locks of all target files, and the files replaced so far are restored if
+        one of them fails.
+        """
+        staged = []
+        replaced = []  # (path, backup path or None)
+        try:
+            for content_type, filename, section in files:
+                path = os.path.join(self._dir(content_type), filename)
+                staged.append((path, content_store.write_temp_json(path, {content_type: section})))
+            with contextlib.ExitStack() as locks:
+                # Sorted, so two imports lock shared files in the same order
+                for path in sorted({path for path, _ in staged}):
+                    locks.enter_context(content_store.FileLock(path))
+                try:
+                    for path, temp_path in staged:
+                        backup = None
+                        if os.path.exists(path):
+                            backup = temp_path + '.bak'
+                            os.link(path, backup)
+                        os.replace(temp_path, path)
+                        replaced.append((path, backup))
+                except BaseException:
+                    for path, backup in reversed(replaced):
+                        if backup:
+                            os.replace(backup, path)
+                        else:
+                            os.remove(path)
+                    replaced = []
+                    raise
+        finally:
+            for path, temp_path in staged:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            for _, backup in replaced:
+                if backup and os.path.exists(backup):
+                    os.remove(backup)
+            for content_type, filename, _ in files:
+                self.invalidate(content_type, [os.path.join(self._dir(content_type), filename)])
+
+    def export_entities(self, content_type):
+        """(id, value, source file, modified_at) of every entity, in merge order."""
+        snapshot = self.load(content_type)
+        sources = {}
+        with self._lock:
+            for filepath, (mtime, _, section, _) in self._files[content_type].items():
+                for key in section:
+                    sources[key] = (os.path.basename(filepath), mtime)
+        return [(key, value, *sources[key]) for key, value in snapshot.data.items()]
+
+    def import_entities(self, content_type, entities):
+        """Replaces all entities of a type, one file per source."""
+        dir_path = self._dir(content_type)
+        os.makedirs(dir_path, exist_ok=True)
+        files = {}
+        for entity_id, value, source, _ in entities:
+            files.setdefault(source, {})[entity_id] = value
+        for filepath in glob.glob(os.path.join(dir_path, '*.json')):
+            if os.path.basename(filepath) not in files:
+                print(f"[WARNING] Removing {filepath}: not present in the imported content.")
+                os.remove(filepath)
+        for source, section in files.items():
+            path = os.path.join(dir_path, source)
+            with content_store.FileLock(path):
+                content_store.atomic_write_json(path, {content_type: section})
+        self.invalidate(content_type, [os.path.join(dir_path, source) for source in files])
+
+    def export_cache(self):
+        """The parsed files, keyed by path relative to the content folder (see content_snapshot)."""
+        with self._lock:
+            return {content_type: {os.path.relpath(path, self.content_path): entry for path, entry in files.items()}
+                    for content_type, files in self._files.items()}
+
+    def seed_cache(self, state):
+        """Adopts parsed files from ``export_cache``; load() still re-parses every file
+        whose mtime or size differs, so a stale entry is never served."""
+        with self._lock:
+            for content_type, files in state.items():
+                if content_type in self._files:
+                    self._files[content_type] = {os.path.join(self.content_path, relative): tuple(entry)
+                                                 for relative, entry in files.items()}
+                    self._snapshots.pop(content_type, None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['files_cached'] = sum(len(files) for files in self._files.values())
+        stats['writes'] = self.writer.get_stats()
+        return stats
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    data TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at INTEGER NOT NULL,
+    PRIMARY KEY (type, id)
+) WITHOUT ROWID;
+DROP INDEX IF EXISTS entities_position;
+CREATE INDEX IF NOT EXISTS entities_order ON entities (type, source, position);
+CREATE TABLE IF NOT EXISTS revisions (
+    type TEXT PRIMARY KEY,
+    revision INTEGER NOT NULL,
+    modified_at INTEGER NOT NULL
+);
+"""
+
+
+class SqliteBackend:
+    """One row per entity; readers never block the writer thanks to WAL."""
+    name = 'sqlite'
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._local = threading.local()
+        # Per content type: entity id -> (version, parsed value), so only changed rows are parsed
+        self._entities = {content_type: {} for content_type in CONTENT_TYPES}
+        self._snapshots = {}
+        self._lock = threading.RLock()
+        self.stats = {'rows_parsed': 0, 'upserts': 0, 'deletes': 0, 'conflicts': 0}
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.database_path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, immediate=False):
+        backend = self
+
+        class Transaction:
+            def __enter__(self):
+                self.conn = backend._connect()
+                # IMMEDIATE takes the write lock up front, so read-check-write cannot interleave
+                self.conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+                return self.conn
+
+            def __exit__(self, exc_type, *exc_info):
+                self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+        return Transaction()
+
+    def load(self, content_type):
+        """Returns the Snapshot of a content type; rows whose version did not change are not re-parsed."""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT revision, modified_at FROM revisions WHERE type = ?', (content_type,)).fetchone()
+            revision, modified_at = row or (0, 0)
+            with self._lock:
+                snapshot = self._snapshots.get(content_type)
+                if snapshot and snapshot.revision == revision:
+                    return snapshot
+
+            # The JSON backend's merge order: file name, then position in the file
+            rows = conn.execute('SELECT id, version, size FROM entities WHERE type = ? ORDER BY source, position',
+                                (content_type,)).fetchall()
+            with self._lock:
+                cached = self._entities[content_type]
+                stale = [entity_id for entity_id, version, _ in rows
+                         if entity_id not in cached or cached[entity_id][0] != version]
+            fresh = {}
+            for start in range(0, len(stale), 500):
+                chunk = stale[start:start + 500]
+                started = time.perf_counter()
+                query = f"SELECT id, version, data FROM entities WHERE type = ? AND id IN ({','.join('?' * len(chunk))})"
+                for entity_id, version, data in conn.execute(query, (content_type, *chunk)):
+                    fresh[entity_id] = (version, json.loads(data))
+                metrics.content_parse_seconds.observe(time.perf_counter() - started, backend=self.name,
+                                                      content_type=content_type)
+
+        with self._lock:
+            self.stats['rows_parsed'] += len(fresh)
+            entities = {entity_id: fresh.get(entity_id) or cached[entity_id] for entity_id, _, _ in rows}
+            self._entities[content_type] = entities
+            snapshot = Snapshot(
+                {entity_id: value for entity_id, (_, value) in entities.items()},
+                {entity_id: {'version': version, 'size': size} for entity_id, version, size in rows},
+                modified_at, revision)
+            self._snapshots[content_type] = snapshot
+            return snapshot
+
+    def invalidate(self, content_type):
+        with self._lock:
+            self._snapshots.pop(content_type, None)
+
+    def _bump(self, conn, content_type, modified_at=None):
+        conn.execute(
+            'INSERT INTO revisions (type, revision, modified_at) VALUES (?, 1, ?) '
+            'ON CONFLICT (type) DO UPDATE SET revision = revision + 1, modified_at = excluded.modified_at',
+            (content_type, modified_at or time.time_ns()))
+
+    def _upsert(self, conn, content_type, entity_id, value, source, position=None, updated_at=None):
+        meta = entity_meta(value)
+        if position is None:
+            position = conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM entities WHERE type = ?',
+                                    (content_type,)).fetchone()[0]
+        conn.execute(
+            'INSERT INTO entities (type, id, position, source, data, version, size, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (type, id) DO UPDATE SET data = excluded.data, version = excluded.version, '
+            'size = excluded.size, updated_at = excluded.updated_at',
+            (content_type, entity_id, position, source,
+             json.dumps(value, ensure_ascii=False, separators=(',', ':')),
+             meta['version'], meta['size'], updated_at or time.time_ns()))
+        return meta['version']
+
+    def update(self, content_type, entity_id, mutate, expected_version=None):
+        """Replaces an entity with ``mutate(current value or None)``; returns its new version."""
+        with self._transaction(immediate=True) as conn:
+            row = conn.execute('SELECT data FROM entities WHERE type = ? AND id = ?',
+                               (content_type, entity_id)).fetchone()
+            current = json.loads(row[0]) if row else None
+            try:
+                content_store.check_version(entity_id, current, expected_version)
+            except content_store.VersionConflict:
+                with self._lock:
+                    self.stats['conflicts'] += 1
+                raise
+            version = self._upsert(conn, content_type, entity_id, mutate(current),
+                                   default_source(content_type, entity_id))
+            self._bump(conn, content_type)
+        with self._lock:
+            self.stats['upserts'] += 1
+        return version
+
+    def delete(self, content_type, entity_ids):
+        removed = []
+        with self._transaction(immediate=True) as conn:
+            for entity_id in entity_ids:
+                if conn.execute('DELETE FROM entities WHERE type = ? AND id = ?', (content_type, entity_id)).rowcount:
+                    removed.append(entity_id)
+            if removed:
+                self._bump(conn, content_type)
+        with self._lock:
+            self.stats['deletes'] += len(removed)
+        return sorted(removed)
+
+    def _import_section(self, conn, content_type, filename, section):
+        conn.execute('DELETE FROM entities WHERE type = ? AND source = ?', (content_type, filename))
+        for entity_id, value in section.items():
+            self._upsert(conn, content_type, entity_id, value, filename)
+        self._bump(conn, content_type)
+        with self._lock:
+            self.stats['upserts'] += len(section)
+
+    def import_file(self, content_type, filename, stream):
+        """Same contract as saving the file into the folder: its entities replace those of a same-named file."""
+        data = json.load(stream)
+        section = data.get(content_type) if isinstance(data, dict) else None
+        if not isinstance(section, dict):
+            raise ValueError(f"{filename} does not contain the top-level key '{content_type}'")
+        with self._transaction(immediate=True) as conn:
+            self._import_section(conn, content_type, filename, section)
+
+    def import_files(self, files):
+        """Same as ``import_file`` for several parsed files, in a single transaction."""
+        with self._transaction(immediate=True) as conn:
+            for content_type, filename, section in files:
+                self._import_section(conn, content_type, filename, section)
+
+    def export_entities(self, content_type):
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT id, data, source, updated_at FROM entities WHERE type = ? '
+                                'ORDER BY source, position',
+                                (content_type,)).fetchall()
+        return [(entity_id, json.loads(data), source, updated_at) for entity_id, data, source, updated_at in rows]
+
+    def import_entities(self, content_type, entities):
+        """Replaces all entities of a type, keeping the given order, sources and timestamps."""
+        with self._transaction(immediate=True) as conn:
+            conn.execute('DELETE FROM entities WHERE type = ?', (content_type,))
+            for position, (entity_id, value, source, updated_at) in enumerate(entities):
+                self._upsert(conn, content_type, entity_id, value, source, position, updated_at)
+            self._bump(conn, content_type, max((entity[3] for entity in entities), default=0) or None)
+        self.invalidate(content_type)
+
+    def export_cache(self):
+        """The parsed rows (see content_snapshot)."""
+        with self._lock:
+            return {content_type: dict(entities) for content_type, entities in self._entities.items()}
+
+    def seed_cache(self, state):
+        """Adopts parsed rows from ``export_cache``; load() re-reads rows whose version differs."""
+        with self._lock:
+            for content_type, entities in state.items():
+                if content_type in self._entities:
+                    self._entities[content_type] = {entity_id: tuple(entry) for entity_id, entry in entities.items()}
+                    self._snapshots.pop(content_type, None)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['rows_cached'] = sum(len(entities) for entities in self._entities.values())
+            return stats
+
+
+def create_backend(name, content_path, database_path, batch_window=0.05):
+    if name == 'sqlite':
+        return SqliteBackend(database_path)
+    if name == 'json':
+        return JsonFolderBackend(content_path, batch_window=batch_window)
+    raise ValueError(f'Unknown content backend: {name}')
+
+
+def copy_content(source, target):
+    """Copies every content type from one backend to another; returns entity counts."""
+    counts = {}
+    for content_type in CONTENT_TYPES:
+        entities = source.export_entities(content_type)
+        target.import_entities(content_type, entities)
+        counts[content_type] = len(entities)
+    return counts
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Convert content between JSON folders and SQLite.')
+    parser.add_argument('direction', choices=('import', 'export'),
+                        help='import: JSON folders -> SQLite, export: SQLite -> JSON folders')
+    parser.add_argument('--content', default=None, help='content folder (default: content, or exported for export)')
+    parser.add_argument('--database', default=os.path.join(base_dir, 'content.sqlite3'))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    database = SqliteBackend(args.database)
+    if args.direction == 'import':
+        folders = JsonFolderBackend(args.content or os.path.join(base_dir, 'content'))
+        counts = copy_content(folders, database)
+    else:
+        folders = JsonFolderBackend(args.content or os.path.join(base_dir, 'exported'))
+        counts = copy_content(database, folders)
+    print(json.dumps({'counts': counts, 'elapsed_s': round(time.perf_counter() - started, 3)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
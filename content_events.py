@@ -0,0 +1,220 @@
+"""Change feed behind the /api/events Server-Sent Events stream.
+
+A single watcher thread per process refreshes the content manager and the
+asset index, diffs entity versions and appends one event per changed entity
+to a bounded ring buffer. Streams do not get a queue each: they read the
+buffer from their last event id whenever the watcher publishes.
+
+How much an idle stream costs depends on the server. Under WSGI (``python
+app.py``, gunicorn, waitress) a response body is produced on a server thread,
+so every open stream holds one thread, blocked in ``stream``; ``max_clients``
+(SSE_MAX_CLIENTS) bounds them, and only the editors subscribe there. Under
+asgi.py, ``stream_async`` waits on the event loop instead: a publish wakes all
+streams at once and an idle stream holds no thread, only its connection, so
+the running game subscribes as well.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+BUFFER_SIZE = 1000
+# The asset index is rescanned when an asset folder's mtime changes (a file was
+# added, removed or renamed over); a full scan every this many seconds catches
+# files edited in place
+FULL_SCAN_INTERVAL = 60.0
+
+
+def stream_params(types, last_event_id):
+    """``?types=`` and Last-Event-ID as passed to ``stream``: (set or None, int or None)."""
+    types = {value for value in (types or '').split(',') if value} or None
+    try:
+        last_event_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        last_event_id = None
+    return types, last_event_id
+
+
+class ChangeFeed:
+    def __init__(self, content_manager, assets_index=None, interval=2.0, max_clients=32,
+                 heartbeat=15.0, max_duration=300.0):
+        self.content_manager = content_manager
+        self.assets_index = assets_index
+        self.interval = interval
+        self.max_clients = max_clients
+        self.heartbeat = heartbeat
+        self.max_duration = max_duration
+        self._events = deque(maxlen=BUFFER_SIZE)  # (id, event dict)
+        self._last_id = 0
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._clients = 0
+        # (event loop, asyncio.Event) of every stream_async waiting for events
+        self._waiters = set()
+        self._thread = None
+        self._folder_stamp = None
+        self._full_scan_at = 0.0
+        self.stats = {'polls': 0, 'events': 0, 'rejected_clients': 0}
+        # (type, id) -> version as of the last poll
+        self._known = self._snapshot()
+
+    def _snapshot(self):
+        versions = {}
+        manager = self.content_manager.refresh()
+        for content_type in manager.CONTENT_TYPES:
+            for entity_id, meta in manager.meta[content_type].items():
+                versions[(content_type, entity_id)] = meta['version']
+        if self.assets_index is not None:
+            # Listing and stat-ing every asset costs more than the few folder stats
+            stamp = self.assets_index.folder_stamp()
+            if stamp != self._folder_stamp or time.monotonic() - self._full_scan_at >= FULL_SCAN_INTERVAL:
+                self.assets_index.scan()
+                self._folder_stamp = stamp
+                self._full_scan_at = time.monotonic()
+            for entry in self.assets_index.entries():
+                versions[('assets', entry['path'])] = entry['hash']
+        return versions
+
+    def poll(self):
+        """Diffs the current versions against the last poll and publishes the changes."""
+        current = self._snapshot()
+        changes = []
+        for key, version in current.items():
+            if self._known.get(key) != version:
+                changes.append({'type': key[0], 'id': key[1], 'version': version})
+        for key in self._known.keys() - current.keys():
+            changes.append({'type': key[0], 'id': key[1], 'version': None})
+        self._known = current
+        self.stats['polls'] += 1
+        if changes:
+            self.publish(changes)
+        return changes
+
+    def publish(self, changes):
+        with self._condition:
+            for change in changes:
+                self._last_id += 1
+                self._events.append((self._last_id, change))
+            self.stats['events'] += len(changes)
+            self._condition.notify_all()
+            for loop, event in self._waiters:
+                try:
+                    loop.call_soon_threadsafe(event.set)
+                except RuntimeError:  # the loop was closed
+                    pass
+
+    def notify(self):
+        """Wakes the watcher right away (after a write in this process)."""
+        self._wakeup.set()
+
+    def start(self):
+        if not self.interval or self._thread:
+            return
+
+        def watch():
+            while True:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    self.poll()
+                except Exception as e:
+                    print(f"[ERROR] Content watcher failed: {e}")
+
+        self._thread = threading.Thread(target=watch, name='content-watcher', daemon=True)
+        self._thread.start()
+
+    def acquire_client(self):
+        with self._condition:
+            if self._clients >= self.max_clients:
+                self.stats['rejected_clients'] += 1
+                return False
+            self._clients += 1
+            return True
+
+    def release_client(self):
+        with self._condition:
+            self._clients -= 1
+
+    def last_id(self):
+        with self._condition:
+            return self._last_id
+
+    def _open(self, last_event_id):
+        """The first frames of a stream and the event id it continues after."""
+        frames = ['retry: 3000\n\n']
+        with self._condition:
+            oldest = self._events[0][0] if self._events else self._last_id + 1
+            cursor = self._last_id if last_event_id is None else last_event_id
+            if last_event_id is not None and not oldest - 1 <= last_event_id <= self._last_id:
+                # Missed more than the buffer holds (or the server restarted and ids
+                # started over): the client has to reload everything
+                frames.append(f'id: {self._last_id}\nevent: reset\ndata: {{}}\n\n')
+                cursor = self._last_id
+        return frames, cursor
+
+    def _take(self, cursor, types):
+        """Frames for the events after ``cursor`` (a ping if there are none) and the new cursor.
+        Must be called with the condition held."""
+        pending = [(event_id, change) for event_id, change in self._events if event_id > cursor]
+        if not pending:
+            return [': ping\n\n'], self._last_id
+        return [f"id: {event_id}\nevent: change\ndata: {json.dumps(change, ensure_ascii=False)}\n\n"
+                for event_id, change in pending if not types or change['type'] in types], self._last_id
+
+    def stream(self, last_event_id=None, types=None):
+        """Yields SSE frames until ``max_duration``; the browser then reconnects with Last-Event-ID.
+
+        Blocks the calling thread between events. Must be called after ``acquire_client``
+        succeeded. The caller releases the slot when the response is closed: a generator
+        that never started (HEAD, early disconnect) would never run a ``finally``.
+        """
+        frames, cursor = self._open(last_event_id)
+        yield from frames
+        deadline = time.monotonic() + self.max_duration
+        while time.monotonic() < deadline:
+            with self._condition:
+                if self._last_id <= cursor:
+                    self._condition.wait(min(self.heartbeat, max(0.0, deadline - time.monotonic())))
+                frames, cursor = self._take(cursor, types)
+            yield from frames
+
+    async def stream_async(self, last_event_id=None, types=None):
+        """``stream`` for an event loop: waits without holding a thread. The caller
+        acquires and releases the client slot."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._condition:
+            self._waiters.add(waiter)
+        try:
+            frames, cursor = self._open(last_event_id)
+            for frame in frames:
+                yield frame
+            deadline = time.monotonic() + self.max_duration
+            while time.monotonic() < deadline:
+                with self._condition:
+                    # Cleared under the lock, so a publish from now on sets it again
+                    waiting = self._last_id <= cursor
+                    if waiting:
+                        event.clear()
+                if waiting:
+                    try:
+                        await asyncio.wait_for(event.wait(),
+                                               min(self.heartbeat, max(0.0, deadline - time.monotonic())))
+                    except asyncio.TimeoutError:
+                        pass
+                with self._condition:
+                    frames, cursor = self._take(cursor, types)
+                for frame in frames:
+                    yield frame
+        finally:
+            with self._condition:
+                self._waiters.discard(waiter)
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self.stats)
+            stats['clients'] = self._clients
+            stats['last_id'] = self._last_id
+            stats['buffered'] = len(self._events)
+            return stats
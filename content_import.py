@@ -0,0 +1,311 @@
+"""Bulk import of content bundles.
+
+A bundle is a zip archive (or a multipart upload of many files) holding
+content JSON files and the images and audio they reference:
+
+    characters/*.json, scenes/*.json, scenarios/*.json, voices/*.json
+    static/locations/..., static/character_images/<id>/..., static/audio/{bgm,sfx,voice}/...
+
+JSON files may also sit at the top level; their type is then taken from their
+top-level key. Everything is extracted into a staging folder first, validated
+in parallel (JSON structure, entity ids, image and audio files, and every
+``/static/...`` path the content references), and only committed if no file
+has an error: the assets are moved into place and the content files are
+written through ``backend.import_files``, which is all-or-nothing itself.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+
+import audio_pipeline
+import content_backends
+import image_pipeline
+import scenario_graph
+
+try:
+    from PIL import Image
+except ImportError:  # images are then only checked by extension
+    Image = None
+
+MAX_FILES = 2000
+MAX_BYTES = 1024 * 1024 * 1024
+MAX_ID_LENGTH = 50
+
+# Folder under static/ -> accepted extensions; subfolders are allowed below them
+ASSET_FOLDERS = {
+    'locations': image_pipeline.SOURCE_EXTENSIONS,
+    'character_images': image_pipeline.SOURCE_EXTENSIONS,
+    'audio/bgm': audio_pipeline.SOURCE_EXTENSIONS,
+    'audio/sfx': audio_pipeline.SOURCE_EXTENSIONS,
+    'audio/voice': audio_pipeline.SOURCE_EXTENSIONS,
+}
+
+
+class BundleTooLarge(Exception):
+    pass
+
+
+def is_valid_id(entity_id):
+    return (isinstance(entity_id, str) and 0 < len(entity_id) <= MAX_ID_LENGTH
+            and entity_id.replace('_', '').replace('-', '').isalnum())
+
+
+def static_refs(value, found=None):
+    """Every ``/static/...`` string anywhere inside a JSON value."""
+    found = set() if found is None else found
+    if isinstance(value, str):
+        if value.startswith('/static/'):
+            found.add(value.split('?', 1)[0])
+    elif isinstance(value, dict):
+        for item in value.values():
+            static_refs(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            static_refs(item, found)
+    return found
+
+
+def classify(name):
+    """Maps a path inside the bundle to ``('content', type or None, filename)``,
+    ``('asset', folder, static URL)`` or ``None`` when it has no place in the tree."""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or any(part == '..' for part in parts):
+        return None
+    safe = [secure_filename(part) for part in parts]
+    if not all(safe):
+        return None
+    extension = os.path.splitext(safe[-1])[1].lower()
+
+    if extension == '.json':
+        if parts[0] == 'content':
+            safe = safe[1:]
+        if len(safe) == 1:
+            return ('content', None, safe[0])
+        if len(safe) == 2 and safe[0] in content_backends.CONTENT_TYPES:
+            return ('content', safe[0], safe[1])
+        return None
+
+    if parts[0] == 'static':
+        safe = safe[1:]
+    relative = '/'.join(safe)
+    for folder, extensions in ASSET_FOLDERS.items():
+        if relative.startswith(folder + '/') and extension in extensions:
+            return ('asset', folder, f'/static/{relative}')
+    return None
+
+
+class BundleImport:
+    """One import: ``add_zip``/``add_file``, then ``validate`` and ``commit``; use as a context manager
+    so the staging folder is always removed."""
+
+    def __init__(self, backend, static_root, staging_root, workers=None, max_files=MAX_FILES, max_bytes=MAX_BYTES):
+        self.backend = backend
+        self.static_root = os.path.abspath(static_root)
+        self.workers = workers
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        os.makedirs(staging_root, exist_ok=True)
+        # Staged next to the live tree, so committing is a rename on the same filesystem
+        self.staging = tempfile.mkdtemp(prefix='import-', dir=staging_root)
+        self.files = []  # one result dict per file, in bundle order
+        self.total_bytes = 0
+        self.timing = {'extract_ms': 0.0, 'validate_ms': 0.0, 'commit_ms': 0.0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def _stage(self, name, stream):
+        if len(self.files) >= self.max_files:
+            raise BundleTooLarge(f'more than {self.max_files} files')
+        result = {'name': name, 'status': 'ok', 'error': None, 'warnings': []}
+        self.files.append(result)
+        target = classify(name)
+        if target is None:
+            result.update(status='skipped', error='unknown location or file type')
+            return
+        result['kind'], result['type'], result['target'] = target
+
+        result['staged'] = os.path.join(self.staging, str(len(self.files)))
+        size = 0
+        with open(result['staged'], 'wb') as f:
+            # Counted while copying: sizes in zip headers can lie
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                size += len(chunk)
+                self.total_bytes += len(chunk)
+                if self.total_bytes > self.max_bytes:
+                    raise BundleTooLarge(f'more than {self.max_bytes} bytes')
+                f.write(chunk)
+        result['size'] = size
+
+    def add_zip(self, stream):
+        started = time.perf_counter()
+        try:
+            with zipfile.ZipFile(stream) as archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                        continue
+                    with archive.open(info) as member:
+                        self._stage(name, member)
+        finally:
+            self.timing['extract_ms'] += (time.perf_counter() - started) * 1000
+
+    def add_file(self, name, stream):
+        started = time.perf_counter()
+        try:
+            self._stage(name, stream)
+        finally:
+            self.timing['extract_ms'] += (time.perf_counter() - started) * 1000
+
+    def _validate_content(self, result):
+        with open(result['staged'], 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError('the file must hold a JSON object')
+        keys = [key for key in data if key in content_backends.CONTENT_TYPES]
+        content_type = result['type']
+        if content_type is None:
+            if len(keys) != 1:
+                raise ValueError('cannot tell the content type: expected one of ' +
+                                 ', '.join(content_backends.CONTENT_TYPES) + ' as the top-level key')
+            content_type = result['type'] = keys[0]
+        section = data.get(content_type)
+        if not isinstance(section, dict):
+            raise ValueError(f"missing top-level key '{content_type}'")
+
+        bad_ids = [entity_id for entity_id, value in section.items()
+                   if not is_valid_id(entity_id) or not isinstance(value, dict)]
+        if bad_ids:
+            raise ValueError('invalid ids or entities: ' + ', '.join(map(str, bad_ids[:10])))
+        if content_type == 'scenarios':
+            for scenario_id, scenario in section.items():
+                issues = scenario_graph.compile_scenario(scenario_id, scenario)['issues']
+                if issues['missing_start']:
+                    result['warnings'].append(f'{scenario_id}: start dialogue not found')
+                if issues['dangling_edges']:
+                    result['warnings'].append(f"{scenario_id}: {len(issues['dangling_edges'])} links to missing dialogues")
+
+        result['section'] = section
+        result['entities'] = len(section)
+        result['refs'] = static_refs(section)
+
+    def _validate_asset(self, result):
+        path = result['staged']
+        if result['size'] == 0:
+            raise ValueError('empty file')
+        if result['type'] in ('locations', 'character_images'):
+            if Image is not None:
+                with Image.open(path) as image:
+                    image.verify()
+        elif result['target'].lower().endswith('.wav'):
+            if audio_pipeline.probe_duration(path) is None:
+                raise ValueError('unreadable WAV file')
+
+    def _validate_one(self, result):
+        started = time.perf_counter()
+        try:
+            if result['kind'] == 'content':
+                self._validate_content(result)
+            else:
+                self._validate_asset(result)
+        except Exception as e:
+            result.update(status='error', error=str(e) or type(e).__name__)
+        result['validate_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def validate(self, existing_ids):
+        """Checks every staged file; ``existing_ids`` maps content type -> ids already stored.
+        Returns True if the bundle can be committed."""
+        started = time.perf_counter()
+        staged = [result for result in self.files if result['status'] == 'ok']
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self._validate_one, staged))
+
+        # Two files claiming the same target
+        seen = {}
+        for result in staged:
+            key = (result['type'], result['target'])
+            if result['status'] == 'ok' and key in seen:
+                result.update(status='error', error=f"same target as {seen[key]}")
+            seen.setdefault(key, result['name'])
+
+        bundle_assets = {result['target'] for result in staged if result['kind'] == 'asset' and result['status'] == 'ok'}
+        known = {content_type: set(ids) for content_type, ids in existing_ids.items()}
+        for result in staged:
+            if result['kind'] == 'content' and result['status'] == 'ok':
+                known.setdefault(result['type'], set()).update(result['section'])
+
+        for result in staged:
+            if result['kind'] != 'content' or result['status'] != 'ok':
+                continue
+            missing = sorted(url for url in result.pop('refs') if url not in bundle_assets and not self._exists(url))
+            if missing:
+                result.update(status='error', error='missing assets: ' + ', '.join(missing[:10]))
+                continue
+            if result['type'] == 'scenarios':
+                for scenario_id, scenario in result['section'].items():
+                    character_ids, scene_ids = scenario_graph.collect_refs(scenario)
+                    unknown = sorted((character_ids - known.get('characters', set())) |
+                                     (scene_ids - known.get('scenes', set())))
+                    if unknown:
+                        result['warnings'].append(f"{scenario_id}: unknown characters or scenes: {', '.join(unknown[:10])}")
+
+        self.timing['validate_ms'] += (time.perf_counter() - started) * 1000
+        return not any(result['status'] == 'error' for result in self.files)
+
+    def _exists(self, url):
+        path = os.path.abspath(os.path.join(self.static_root, *url[len('/static/'):].split('/')))
+        return path.startswith(self.static_root + os.sep) and os.path.isfile(path)
+
+    def commit(self):
+        """Moves the assets into static/ and writes the content; undoes the asset moves if the content
+        write fails. Returns the committed results."""
+        started = time.perf_counter()
+        assets = [result for result in self.files if result['status'] == 'ok' and result['kind'] == 'asset']
+        contents = [result for result in self.files if result['status'] == 'ok' and result['kind'] == 'content']
+        moved = []  # (target path, backup path or None)
+        try:
+            for result in assets:
+                target = os.path.join(self.static_root, *result['target'][len('/static/'):].split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                backup = None
+                if os.path.exists(target):
+                    # A link keeps the old file in place until the new one replaces it
+                    backup = result['staged'] + '.bak'
+                    try:
+                        os.link(target, backup)
+                    except OSError:
+                        shutil.copy2(target, backup)
+                os.replace(result['staged'], target)
+                moved.append((target, backup))
+                result['path'] = target
+            self.backend.import_files([(result['type'], result['target'], result['section']) for result in contents])
+        except BaseException:
+            for target, backup in reversed(moved):
+                if backup:
+                    os.replace(backup, target)
+                elif os.path.exists(target):
+                    os.remove(target)
+            raise
+        finally:
+            self.timing['commit_ms'] += (time.perf_counter() - started) * 1000
+        return assets + contents
+
+    def report(self):
+        """Per-file results and timing, JSON-ready."""
+        files = []
+        for result in self.files:
+            item = {key: result.get(key) for key in ('name', 'status', 'error', 'warnings', 'kind', 'type',
+                                                     'target', 'size', 'entities', 'validate_ms')}
+            files.append({key: value for key, value in item.items() if value not in (None, [])})
+        timing = {key: round(value, 3) for key, value in self.timing.items()}
+        timing['total_ms'] = round(sum(self.timing.values()), 3)
+        return {'files': files, 'timing': timing, 'bytes': self.total_bytes}
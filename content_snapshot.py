@@ -0,0 +1,223 @@
+"""Precompiled content snapshot for fast worker start-up.
+
+    python content_snapshot.py [--output content.snapshot] [--backend json|sqlite]
+
+Parsing every content file and hashing every asset is the bulk of a cold
+start, and each worker (or autoscaled instance) pays it again. The snapshot
+stores the parsed and merged content, the asset index and the asset
+fingerprints in one file that workers load at start-up instead. Building it
+also compiles every scenario, so broken graphs show up before deployment.
+
+Nothing in it is trusted blindly: parsed files carry their mtime and size and
+rows their version, so the backend re-reads whatever changed since the
+snapshot was built, and asset entries are re-probed when the file differs. A
+snapshot written by other code (``code`` hash) or another format is ignored
+as a whole and everything is parsed as before.
+
+Compiled graphs are not stored: unpickling one costs about as much as
+compiling it from the parsed scenario, so the manager compiles on first use.
+
+Layout: ``MAGIC``, the length of the directory, the pickled directory, then
+one pickled blob per section. Pickle executes code on load, so the snapshot
+must come from this command, like the code itself.
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import pickle
+import struct
+import time
+from datetime import datetime
+
+import asset_fingerprints
+import asset_index
+import content_backends
+import scenario_graph
+
+SNAPSHOT_FORMAT = 1
+MAGIC = b'SWVNE-SNAPSHOT\n'
+DIRECTORY_LENGTH = struct.Struct('<Q')
+# Modules whose output the snapshot caches; changing any of them invalidates it
+CODE_MODULES = ('asset_fingerprints', 'asset_index', 'content_backends', 'content_snapshot', 'scenario_graph')
+
+
+def code_version():
+    digest = hashlib.sha1()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in CODE_MODULES:
+        with open(os.path.join(base_dir, f'{module}.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def _loads(data):
+    # Unpickling creates millions of containers; the cyclic GC would rescan them over and over
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def write_snapshot(path, backend, assets_index=None, fingerprints=None):
+    """Loads everything through ``backend``, compiles every scenario to validate it and
+    writes the file atomically. Returns a summary."""
+    started = time.perf_counter()
+    for content_type in content_backends.CONTENT_TYPES:
+        backend.load(content_type)
+
+    with_errors = 0
+    for scenario_id, scenario in backend.load('scenarios').data.items():
+        compiled = scenario_graph.compile_scenario(scenario_id, scenario)
+        if scenario_graph.has_errors(compiled):
+            with_errors += 1
+            for message in scenario_graph.summarize_issues(compiled):
+                print(f"[WARNING] Scenario '{scenario_id}': {message}")
+
+    sections = {'content': backend.export_cache()}
+    if assets_index is not None:
+        sections['assets'] = assets_index.export_cache()
+    if fingerprints is not None:
+        sections['fingerprints'] = fingerprints.export_cache()
+
+    directory = {
+        'format': SNAPSHOT_FORMAT,
+        'code': code_version(),
+        'backend': backend.name,
+        'created_at': time.time(),
+        'sections': {},  # name -> (offset after the directory, length)
+    }
+    blobs = []
+    offset = 0
+    for name, value in sections.items():
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        directory['sections'][name] = (offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+
+    directory_blob = pickle.dumps(directory, pickle.HIGHEST_PROTOCOL)
+    temp_path = f'{path}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(DIRECTORY_LENGTH.pack(len(directory_blob)))
+            f.write(directory_blob)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return {
+        'path': path,
+        'backend': backend.name,
+        'code': directory['code'],
+        'entities': {content_type: len(backend.load(content_type).data)
+                     for content_type in content_backends.CONTENT_TYPES},
+        'scenarios_with_errors': with_errors,
+        'assets': len(sections.get('assets', ())),
+        'fingerprints': len(sections.get('fingerprints', ())),
+        'size': os.path.getsize(path),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+class SnapshotFile:
+    """A snapshot opened for reading; see ``open``. Sections are read when seeded.
+
+    The file stays open until ``close``, so a snapshot rebuilt in the meantime
+    (a rename over this one) does not mix old offsets with new contents.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            if self._file.read(len(MAGIC)) != MAGIC:
+                raise ValueError('not a content snapshot')
+            (length,) = DIRECTORY_LENGTH.unpack(self._file.read(DIRECTORY_LENGTH.size))
+            self.directory = _loads(self._file.read(length))
+            self._base = len(MAGIC) + DIRECTORY_LENGTH.size + length
+            if self.directory.get('format') != SNAPSHOT_FORMAT:
+                raise ValueError(f"format {self.directory.get('format')}, expected {SNAPSHOT_FORMAT}")
+            if self.directory.get('code') != code_version():
+                raise ValueError('built by a different version of the code')
+        except Exception:
+            self._file.close()
+            raise
+        self.stats = {'sections_loaded': 0, 'load_ms_total': 0.0}
+
+    @classmethod
+    def open(cls, path):
+        """The snapshot at ``path``, or None if there is none or it cannot be used."""
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            snapshot = cls(path)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError, struct.error) as e:
+            print(f"[WARNING] Content snapshot {path} ignored: {e}")
+            return None
+        created_at = datetime.fromtimestamp(snapshot.directory['created_at']).strftime('%Y-%m-%d %H:%M')
+        print(f"Using content snapshot {path} (built {created_at}).")
+        return snapshot
+
+    def seed(self, section, target):
+        """Hands a section to ``target.seed_cache``; returns False if it could not."""
+        if section not in self.directory['sections']:
+            return False
+        if section == 'content' and self.directory['backend'] != target.name:
+            print(f"[WARNING] Content snapshot {self.path} was built for the {self.directory['backend']} backend, "
+                  f"not {target.name}; content will be parsed.")
+            return False
+        offset, length = self.directory['sections'][section]
+        started = time.perf_counter()
+        try:
+            self._file.seek(self._base + offset)
+            value = _loads(self._file.read(length))
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            print(f"[WARNING] Content snapshot {self.path}: section {section} ignored: {e}")
+            return False
+        target.seed_cache(value)
+        self.stats['sections_loaded'] += 1
+        self.stats['load_ms_total'] = round(self.stats['load_ms_total'] + (time.perf_counter() - started) * 1000, 3)
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update({
+            'path': self.path,
+            'backend': self.directory['backend'],
+            'created_at': self.directory['created_at'],
+        })
+        return stats
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Build the precompiled content snapshot workers start from.')
+    parser.add_argument('--content', default=os.path.join(base_dir, 'content'))
+    parser.add_argument('--static', default=os.path.join(base_dir, 'static'))
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--database', default=os.path.join(base_dir, 'content.sqlite3'))
+    parser.add_argument('--output', default=os.path.join(base_dir, 'content.snapshot'))
+    args = parser.parse_args()
+
+    backend = content_backends.create_backend(args.backend, args.content, args.database)
+    assets = asset_index.AssetIndex(args.static)
+    assets.scan()
+    fingerprints = asset_fingerprints.create_fingerprints(args.static)
+    fingerprints.build()
+    summary = write_snapshot(args.output, backend, assets, fingerprints)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
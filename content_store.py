@@ -0,0 +1,225 @@
+"""Safe writes for the JSON content files.
+
+Every read-modify-write of a content file goes through ``ContentStore.update``:
+
+* a cross-process lock (``<file>.lock`` next to the file) serializes writers
+  across gunicorn workers, the thread lock inside one process;
+* the new content is written to a temp file and moved over the old one, so
+  readers see either the old or the new file, never half of it;
+* edits carry the version (content hash) of the entity they were made
+  against; if the entity changed since, ``VersionConflict`` is raised;
+* edits to the same file that arrive within ``batch_window`` seconds are
+  applied together with a single rewrite.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_SUFFIX = '.lock'
+
+
+class VersionConflict(Exception):
+    """The entity was changed by someone else since the client loaded it."""
+
+    def __init__(self, entity_id, expected, current):
+        super().__init__(f'{entity_id}: expected version {expected!r}, found {current!r}')
+        self.entity_id = entity_id
+        self.expected = expected
+        self.current = current
+
+
+def entity_version(value):
+    """Content hash of one entity; the same value ``content_backends.entity_meta`` reports."""
+    if value is None:
+        return None
+    encoded = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def check_version(entity_id, current_value, expected_version):
+    """Raises VersionConflict unless the entity is still at ``expected_version``.
+
+    ``None`` skips the check; an empty string means the entity must not exist yet.
+    """
+    if expected_version is None:
+        return
+    current = entity_version(current_value)
+    if (current or '') != expected_version:
+        raise VersionConflict(entity_id, expected_version, current)
+
+
+class FileLock:
+    """Exclusive lock on ``<path>.lock``, held across processes and threads."""
+
+    def __init__(self, path):
+        self.lock_path = path + LOCK_SUFFIX
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        self._file = open(self.lock_path, 'a+b')
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10s
+                    continue
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+def read_json(path, default=None):
+    """Parsed file, or a fresh copy of ``default`` if it does not exist."""
+    if not os.path.exists(path):
+        return json.loads(json.dumps(default)) if default is not None else None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_temp_json(path, data):
+    """Writes ``data`` to a fsynced temp file next to ``path`` and returns the temp file's path."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    # The temp name must not end in .json, or the content loader would pick it up
+    temp_path = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return temp_path
+
+
+def atomic_write_json(path, data):
+    """Writes to a temp file in the same folder, fsyncs it and renames it over ``path``."""
+    temp_path = write_temp_json(path, data)
+    try:
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def atomic_write_file(path, stream):
+    """Same as ``atomic_write_json`` for an uploaded file (anything with ``save()``)."""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+    try:
+        stream.save(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class _Edit:
+    __slots__ = ('mutate', 'result', 'error', 'done')
+
+    def __init__(self, mutate):
+        self.mutate = mutate
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ContentStore:
+    def __init__(self, batch_window=0.05):
+        self.batch_window = batch_window
+        self._pending = {}  # path -> [_Edit], the first one's thread commits the batch
+        self._lock = threading.Lock()
+        self.stats = {'edits': 0, 'writes': 0, 'conflicts': 0, 'failed': 0, 'write_ms_total': 0.0}
+
+    def update(self, path, mutate, default=None):
+        """Applies ``mutate(data)`` to the JSON file at ``path`` and returns its result.
+
+        ``mutate`` changes ``data`` in place. It must raise (e.g. VersionConflict)
+        before touching ``data`` if it decides not to apply; its exception is
+        re-raised here and does not affect the other edits of the batch. Blocks
+        until the batch containing this edit is on disk.
+        """
+        edit = _Edit(mutate)
+        path = os.path.abspath(path)
+        with self._lock:
+            batch = self._pending.setdefault(path, [])
+            batch.append(edit)
+            is_leader = len(batch) == 1
+            self.stats['edits'] += 1
+
+        if is_leader:
+            if self.batch_window:
+                time.sleep(self.batch_window)
+            with self._lock:
+                batch = self._pending.pop(path)
+            self._commit(path, batch, default)
+
+        edit.done.wait()
+        if edit.error is not None:
+            raise edit.error
+        return edit.result
+
+    def _commit(self, path, batch, default):
+        started = time.perf_counter()
+        try:
+            with FileLock(path):
+                # Re-read under the lock: another process may have written since
+                data = read_json(path, default if default is not None else {})
+                applied = 0
+                for edit in batch:
+                    try:
+                        edit.result = edit.mutate(data)
+                        applied += 1
+                    except Exception as e:
+                        edit.error = e
+                if applied:
+                    atomic_write_json(path, data)
+            with self._lock:
+                self.stats['writes'] += 1 if applied else 0
+                self.stats['conflicts'] += sum(isinstance(edit.error, VersionConflict) for edit in batch)
+                self.stats['write_ms_total'] = round(
+                    self.stats['write_ms_total'] + (time.perf_counter() - started) * 1000, 3)
+        except Exception as e:
+            print(f"[ERROR] Failed to write {os.path.basename(path)}: {e}")
+            for edit in batch:
+                if edit.error is None:
+                    edit.error = e
+            with self._lock:
+                self.stats['failed'] += 1
+        finally:
+            for edit in batch:
+                edit.done.set()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = sum(len(batch) for batch in self._pending.values())
+            return stats
@@ -0,0 +1,277 @@
+"""Image derivatives for character poses and locations.
+
+Each source image is decoded once, trimmed to its non-transparent area and
+re-encoded as WebP (and AVIF when Pillow supports it) at several widths. Files
+are named after the source content hash, so they can be cached forever, and
+every source gets an entry in static/derivatives/manifest.json.
+
+Character poses are not trimmed: all poses of a character share one canvas,
+and where the figure sits on it is what keeps its size and position steady
+between poses.
+
+Batch run over the existing tree:
+
+    python image_pipeline.py [--workers N] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import content_store
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is optional; without it uploads are stored as-is
+    Image = None
+    features = None
+
+DEFAULT_WIDTHS = (480, 960, 1920)
+SOURCE_FOLDERS = ('character_images', 'locations')
+# Sources kept on their full canvas, see the module docstring
+UNTRIMMED_FOLDERS = ('character_images',)
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+DERIVATIVES_FOLDER = 'derivatives'
+MANIFEST_NAME = 'manifest.json'
+QUALITY = {'webp': 82, 'avif': 60}
+
+
+def is_available():
+    return Image is not None
+
+
+def available_formats():
+    """Output formats this Pillow build can encode, best compression first."""
+    if Image is None:
+        return []
+    formats = []
+    if features.check('avif'):
+        formats.append('avif')
+    if features.check('webp'):
+        formats.append('webp')
+    return formats
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_to_png(path):
+    """Re-encodes an image in place as a real PNG (uploads are always stored under .png)."""
+    if Image is None:
+        return False
+    with Image.open(path) as image:
+        if image.format == 'PNG':
+            return False
+        image.load()
+        converted = image.convert('RGBA') if image.mode not in ('RGB', 'RGBA') else image
+        temp_path = f'{path}.tmp'
+        converted.save(temp_path, format='PNG', optimize=True)
+    os.replace(temp_path, path)
+    return True
+
+
+def should_trim(source_url):
+    return source_url.split('/')[2] not in UNTRIMMED_FOLDERS
+
+
+def process_image(source_path, source_url, output_dir, output_url, widths=DEFAULT_WIDTHS, formats=None,
+                  trim=True):
+    """Builds all derivatives of one image and returns its manifest entry.
+
+    Runs in worker processes, so it only takes and returns plain data.
+    """
+    started = time.perf_counter()
+    formats = formats or available_formats()
+    content_hash = file_hash(source_path)
+    short_hash = content_hash[:16]
+
+    with Image.open(source_path) as image:
+        image.load()
+        original_size = image.size
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        trim_box = None
+        if has_alpha and trim:
+            trim_box = image.getchannel('A').getbbox()
+            if trim_box and trim_box != (0, 0) + image.size:
+                image = image.crop(trim_box)
+
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        # Full-canvas files must not reuse trimmed ones of the same source and width
+        key = short_hash if trim else f'{short_hash}.canvas'
+        os.makedirs(output_dir, exist_ok=True)
+
+        variants = []
+        # Never upscale; the trimmed original width is always one of the variants
+        target_widths = sorted({width for width in widths if width < image.width} | {image.width})
+        for width in target_widths:
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                filename = f'{stem}.{key}.{width}w.{fmt}'
+                path = os.path.join(output_dir, filename)
+                if not os.path.exists(path):
+                    temp_path = f'{path}.tmp'
+                    resized.save(temp_path, format=fmt.upper(), quality=QUALITY.get(fmt, 80))
+                    os.replace(temp_path, path)
+                variants.append({
+                    'url': f'{output_url}/{filename}',
+                    'format': fmt,
+                    'width': width,
+                    'height': height,
+                    'size': os.path.getsize(path),
+                })
+
+    return {
+        'source': source_url,
+        'hash': content_hash,
+        'width': original_size[0],
+        'height': original_size[1],
+        'trim': list(trim_box) if trim_box else None,
+        'source_size': os.path.getsize(source_path),
+        'variants': variants,
+        'process_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+def derivative_target(static_root, source_url):
+    """Output folder and URL for a /static/... source: derivatives mirror the source tree."""
+    relative_dir = os.path.dirname(source_url[len('/static/'):])
+    output_dir = os.path.join(static_root, DERIVATIVES_FOLDER, *relative_dir.split('/'))
+    output_url = f'/static/{DERIVATIVES_FOLDER}/{relative_dir}'
+    return output_dir, output_url
+
+
+def manifest_path(static_root):
+    return os.path.join(static_root, DERIVATIVES_FOLDER, MANIFEST_NAME)
+
+
+def load_manifest(static_root):
+    path = manifest_path(static_root)
+    if not os.path.exists(path):
+        return {'images': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[ERROR] Failed to read image manifest: {e}")
+        return {'images': {}}
+
+
+def update_manifest(static_root, entries=(), removed=()):
+    """Merges entries (and drops removed source URLs) into the manifest atomically.
+
+    The file lock makes the read-modify-write safe across worker processes too.
+    """
+    path = manifest_path(static_root)
+    with content_store.FileLock(path):
+        manifest = load_manifest(static_root)
+        for entry in entries:
+            previous = manifest['images'].get(entry['source'])
+            if previous:
+                # Files of a replaced source (or of an earlier trim setting) are orphans now
+                kept = {variant['url'] for variant in entry['variants']}
+                _remove_variant_files(static_root, dict(previous, variants=[
+                    variant for variant in previous['variants'] if variant['url'] not in kept]))
+            manifest['images'][entry['source']] = entry
+        for source_url in removed:
+            manifest['images'].pop(source_url, None)
+        content_store.atomic_write_json(path, manifest)
+        return manifest
+
+
+def _remove_variant_files(static_root, entry):
+    for variant in entry['variants']:
+        path = os.path.join(static_root, *variant['url'][len('/static/'):].split('/'))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def remove_derivatives(static_root, source_url):
+    """Deletes the derivative files of a source and its manifest entry."""
+    entry = load_manifest(static_root)['images'].get(source_url)
+    if entry:
+        _remove_variant_files(static_root, entry)
+        update_manifest(static_root, removed=[source_url])
+
+
+def find_sources(static_root):
+    """Yields (path, url) for every source image in the pipeline folders."""
+    for folder in SOURCE_FOLDERS:
+        root = os.path.join(static_root, folder)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(SOURCE_EXTENSIONS):
+                    path = os.path.join(dirpath, filename)
+                    relative = os.path.relpath(path, static_root).replace(os.sep, '/')
+                    yield path, f'/static/{relative}'
+
+
+def build_job(static_root, path, source_url, widths):
+    output_dir, output_url = derivative_target(static_root, source_url)
+    return (path, source_url, output_dir, output_url, tuple(widths), tuple(available_formats()),
+            should_trim(source_url))
+
+
+def process_tree(static_root, widths=DEFAULT_WIDTHS, workers=None, force=False):
+    """Processes every source image in a process pool; unchanged sources are skipped."""
+    if Image is None:
+        raise RuntimeError('Pillow is not installed')
+
+    started = time.perf_counter()
+    manifest = load_manifest(static_root)
+    jobs = []
+    for path, source_url in find_sources(static_root):
+        entry = manifest['images'].get(source_url)
+        # Poses trimmed before they were kept on their canvas are rebuilt as well
+        trimmed_pose = entry and entry.get('trim') and not should_trim(source_url)
+        if not force and entry and entry['hash'] == file_hash(path) and not trimmed_pose:
+            continue
+        jobs.append(build_job(static_root, path, source_url, widths))
+
+    entries = []
+    errors = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_image, *job): job[1] for job in jobs}
+        for future in as_completed(futures):
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                errors.append({'source': futures[future], 'error': str(e)})
+                print(f"[ERROR] Failed to process {futures[future]}: {e}")
+
+    if entries:
+        update_manifest(static_root, entries)
+    return {
+        'processed': len(entries),
+        'skipped': len(list(find_sources(static_root))) - len(jobs),
+        'errors': errors,
+        'bytes_in': sum(entry['source_size'] for entry in entries),
+        'bytes_out': sum(variant['size'] for entry in entries for variant in entry['variants']),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build WebP/AVIF derivatives for character poses and locations.')
+    parser.add_argument('--static', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    parser.add_argument('--widths', default=','.join(map(str, DEFAULT_WIDTHS)))
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='rebuild even if the source hash is unchanged')
+    args = parser.parse_args()
+
+    widths = [int(width) for width in args.widths.split(',') if width]
+    report = process_tree(args.static, widths=widths, workers=args.workers, force=args.force)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
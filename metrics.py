@@ -0,0 +1,249 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms live in one module-level registry, so any module can
+record into them without passing objects around (``metrics.content_parse_seconds
+.observe(...)``). Values that other components already track (cache hit
+counters, SSE clients) are read at scrape time through callback gauges.
+
+Each worker process has its own registry; scrape every worker, or run a
+single one, to get the full picture.
+"""
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+
+# Seconds; covers a cached 304 up to a slow bulk import
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Bytes; 1 KiB to 1 GiB in steps of 4
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(11))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in values]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[position] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        lines = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key, [('le', '+Inf')])
+            lines.append(f'{self.name}_bucket{labels} {state[-1]}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(round(state[-2], 6))}')
+            lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+class CallbackMetric:
+    """A gauge or counter whose values come from ``callback()`` at scrape time:
+    a number, or a dict of label value tuples to numbers."""
+
+    def __init__(self, kind, name, help_text, callback, labelnames=()):
+        self.kind = kind
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"[WARNING] Metric {self.name} could not be collected: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(values.items()) if value is not None]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering (e.g. a second app in the same process) replaces the old callback
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_callback(self, name, help_text, callback, labelnames=()):
+        return self.register(CallbackMetric('gauge', name, help_text, callback, labelnames))
+
+    def counter_callback(self, name, help_text, callback, labelnames=()):
+        return self.register(CallbackMetric('counter', name, help_text, callback, labelnames))
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.counter(
+    'swvne_http_requests_total', 'Requests by route, method and status.', ('route', 'method', 'status'))
+http_request_seconds = REGISTRY.histogram(
+    'swvne_http_request_duration_seconds', 'Time to build the response (streamed bodies excluded).',
+    ('route', 'method'))
+http_response_bytes = REGISTRY.counter(
+    'swvne_http_response_bytes_total', 'Response body bytes by route (streamed bodies excluded).', ('route',))
+http_errors = REGISTRY.counter(
+    'swvne_http_errors_total', 'Responses with status 500 or above by route.', ('route', 'status'))
+http_exceptions = REGISTRY.counter(
+    'swvne_http_exceptions_total', 'Exceptions that escaped a view, by route and type.', ('route', 'exception'))
+upload_bytes = REGISTRY.histogram(
+    'swvne_upload_bytes', 'Size of upload requests (multipart uploads and upload chunks).', ('route',), buckets=SIZE_BUCKETS)
+upload_seconds = REGISTRY.histogram(
+    'swvne_upload_duration_seconds', 'Time to receive and process upload requests (multipart uploads and upload chunks).', ('route',))
+slow_requests = REGISTRY.counter(
+    'swvne_slow_requests_total', 'Requests slower than the slow-request threshold.', ('route',))
+content_parse_seconds = REGISTRY.histogram(
+    'swvne_content_parse_seconds', 'Time to read and parse one content file (json) or one batch of rows (sqlite).',
+    ('backend', 'content_type'))
+content_load_seconds = REGISTRY.histogram(
+    'swvne_content_load_seconds', 'Time to reload a content type after it changed.', ('content_type',))
+json_cache_requests = REGISTRY.counter(
+    'swvne_json_cache_requests_total', 'Cached JSON responses by outcome (hit, miss, not_modified, streamed).', ('result',))
+
+
+def route_label(request):
+    """The URL rule (``/api/scenarios/load/<scenario_id>``), so ids do not explode the label set."""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+class RequestProfiler:
+    """Profiles a random sample of requests with cProfile and keeps the profiles of
+    the slow ones as ``.prof`` files (open them with ``python -m pstats`` or snakeviz).
+
+    Requests slower than ``threshold_ms`` are counted and logged whether sampled or not.
+    """
+
+    def __init__(self, folder, sample_rate=0.0, threshold_ms=1000, keep=50):
+        self.folder = folder
+        self.sample_rate = sample_rate
+        self.threshold_ms = threshold_ms
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Returns a running profiler if this request was sampled, else None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active in this thread
+            return None
+        return profiler
+
+    def finish(self, profiler, route, method, elapsed):
+        if profiler is not None:
+            profiler.disable()
+        if self.threshold_ms is None or elapsed * 1000 < self.threshold_ms:
+            return None
+        slow_requests.inc(route=route)
+        if profiler is None:
+            print(f"[WARNING] Slow request: {method} {route} took {elapsed * 1000:.0f} ms")
+            return None
+
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        path = os.path.join(self.folder, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{method}-{slug}.prof")
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            profiler.dump_stats(path)
+            with self._lock:
+                profiles = sorted((entry.path for entry in os.scandir(self.folder) if entry.name.endswith('.prof')),
+                                  key=os.path.getmtime)
+                for old in profiles[:max(0, len(profiles) - self.keep)]:
+                    os.remove(old)
+        except OSError as e:
+            print(f"[ERROR] Failed to save profile of {method} {route}: {e}")
+            return None
+        print(f"[WARNING] Slow request: {method} {route} took {elapsed * 1000:.0f} ms, profile saved to {path}")
+        return path
@@ -0,0 +1,326 @@
+"""Headless playthrough explorer: coverage and regression checks for scenarios.
+
+    python playthrough_explorer.py [scenario ...] [--workers 4] [--max-states 1000000]
+                                   [--output report.json] [--fail-on-issues]
+
+Plays every branch of a scenario with the rules of the game client
+(scenario_engine): each state is a dialogue on screen plus the player's
+variables, and every available choice (or the click to the next line) leads to
+the next state. Identical (dialogue, variables) states are explored once, so
+branches that join again are not replayed. Levels of the search are expanded
+on a process pool.
+
+The report lists per scenario:
+
+- ``unreachable``: dialogues no playthrough shows, whether cut off in the graph
+  or by conditions no variable state satisfies;
+- ``dead_ends``: choices that lead nowhere (the player is stuck) and nodes
+  where no choice is available and there is no next line;
+- ``loops``: condition chains that never settle, and dialogues from which no
+  playthrough can reach an ending. When the search is truncated (a counter
+  that grows forever never repeats a state) the check runs on dialogues
+  instead of states, and reports dialogues no explored move leads to an
+  ending from;
+- ``endings`` reached, the range of every variable seen and throughput.
+
+With ``--fail-on-issues`` the exit status is 1 when any scenario has dead
+ends, loops, unreachable dialogues or errors in its graph, for CI.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import content_backends
+import scenario_engine
+import scenario_graph
+
+DEFAULT_MAX_STATES = 1000000
+# Below this many states per level a pool costs more than it saves
+PARALLEL_MIN_FRONTIER = 2000
+BATCH_SIZE = 500
+MAX_VALUES_LISTED = 20
+
+# Outcome of a move that does not lead to another state
+END = 'end'                        # no choices and no next line
+NO_CHOICE_AVAILABLE = 'no_choice'  # choices exist, none available, no next line
+STUCK = 'stuck'                    # a choice without a target: the client stays on the line
+CONDITION_LOOP = 'condition_loop'  # next_if_false chain longer than the client follows
+
+# Frozen NaN: float('nan') != float('nan'), so states holding one would never compare equal
+NAN = ('nan',)
+
+
+def _freeze_value(value):
+    if isinstance(value, (list, dict)):
+        return ('json', json.dumps(value, sort_keys=True))
+    if isinstance(value, float) and math.isnan(value):
+        return NAN
+    return value
+
+
+def freeze(variables):
+    """Hashable form of a variables dict; lists and dicts (set from JSON) are kept as JSON text."""
+    return tuple(sorted((key, _freeze_value(value)) for key, value in variables.items()))
+
+
+def _thaw_value(value):
+    if value == NAN:
+        return math.nan
+    return json.loads(value[1]) if isinstance(value, tuple) else value
+
+
+def thaw(frozen):
+    return {key: _thaw_value(value) for key, value in frozen}
+
+
+_compiled = None
+
+
+def _init_worker(compiled):
+    global _compiled
+    _compiled = compiled
+
+
+def expand(compiled, state):
+    """Moves available in ``state``: a list of ``(label, next state or outcome)``.
+
+    ``label`` is the choice index, or None for clicking through.
+    """
+    position, frozen = state
+    node = compiled['nodes'][position]
+    variables = thaw(frozen)
+    available = scenario_engine.available_choices(compiled, position, variables)
+    moves = []
+    if available:
+        for index in available:
+            choice = node['choices'][index]
+            if choice['next'] is None:
+                moves.append((index, STUCK))
+                continue
+            after = dict(variables)
+            for effect in choice['set']:
+                scenario_engine.apply_effect(after, effect)
+            moves.append((index, _resolve(compiled, choice['next'], after)))
+    elif node['next'] is not None:
+        moves.append((None, _resolve(compiled, node['next'], variables)))
+    else:
+        moves.append((None, NO_CHOICE_AVAILABLE if node['choices'] else END))
+    return moves
+
+
+def _resolve(compiled, target, variables):
+    try:
+        position = scenario_engine.resolve_node(compiled, target, variables)
+    except scenario_engine.StepError:
+        return CONDITION_LOOP
+    # A failed condition chain that runs out sends the client to the main menu
+    return END if position is None else (position, freeze(variables))
+
+
+def _expand_batch(states):
+    return [expand(_compiled, state) for state in states]
+
+
+def explore(compiled, workers=1, max_states=DEFAULT_MAX_STATES):
+    """Breadth-first search over (dialogue, variables) states; returns the report."""
+    started = time.perf_counter()
+    ids = compiled['ids']
+    report = {
+        'scenario': compiled['id'],
+        'title': compiled['title'],
+        'nodes': len(ids),
+        'graph_errors': scenario_graph.summarize_issues(compiled) if scenario_graph.has_errors(compiled) else [],
+    }
+    if compiled['start'] is None:
+        report.update(states=0, truncated=False, coverage=0.0, unreachable=list(ids), dead_ends=[], loops=[],
+                      endings=[], variables={}, elapsed_s=0.0, nodes_per_second=0)
+        return report
+
+    state_ids = {}
+    states = []
+    edges = []           # state id -> ids of the states its moves lead to
+    outcomes = {}        # (node id, choice, outcome) -> times seen
+    ending_states = set()
+    truncated = False
+    # The same search projected on dialogues, including the moves truncation dropped
+    node_edges = {}      # position -> positions its moves lead to
+    ending_nodes = set()
+
+    def add(state):
+        state_id = state_ids.get(state)
+        if state_id is None:
+            state_id = state_ids[state] = len(states)
+            states.append(state)
+            edges.append(())
+        return state_id
+
+    first = _resolve(compiled, compiled['start'], {})
+    frontier = []
+    if isinstance(first, tuple):
+        frontier.append(add(first))
+    else:
+        outcomes[('<start>', None, first)] = 1
+
+    pool = None
+    try:
+        while frontier:
+            batch_states = [states[state_id] for state_id in frontier]
+            if workers > 1 and len(frontier) >= PARALLEL_MIN_FRONTIER:
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(compiled,))
+                batches = [batch_states[start:start + BATCH_SIZE] for start in range(0, len(batch_states), BATCH_SIZE)]
+                expanded = [moves for result in pool.map(_expand_batch, batches) for moves in result]
+            else:
+                expanded = [expand(compiled, state) for state in batch_states]
+
+            next_frontier = []
+            for state_id, moves in zip(frontier, expanded):
+                targets = []
+                position = states[state_id][0]
+                node_targets = node_edges.setdefault(position, set())
+                for label, result in moves:
+                    if isinstance(result, tuple):
+                        node_targets.add(result[0])
+                        known = result in state_ids
+                        if not known and len(states) >= max_states:
+                            truncated = True
+                            continue
+                        target = add(result)
+                        targets.append(target)
+                        if not known:
+                            next_frontier.append(target)
+                    else:
+                        key = (ids[states[state_id][0]], label, result)
+                        outcomes[key] = outcomes.get(key, 0) + 1
+                        if result in (END, NO_CHOICE_AVAILABLE):
+                            ending_states.add(state_id)
+                            ending_nodes.add(position)
+                edges[state_id] = tuple(targets)
+            frontier = next_frontier
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    elapsed = time.perf_counter() - started
+    visited = {position for position, _ in states}
+
+    if truncated:
+        # Unexplored states are not evidence of a loop, so dialogues stand in for them:
+        # a dialogue no explored move leads to an ending from is in a loop (a counter
+        # that grows forever never repeats a state). Dialogues only reached by dropped
+        # moves are unexplored and count as able to finish.
+        unexplored = {target for targets in node_edges.values() for target in targets} - node_edges.keys()
+        can_finish = _can_reach(node_edges.items(), ending_nodes | unexplored)
+        trapped = set(node_edges) - can_finish
+        loop_reason = 'no_ending_within_limit'
+    else:
+        # States from which some playthrough still reaches an ending
+        can_finish = _can_reach(enumerate(edges), ending_states)
+        trapped = {states[state_id][0] for state_id in range(len(states)) if state_id not in can_finish}
+        loop_reason = 'no_ending_reachable'
+
+    report.update({
+        'states': len(states),
+        'truncated': truncated,
+        'coverage': round(len(visited) / len(ids) * 100, 2) if ids else 100.0,
+        'unreachable': [ids[position] for position in range(len(ids)) if position not in visited],
+        'dead_ends': [{'node': node_id, 'choice': label, 'reason': result, 'times': count}
+                      for (node_id, label, result), count in sorted(outcomes.items(), key=str)
+                      if result in (STUCK, NO_CHOICE_AVAILABLE)],
+        'loops': [{'node': node_id, 'choice': label, 'reason': result, 'times': count}
+                  for (node_id, label, result), count in sorted(outcomes.items(), key=str)
+                  if result == CONDITION_LOOP] +
+                 [{'node': ids[position], 'choice': None, 'reason': loop_reason} for position in sorted(trapped)],
+        'endings': sorted({node_id for (node_id, _, result) in outcomes if result in (END, NO_CHOICE_AVAILABLE)}),
+        'variables': variable_ranges(states),
+        'elapsed_s': round(elapsed, 3),
+        'nodes_per_second': round(len(states) / elapsed) if elapsed else None,
+    })
+    return report
+
+
+def _can_reach(edges, goals):
+    """Sources of ``edges`` (``(source, targets)`` pairs) from which some path reaches ``goals``, and the goals."""
+    reverse = {}
+    for source, targets in edges:
+        for target in targets:
+            reverse.setdefault(target, []).append(source)
+    reached = set(goals)
+    stack = list(goals)
+    while stack:
+        for source in reverse.get(stack.pop(), ()):
+            if source not in reached:
+                reached.add(source)
+                stack.append(source)
+    return reached
+
+
+def variable_ranges(states):
+    """Per variable: min and max of the numbers seen and up to MAX_VALUES_LISTED other values."""
+    ranges = {}
+    for _, frozen in states:
+        for key, value in frozen:
+            entry = ranges.setdefault(key, {'min': None, 'max': None, 'values': set()})
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                entry['min'] = value if entry['min'] is None else min(entry['min'], value)
+                entry['max'] = value if entry['max'] is None else max(entry['max'], value)
+            elif len(entry['values']) < MAX_VALUES_LISTED:
+                if value == NAN:
+                    entry['values'].add('NaN')
+                else:
+                    entry['values'].add(value[1] if isinstance(value, tuple) else json.dumps(value, ensure_ascii=False))
+    return {key: {'min': entry['min'], 'max': entry['max'], 'values': sorted(entry['values'])}
+            for key, entry in sorted(ranges.items())}
+
+
+def has_issues(report):
+    return bool(report['graph_errors'] or report['unreachable'] or report['dead_ends'] or report['loops'])
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Play every branch of the scenarios and report coverage.')
+    parser.add_argument('scenarios', nargs='*', help='scenario ids (default: all)')
+    parser.add_argument('--content', default=os.path.join(base_dir, 'content'))
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--database', default=os.path.join(base_dir, 'content.sqlite3'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-states', type=int, default=DEFAULT_MAX_STATES,
+                        help='stop exploring a scenario after this many states')
+    parser.add_argument('--output', help='also write the reports to this JSON file')
+    parser.add_argument('--fail-on-issues', action='store_true',
+                        help='exit with status 1 if any scenario has unreachable dialogues, dead ends or loops')
+    args = parser.parse_args()
+
+    backend = content_backends.create_backend(args.backend, args.content, args.database)
+    scenarios = backend.load('scenarios').data
+    missing = [scenario_id for scenario_id in args.scenarios if scenario_id not in scenarios]
+    if missing:
+        parser.error(f"unknown scenarios: {', '.join(missing)}")
+
+    reports = []
+    for scenario_id in args.scenarios or sorted(scenarios):
+        compiled = scenario_graph.compile_scenario(scenario_id, scenarios[scenario_id])
+        report = explore(compiled, workers=args.workers, max_states=args.max_states)
+        reports.append(report)
+        print(f"{scenario_id}: {report['coverage']}% of {report['nodes']} dialogues, {report['states']} states"
+              f"{' (truncated)' if report['truncated'] else ''}, {len(report['endings'])} endings, "
+              f"{len(report['unreachable'])} unreachable, {len(report['dead_ends'])} dead ends, "
+              f"{len(report['loops'])} loops, {report['nodes_per_second']} states/s")
+
+    output = json.dumps(reports, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.fail_on_issues and any(has_issues(report) for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
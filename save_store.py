@@ -0,0 +1,233 @@
+"""Server-side save slots.
+
+The session cookie only holds an opaque player id; the saves live in an
+SQLite database (WAL mode), one row per slot plus one row per history entry.
+History is delta-encoded: a save names the revision and history length it
+builds on and only sends the entries added since. If that base is not the
+slot's current revision (another tab saved, the slot was deleted), the save
+is rejected with ``StaleBase`` and the client sends the full history instead.
+
+Anyone with a session can save, so saves are bounded: a slot keeps the last
+``max_history`` entries (older ones are dropped and the response says how
+many, so the client drops them too), entries and variables over their size
+limits are rejected, and slots not saved for ``ttl`` seconds are removed.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_SLOT = 'default'
+MAX_SLOTS = 20
+MAX_HISTORY = 1000
+MAX_ENTRY_BYTES = 4096
+MAX_VARIABLES_BYTES = 64 * 1024
+DEFAULT_TTL = 180 * 24 * 3600
+CLEANUP_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS slots (
+    player_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    revision TEXT NOT NULL,
+    scenario TEXT,
+    dialogue TEXT,
+    variables TEXT NOT NULL,
+    history_length INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (player_id, slot)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS slots_updated_at ON slots (updated_at);
+CREATE TABLE IF NOT EXISTS history (
+    player_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (player_id, slot, position)
+) WITHOUT ROWID;
+"""
+
+
+class StaleBase(Exception):
+    """The delta was computed against a revision the slot no longer has."""
+
+
+class TooManySlots(Exception):
+    pass
+
+
+class SaveTooLarge(ValueError):
+    """A history entry or the variables exceed their size limit."""
+
+
+def new_player_id():
+    return secrets.token_urlsafe(16)
+
+
+def is_valid_slot(slot):
+    return (isinstance(slot, str) and 0 < len(slot) <= 40
+            and slot.replace('_', '').replace('-', '').replace(' ', '').isalnum())
+
+
+class SaveStore:
+    def __init__(self, database_path, max_slots=MAX_SLOTS, max_history=MAX_HISTORY, max_entry_bytes=MAX_ENTRY_BYTES,
+                 max_variables_bytes=MAX_VARIABLES_BYTES, ttl=DEFAULT_TTL):
+        self.database_path = database_path
+        self.max_slots = max_slots
+        self.max_history = max_history
+        self.max_entry_bytes = max_entry_bytes
+        self.max_variables_bytes = max_variables_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cleaned_at = None  # first save of the process cleans up
+        self.stats = {'saves': 0, 'full_saves': 0, 'entries_written': 0, 'stale': 0, 'loads': 0,
+                      'entries_trimmed': 0, 'rejected': 0, 'expired': 0}
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.database_path)), exist_ok=True)
+            conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self, immediate=False):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def save(self, player_id, slot, scenario, dialogue, variables, history, history_base=0, base_revision=None):
+        """Stores a slot; ``history`` holds the entries after the first ``history_base`` ones.
+
+        Returns ``{'slot', 'revision', 'history_length', 'history_trimmed'}``; the
+        client drops its first ``history_trimmed`` entries and sends the revision
+        and length back with its next delta.
+        """
+        variables_json = json.dumps(variables, ensure_ascii=False)
+        entries = [json.dumps(entry, ensure_ascii=False) for entry in history]
+        if len(variables_json.encode('utf-8')) > self.max_variables_bytes or \
+                any(len(entry.encode('utf-8')) > self.max_entry_bytes for entry in entries):
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise SaveTooLarge(slot)
+        self._cleanup_if_due()
+
+        with self._transaction(immediate=True) as conn:
+            row = conn.execute('SELECT revision, history_length FROM slots WHERE player_id = ? AND slot = ?',
+                               (player_id, slot)).fetchone()
+            if row is None:
+                count = conn.execute('SELECT COUNT(*) FROM slots WHERE player_id = ?', (player_id,)).fetchone()[0]
+                if count >= self.max_slots:
+                    raise TooManySlots(slot)
+            if history_base:
+                if row is None or row[0] != base_revision or history_base > row[1]:
+                    with self._lock:
+                        self.stats['stale'] += 1
+                    raise StaleBase(slot)
+            # Entries past the base belong to a branch the client no longer has
+            conn.execute('DELETE FROM history WHERE player_id = ? AND slot = ? AND position >= ?',
+                         (player_id, slot, history_base))
+            conn.executemany(
+                'INSERT INTO history (player_id, slot, position, entry) VALUES (?, ?, ?, ?)',
+                [(player_id, slot, history_base + offset, entry) for offset, entry in enumerate(entries)])
+            revision = uuid.uuid4().hex[:12]
+            history_length = history_base + len(entries)
+            trimmed = max(0, history_length - self.max_history)
+            if trimmed:
+                conn.execute('DELETE FROM history WHERE player_id = ? AND slot = ? AND position < ?',
+                             (player_id, slot, trimmed))
+                # Renumber from 0 through negative positions, so no step collides with a row not yet moved
+                conn.execute('UPDATE history SET position = ? - position - 1 WHERE player_id = ? AND slot = ?',
+                             (trimmed, player_id, slot))
+                conn.execute('UPDATE history SET position = -position - 1 WHERE player_id = ? AND slot = ?',
+                             (player_id, slot))
+                history_length -= trimmed
+            conn.execute(
+                'INSERT INTO slots (player_id, slot, revision, scenario, dialogue, variables, history_length, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (player_id, slot) DO UPDATE SET revision = excluded.revision, scenario = excluded.scenario, '
+                'dialogue = excluded.dialogue, variables = excluded.variables, '
+                'history_length = excluded.history_length, updated_at = excluded.updated_at',
+                (player_id, slot, revision, scenario, dialogue, variables_json, history_length, time.time()))
+        with self._lock:
+            self.stats['saves'] += 1
+            self.stats['full_saves'] += 0 if history_base else 1
+            self.stats['entries_written'] += len(entries)
+            self.stats['entries_trimmed'] += trimmed
+        return {'slot': slot, 'revision': revision, 'history_length': history_length, 'history_trimmed': trimmed}
+
+    def load(self, player_id, slot=None):
+        """The saved game state of a slot (the most recent slot if None), or None."""
+        with self._transaction() as conn:
+            if slot is None:
+                row = conn.execute(
+                    'SELECT slot, revision, scenario, dialogue, variables FROM slots WHERE player_id = ? '
+                    'ORDER BY updated_at DESC LIMIT 1', (player_id,)).fetchone()
+            else:
+                row = conn.execute(
+                    'SELECT slot, revision, scenario, dialogue, variables FROM slots WHERE player_id = ? AND slot = ?',
+                    (player_id, slot)).fetchone()
+            if row is None:
+                return None
+            history = [json.loads(entry) for (entry,) in conn.execute(
+                'SELECT entry FROM history WHERE player_id = ? AND slot = ? ORDER BY position', (player_id, row[0]))]
+        with self._lock:
+            self.stats['loads'] += 1
+        return {
+            'currentScenario': row[2],
+            'currentDialogue': row[3],
+            'variables': json.loads(row[4]),
+            'history': history,
+            'slot': row[0],
+            'revision': row[1],
+        }
+
+    def list_slots(self, player_id):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                'SELECT slot, scenario, dialogue, history_length, updated_at FROM slots WHERE player_id = ? '
+                'ORDER BY updated_at DESC', (player_id,)).fetchall()
+        return [{'slot': slot, 'scenario': scenario, 'dialogue': dialogue, 'history_length': history_length,
+                 'updated_at': round(updated_at, 3)}
+                for slot, scenario, dialogue, history_length, updated_at in rows]
+
+    def delete(self, player_id, slot):
+        with self._transaction(immediate=True) as conn:
+            conn.execute('DELETE FROM history WHERE player_id = ? AND slot = ?', (player_id, slot))
+            return conn.execute('DELETE FROM slots WHERE player_id = ? AND slot = ?', (player_id, slot)).rowcount > 0
+
+    def cleanup(self):
+        """Removes slots not saved for ``ttl`` seconds; returns how many."""
+        cutoff = time.time() - self.ttl
+        with self._transaction(immediate=True) as conn:
+            conn.execute('DELETE FROM history WHERE (player_id, slot) IN '
+                         '(SELECT player_id, slot FROM slots WHERE updated_at < ?)', (cutoff,))
+            removed = conn.execute('DELETE FROM slots WHERE updated_at < ?', (cutoff,)).rowcount
+        with self._lock:
+            self.stats['expired'] += removed
+        return removed
+
+    def _cleanup_if_due(self):
+        with self._lock:
+            if not self.ttl or self._cleaned_at is not None and time.monotonic() - self._cleaned_at < CLEANUP_INTERVAL:
+                return
+            self._cleaned_at = time.monotonic()
+        self.cleanup()
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
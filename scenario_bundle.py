@@ -0,0 +1,222 @@
+"""Self-contained scenario bundles for kiosk builds, offline play and CDNs.
+
+A bundle is a zip archive with one scenario, the characters and scenes it
+references and every background, pose, BGM, SFX and voice line it shows or
+plays, preferring the optimized derivatives (WebP/AVIF images, transcoded
+audio) over the originals. Entry paths mirror the URL under /static/.
+
+Entries are stored uncompressed (the assets are compressed formats already),
+so every file is one contiguous byte range of the archive. ``index.json``, the
+last entry, maps each source URL to its entry and gives the entry's offset and
+size, so a server or a service worker can answer an asset request with a
+single range read, and a static host can serve the unzipped tree as is.
+
+Bundles are deterministic: entries are sorted, timestamps and attributes are
+fixed and JSON is written with sorted keys, so the same content always gives
+the same bytes. The content hash is part of the file name.
+
+    python scenario_bundle.py <scenario_id> [--output bundles] [--image-format webp] [--max-width 1920]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import zipfile
+
+import audio_pipeline
+import image_pipeline
+import scenario_graph
+
+BUNDLE_FORMAT = 1
+BUNDLES_FOLDER = 'bundles'
+IMAGE_FORMATS = ('webp', 'avif', 'original')
+DEFAULT_MAX_WIDTH = 1920
+# Earliest timestamp a zip entry can have; every entry gets it
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+# Size of a zip local file header before the name (see APPNOTE 4.3.7)
+LOCAL_HEADER_SIZE = 30
+
+_hash_cache = {}  # path -> (mtime_ns, size, sha256)
+_hash_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def file_hash(path):
+    """SHA-256 of a file, remembered until its mtime or size changes."""
+    st = os.stat(path)
+    with _hash_lock:
+        cached = _hash_cache.get(path)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with _hash_lock:
+        _hash_cache[path] = (st.st_mtime_ns, st.st_size, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def url_to_path(static_root, url):
+    relative = url[len('/static/'):].split('?', 1)[0]
+    path = os.path.abspath(os.path.join(static_root, *relative.split('/')))
+    if not path.startswith(os.path.abspath(static_root) + os.sep):
+        return None
+    return path
+
+
+def choose_image(url, images, image_format, max_width):
+    """The widest derivative of the wanted format that fits ``max_width``, else the original."""
+    entry = images.get(url)
+    if not entry or image_format == 'original':
+        return url
+    variants = [variant for variant in entry['variants']
+                if variant['format'] == image_format and variant['width'] <= max_width]
+    if not variants:
+        return url
+    return max(variants, key=lambda variant: variant['width'])['url']
+
+
+def choose_audio(url, audio):
+    entry = audio.get(url)
+    if not entry or not entry['variants']:
+        return url
+    return entry['variants'][0]['url']
+
+
+def collect(static_root, scenario_id, scenario, characters, scenes, image_format='webp', max_width=DEFAULT_MAX_WIDTH):
+    """Returns ``(payload, assets, missing)``: the scenario JSON, ``{source URL: chosen URL}``
+    for every asset that exists and the referenced URLs that do not."""
+    compiled = scenario_graph.compile_scenario(scenario_id, scenario)
+    node_assets = scenario_graph.collect_node_assets(
+        scenario_id, compiled, characters, scenes,
+        voice_exists=lambda url: os.path.isfile(url_to_path(static_root, url) or ''))
+    character_ids, scene_ids = scenario_graph.collect_refs(scenario)
+    payload = {
+        'format': BUNDLE_FORMAT,
+        'scenarios': {scenario_id: scenario},
+        'characters': {char_id: characters[char_id] for char_id in sorted(character_ids) if char_id in characters},
+        'scenes': {scene_id: scenes[scene_id] for scene_id in sorted(scene_ids) if scene_id in scenes},
+    }
+
+    images = image_pipeline.load_manifest(static_root)['images']
+    audio = audio_pipeline.load_manifest(static_root)['audio']
+    assets = {}
+    missing = set()
+    for url in sorted({url for urls in node_assets for url in urls}):
+        if url.lower().endswith(image_pipeline.SOURCE_EXTENSIONS):
+            chosen = choose_image(url, images, image_format, max_width)
+        else:
+            chosen = choose_audio(url, audio)
+        path = url_to_path(static_root, chosen) if chosen.startswith('/static/') else None
+        if path and os.path.isfile(path):
+            assets[url] = chosen
+        elif chosen != url and os.path.isfile(url_to_path(static_root, url) or ''):
+            assets[url] = url  # derivative listed but gone: fall back to the original
+        else:
+            missing.add(url)
+    return payload, assets, sorted(missing)
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _zip_info(name, size):
+    info = zipfile.ZipInfo(name, date_time=ZIP_EPOCH)
+    info.compress_type = zipfile.ZIP_STORED
+    info.create_system = 3  # the same on every platform
+    info.external_attr = 0o100644 << 16
+    info.file_size = size
+    return info
+
+
+def bundle_digest(payload, assets, missing, entries):
+    """Content hash of a bundle, computed from its inputs before anything is written."""
+    digest = hashlib.sha256()
+    digest.update(_dumps([BUNDLE_FORMAT, payload, assets, missing]))
+    for name, path in entries:
+        digest.update(name.encode('utf-8') + b'\0' + file_hash(path).encode('ascii') + b'\0')
+    return digest.hexdigest()
+
+
+def write_bundle(path, scenario_id, payload, assets, missing, entries):
+    """Writes the archive to ``path``; ``entries`` are sorted ``(entry name, file path)`` pairs.
+    Returns the index."""
+    index = {
+        'format': BUNDLE_FORMAT,
+        'scenario': scenario_id,
+        'assets': {url: chosen[len('/static/'):] for url, chosen in assets.items()},
+        'missing': missing,
+        'entries': {},
+    }
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        scenario_json = _dumps(payload)
+        archive.writestr(_zip_info('scenario.json', len(scenario_json)), scenario_json)
+        for name, source_path in entries:
+            size = os.path.getsize(source_path)
+            info = _zip_info(name, size)
+            with open(source_path, 'rb') as src, archive.open(info, 'w') as dest:
+                shutil.copyfileobj(src, dest, 1024 * 1024)
+            offset = info.header_offset + LOCAL_HEADER_SIZE + len(name.encode('utf-8')) + len(info.extra)
+            index['entries'][name] = [offset, size, file_hash(source_path)[:16]]
+        index_json = _dumps(index)
+        archive.writestr(_zip_info('index.json', len(index_json)), index_json)
+    return index
+
+
+def build_bundle(static_root, output_dir, scenario_id, scenario, characters, scenes,
+                 image_format='webp', max_width=DEFAULT_MAX_WIDTH):
+    """Builds the bundle unless one with the same content hash exists; returns ``(path, digest)``.
+
+    Older bundles of the same scenario in ``output_dir`` are removed.
+    """
+    payload, assets, missing = collect(static_root, scenario_id, scenario, characters, scenes, image_format, max_width)
+    entries = sorted({(chosen[len('/static/'):], url_to_path(static_root, chosen)) for chosen in assets.values()})
+    digest = bundle_digest(payload, assets, missing, entries)
+    filename = f'{scenario_id}.{digest[:16]}.zip'
+    path = os.path.join(output_dir, filename)
+
+    with _build_lock:
+        if not os.path.exists(path):
+            os.makedirs(output_dir, exist_ok=True)
+            temp_path = f'{path}.tmp'
+            try:
+                write_bundle(temp_path, scenario_id, payload, assets, missing, entries)
+                os.replace(temp_path, path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+            for other in os.listdir(output_dir):
+                if other != filename and other.startswith(f'{scenario_id}.') and other.endswith('.zip'):
+                    os.remove(os.path.join(output_dir, other))
+    return path, digest
+
+
+def main():
+    import content_backends
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Pack a scenario and its assets into one deterministic archive.')
+    parser.add_argument('scenario_id')
+    parser.add_argument('--content', default=os.path.join(base_dir, 'content'))
+    parser.add_argument('--static', default=os.path.join(base_dir, 'static'))
+    parser.add_argument('--output', default=os.path.join(base_dir, 'bundles'))
+    parser.add_argument('--image-format', choices=IMAGE_FORMATS, default='webp')
+    parser.add_argument('--max-width', type=int, default=DEFAULT_MAX_WIDTH)
+    args = parser.parse_args()
+
+    backend = content_backends.JsonFolderBackend(args.content)
+    scenarios = backend.load('scenarios').data
+    if args.scenario_id not in scenarios:
+        parser.error(f'unknown scenario: {args.scenario_id}')
+    path, digest = build_bundle(args.static, args.output, args.scenario_id, scenarios[args.scenario_id],
+                                backend.load('characters').data, backend.load('scenes').data,
+                                image_format=args.image_format, max_width=args.max_width)
+    print(json.dumps({'path': path, 'hash': digest, 'size': os.path.getsize(path)}, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""Runs compiled scenarios on the server, with the semantics of static/js/game.js.
+
+``step`` takes the dialogue on screen, the player's variables and a choice, and
+returns the next frame: the text, the speaker, resolved pose, background and
+audio URLs, and the choices available with those variables. Condition checks
+and variable updates follow JavaScript's rules (loose ``==``, ``||`` for
+missing values, ``+`` concatenating strings), so the server and the client
+agree on every branch.
+
+A frame is everything about a node that does not depend on variables. Frames
+are rendered once per content version (see
+``VisualNovelManager.get_frames``), so a step only checks conditions and
+applies effects.
+"""
+import math
+import re
+
+# String forms JS Number() accepts
+DECIMAL = re.compile(r'^[+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)$')
+RADIX = re.compile(r'^0(?:[xX][0-9a-fA-F]+|[oO][0-7]+|[bB][01]+)$')
+
+MAX_CONDITION_HOPS = 100
+VOICE_URL = '/static/audio/voice/game_voice/{scenario}_{dialogue}.wav'
+# Target of a choice without next: the client stays on the line
+STAY = object()
+
+
+class StepError(ValueError):
+    """The step cannot be taken; the message is shown to the player (Russian, like the API)."""
+
+
+def to_number(value):
+    """JS ``Number(value)``; NaN for what it cannot convert."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if value is None:
+        return 0
+    if not isinstance(value, str):
+        return math.nan
+    text = value.strip()
+    if not text:
+        return 0
+    if DECIMAL.match(text):
+        number = float(text.replace('Infinity', 'inf'))
+    elif RADIX.match(text):
+        number = float(int(text, 0))
+    else:
+        return math.nan
+    return int(number) if number.is_integer() else number
+
+
+def to_primitive(value):
+    """JS ``ToPrimitive`` of an array or object (what ``+``, ``==`` and ``<`` see); other values unchanged."""
+    if isinstance(value, list):
+        return ','.join('' if item is None else to_string(item) for item in value)
+    if isinstance(value, dict):
+        return '[object Object]'
+    return value
+
+
+def to_string(value):
+    """JS ``String(value)`` for the values variables can hold."""
+    if value is None:
+        return 'null'
+    if isinstance(value, (list, dict)):
+        return to_primitive(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        if value.is_integer() and abs(value) < 1e21:
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+def loose_equals(left, right):
+    """JS ``left == right`` for JSON values."""
+    if left is None or right is None:
+        return left is None and right is None
+    if isinstance(left, bool):
+        left = int(left)
+    if isinstance(right, bool):
+        right = int(right)
+    if isinstance(left, (list, dict)) and isinstance(right, (list, dict)):
+        # Objects and arrays compare by identity in JS; values from JSON never match
+        return False
+    left, right = to_primitive(left), to_primitive(right)
+    if isinstance(left, str) and isinstance(right, str):
+        return left == right
+    return to_number(left) == to_number(right)
+
+
+def _relational(left, right):
+    """Operands of a JS relational comparison: both strings, or both numbers."""
+    left, right = to_primitive(left), to_primitive(right)
+    if isinstance(left, str) and isinstance(right, str):
+        return left, right
+    left, right = to_number(left), to_number(right)
+    if isinstance(left, float) and math.isnan(left) or isinstance(right, float) and math.isnan(right):
+        return None
+    return left, right
+
+
+def check_condition(condition, variables):
+    """``checkCondition`` from game.js for a compiled ``[variable, operator, value]``."""
+    if condition is None:
+        return True
+    if not isinstance(condition, list):
+        return False
+    var_name, operator, compare_value = condition
+    state_value = variables.get(var_name, 0)
+    if operator == '==':
+        return loose_equals(state_value, compare_value)
+    if operator == '!=':
+        return not loose_equals(state_value, compare_value)
+    operands = _relational(state_value, compare_value)
+    if operands is None:
+        return False
+    left, right = operands
+    if operator == '>':
+        return left > right
+    if operator == '<':
+        return left < right
+    if operator == '>=':
+        return left >= right
+    if operator == '<=':
+        return left <= right
+    return False
+
+
+def _falsy(value):
+    return value in (None, False, 0, '') or isinstance(value, float) and math.isnan(value)
+
+
+def apply_effect(variables, effect):
+    """``applyEffect`` from game.js; changes ``variables`` in place."""
+    key, operation, value = effect
+    if operation != 'add':
+        variables[key] = value
+        return
+    current = variables.get(key)
+    current = 0 if _falsy(current) else to_primitive(current)
+    if isinstance(current, str) or isinstance(value, str):
+        variables[key] = to_string(current) + to_string(value)
+    else:
+        variables[key] = to_number(current) + value
+
+
+def resolve_node(compiled, position, variables):
+    """Follows ``next_if_false`` (or ``next``) past nodes whose condition fails.
+
+    Returns the node to show, or None when the chain runs out (the scenario ends).
+    """
+    nodes = compiled['nodes']
+    for _ in range(MAX_CONDITION_HOPS):
+        if position is None:
+            return None
+        node = nodes[position]
+        if check_condition(node['condition'], variables):
+            return position
+        position = node['next_if_false'] if node['next_if_false'] is not None else node['next']
+    raise StepError('Бесконечный цикл условий')
+
+
+def character_left(index, count):
+    """Horizontal position (percent) of the index-th of ``count`` sprites, as ``renderCharacters`` does."""
+    if count == 1:
+        return 50
+    if count == 2:
+        return 25 if index == 0 else 75
+    return round(10 + index * (80 / (count - 1)), 4)
+
+
+def render_frame(scenario_id, compiled, position, characters, scenes, voice_exists=None):
+    """Everything about a node that does not depend on variables.
+
+    ``background``, ``bgm`` are None when the node keeps what was there before;
+    ``bgm`` is ``"stop"`` to stop the music.
+    """
+    node = compiled['nodes'][position]
+    dialogue_id = compiled['ids'][position]
+
+    speaker = None
+    if node.get('character') and node['character'] in characters:
+        character = characters[node['character']]
+        speaker = {'id': node['character'], 'name': character.get('name'), 'color': character.get('color')}
+
+    on_screen = node.get('characters_on_screen') or []
+    sprites = []
+    for index, char_info in enumerate(on_screen):
+        character = characters.get(char_info.get('id'))
+        if not character:
+            continue
+        pose = char_info.get('pose') or 'neutral'
+        url = (character.get('poses') or {}).get(pose)
+        if not url:
+            continue
+        sprites.append({'id': char_info['id'], 'pose': pose, 'url': url, 'left': character_left(index, len(on_screen)),
+                        'speaking': char_info['id'] == node.get('character')})
+
+    scene = scenes.get(node.get('scene')) if node.get('scene') else None
+    voice_url = VOICE_URL.format(scenario=scenario_id, dialogue=dialogue_id)
+    choices = node['choices']
+    return {
+        'scenario': scenario_id,
+        'dialogue': dialogue_id,
+        'text': node.get('text', ''),
+        'speaker': speaker,
+        'characters': sprites,
+        'background': scene.get('background') if scene else None,
+        'bgm': node.get('bgm') or None,
+        'sfx': node.get('sfx') or None,
+        'voice': voice_url if voice_exists and voice_exists(voice_url) else None,
+        'choices': [{'index': index, 'text': choice['text']} for index, choice in enumerate(choices)],
+        # When no choice is available the player clicks through to next
+        'next': compiled['ids'][node['next']] if node['next'] is not None else None,
+        # False when the choices on offer depend on the variables
+        'static': all(choice['condition'] is None for choice in choices),
+    }
+
+
+def available_choices(compiled, position, variables):
+    return [index for index, choice in enumerate(compiled['nodes'][position]['choices'])
+            if check_condition(choice['condition'], variables)]
+
+
+def step(compiled, position, variables, choice, get_frame):
+    """Takes one step; returns ``(frame, variables)``, with no frame when the scenario ends.
+
+    ``position`` is the node on screen (None to start the scenario) and ``choice``
+    the index of the chosen option (None to click through). ``get_frame`` renders
+    a node position, normally memoized. ``variables`` is not modified.
+
+    A choice without ``next`` applies its effects and stays on the line, as the
+    client does, so the frame returned is the one on screen.
+    """
+    variables = dict(variables)
+    if position is None:
+        if compiled['start'] is None:
+            raise StepError('Стартовый диалог не найден')
+        target = compiled['start']
+    else:
+        node = compiled['nodes'][position]
+        available = available_choices(compiled, position, variables)
+        if choice is None:
+            if available:
+                raise StepError('Нужно выбрать вариант ответа')
+            target = node['next']
+        else:
+            if choice not in available:
+                raise StepError('Этот вариант недоступен')
+            for effect in node['choices'][choice]['set']:
+                apply_effect(variables, effect)
+            target = node['choices'][choice]['next']
+            if target is None:
+                target = STAY
+
+    if target is not STAY:
+        position = resolve_node(compiled, target, variables)
+        if position is None:
+            return None, variables
+    frame = get_frame(position)
+    if not frame['static']:
+        available = set(available_choices(compiled, position, variables))
+        frame = dict(frame, choices=[item for item in frame['choices'] if item['index'] in available])
+    return frame, variables
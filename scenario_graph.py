@@ -0,0 +1,277 @@
+"""Compiles scenario dialogues into an indexed graph.
+
+Mirrors the semantics of ``checkCondition``/``setVariable`` in static/js/game.js,
+so conditions and variable effects are parsed once on the server instead of on
+every step in the client.
+"""
+import re
+import time
+from collections import deque
+
+GRAPH_FORMAT_VERSION = 1
+
+CONDITION_OPERATORS = re.compile(r'(==|!=|>=|<=|>|<)')
+FLOAT_PREFIX = re.compile(r'^[+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)')
+
+# Dialogue fields that are passed to the client untouched
+PAYLOAD_FIELDS = ('scene', 'character', 'characters_on_screen', 'text', 'bgm', 'sfx')
+
+
+def parse_float(value):
+    """Same as JS ``parseFloat``: parses the numeric prefix, returns None for NaN."""
+    match = FLOAT_PREFIX.match(str(value).strip())
+    if not match:
+        return None
+    number = float(match.group(0).replace('Infinity', 'inf'))
+    return int(number) if number.is_integer() else number
+
+
+def parse_condition(condition_string):
+    """Parses ``"var >= 5"`` into ``[var, op, value]``.
+
+    Returns None for an empty condition (always true) and False for a malformed
+    one (the client treats those as always false).
+    """
+    if not condition_string:
+        return None
+    if not isinstance(condition_string, str):
+        return False
+
+    parts = [part.strip() for part in CONDITION_OPERATORS.split(condition_string)]
+    if len(parts) != 3:
+        return False
+
+    var_name, operator, value_str = parts
+    if value_str.lower() == 'true':
+        value = True
+    elif value_str.lower() == 'false':
+        value = False
+    else:
+        value = parse_float(value_str)
+        if value is None:
+            value = re.sub(r'^[\'"]|[\'"]$', '', value_str)
+    return [var_name, operator, value]
+
+
+def parse_effect(key, value):
+    """Parses one ``set`` entry into ``[key, 'add'|'set', value]``; None if it is not a number."""
+    if isinstance(value, str) and (value.startswith('+') or value.startswith('-')):
+        change = parse_float(value)
+        if change is None:
+            return None
+        return [key, 'add', change]
+    return [key, 'set', value]
+
+
+def collect_refs(scenario):
+    """Returns the character and scene ids a scenario's dialogues reference."""
+    character_ids = set()
+    scene_ids = set()
+    for dialogue in scenario.get('dialogues', {}).values():
+        if dialogue.get('character'):
+            character_ids.add(dialogue['character'])
+        for char_info in dialogue.get('characters_on_screen') or []:
+            if char_info.get('id'):
+                character_ids.add(char_info['id'])
+        if dialogue.get('scene'):
+            scene_ids.add(dialogue['scene'])
+    return character_ids, scene_ids
+
+
+def compile_scenario(scenario_id, scenario):
+    """Builds the compact graph for one scenario.
+
+    Node ids are positions in ``ids``; every edge (``next``, ``next_if_false`` and
+    choice targets) is an int or None. ``issues`` lists dangling edges, unreachable
+    and dead-end nodes and anything that failed to parse.
+    """
+    started = time.perf_counter()
+    dialogues = scenario.get('dialogues') or {}
+    ids = list(dialogues.keys())
+    index = {dialogue_id: position for position, dialogue_id in enumerate(ids)}
+
+    issues = {
+        'missing_start': False,
+        'dangling_edges': [],
+        'unreachable': [],
+        'dead_ends': [],
+        'invalid_conditions': [],
+        'invalid_effects': [],
+    }
+
+    def resolve(source_id, target_id, field):
+        if not target_id:
+            return None
+        if target_id not in index:
+            issues['dangling_edges'].append({'from': source_id, 'field': field, 'to': target_id})
+            return None
+        return index[target_id]
+
+    def compile_condition(source_id, condition_string):
+        condition = parse_condition(condition_string)
+        if condition is False:
+            issues['invalid_conditions'].append({'node': source_id, 'condition': condition_string})
+        return condition
+
+    nodes = []
+    adjacency = []
+    for dialogue_id in ids:
+        dialogue = dialogues[dialogue_id] or {}
+        node = {'id': dialogue_id}
+        for field in PAYLOAD_FIELDS:
+            if field in dialogue:
+                node[field] = dialogue[field]
+        node['condition'] = compile_condition(dialogue_id, dialogue.get('condition'))
+        node['next'] = resolve(dialogue_id, dialogue.get('next'), 'next')
+        node['next_if_false'] = resolve(dialogue_id, dialogue.get('next_if_false'), 'next_if_false')
+
+        choices = []
+        for position, choice in enumerate(dialogue.get('choices') or []):
+            effects = []
+            for key, value in (choice.get('set') or {}).items():
+                effect = parse_effect(key, value)
+                if effect is None:
+                    issues['invalid_effects'].append({'node': dialogue_id, 'choice': position, 'variable': key})
+                    effect = [key, 'add', 0]
+                effects.append(effect)
+            choices.append({
+                'text': choice.get('text', ''),
+                'condition': compile_condition(dialogue_id, choice.get('condition')),
+                'next': resolve(dialogue_id, choice.get('next'), f'choices[{position}].next'),
+                'set': effects,
+            })
+        node['choices'] = choices
+        nodes.append(node)
+
+        edges = [node['next'], node['next_if_false']] + [choice['next'] for choice in choices]
+        adjacency.append(sorted({edge for edge in edges if edge is not None}))
+
+    start_id = scenario.get('start_dialogue') or 'start'
+    start = index.get(start_id)
+    if start is None:
+        issues['missing_start'] = True
+
+    # Breadth-first reachability from the start node; depth doubles as a lookahead distance
+    depth = [None] * len(ids)
+    if start is not None:
+        depth[start] = 0
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            for target in adjacency[current]:
+                if depth[target] is None:
+                    depth[target] = depth[current] + 1
+                    queue.append(target)
+
+    issues['unreachable'] = [ids[position] for position, value in enumerate(depth) if value is None]
+    # A node without a next or choices ends the scenario, which is only suspicious when
+    # its choices all point nowhere
+    issues['dead_ends'] = [
+        ids[position] for position, node in enumerate(nodes)
+        if not adjacency[position] and node['choices']
+    ]
+
+    return {
+        'format': GRAPH_FORMAT_VERSION,
+        'id': scenario_id,
+        'title': scenario.get('title', scenario_id),
+        'description': scenario.get('description', ''),
+        'author': scenario.get('author', ''),
+        'start': start,
+        'ids': ids,
+        'nodes': nodes,
+        'adjacency': adjacency,
+        'depth': depth,
+        'issues': issues,
+        'stats': {
+            'nodes': len(nodes),
+            'edges': sum(len(edges) for edges in adjacency),
+            'compile_ms': round((time.perf_counter() - started) * 1000, 3),
+        },
+    }
+
+
+def has_errors(compiled):
+    """True when the graph has problems that break play (not just unreachable nodes)."""
+    issues = compiled['issues']
+    return bool(issues['missing_start'] or issues['dangling_edges'] or issues['invalid_conditions'])
+
+
+def summarize_issues(compiled):
+    """Human-readable (Russian, like the rest of the API) list of graph problems."""
+    issues = compiled['issues']
+    messages = []
+    if issues['missing_start']:
+        messages.append('Стартовый диалог не найден')
+    for edge in issues['dangling_edges']:
+        messages.append(f"Диалог \"{edge['from']}\" ссылается на несуществующий \"{edge['to']}\" ({edge['field']})")
+    for item in issues['invalid_conditions']:
+        messages.append(f"Некорректное условие в \"{item['node']}\": {item['condition']}")
+    for item in issues['invalid_effects']:
+        messages.append(f"Некорректное изменение переменной \"{item['variable']}\" в \"{item['node']}\"")
+    for dialogue_id in issues['dead_ends']:
+        messages.append(f"Из диалога \"{dialogue_id}\" нет перехода ни по одному выбору")
+    if issues['unreachable']:
+        messages.append(f"Недостижимые диалоги: {', '.join(issues['unreachable'])}")
+    return messages
+
+
+def collect_node_assets(scenario_id, compiled, characters, scenes, voice_exists=None):
+    """Lists the asset URLs each compiled node shows or plays when it is displayed."""
+    node_assets = []
+    for node in compiled['nodes']:
+        urls = []
+        scene = scenes.get(node.get('scene')) if node.get('scene') else None
+        if scene and scene.get('background'):
+            urls.append(scene['background'])
+        for char_info in node.get('characters_on_screen') or []:
+            character = characters.get(char_info.get('id'))
+            pose_path = (character or {}).get('poses', {}).get(char_info.get('pose') or 'neutral')
+            if pose_path:
+                urls.append(pose_path)
+        if node.get('bgm') and node['bgm'] != 'stop':
+            urls.append(node['bgm'])
+        if node.get('sfx'):
+            urls.append(node['sfx'])
+        voice_url = f"/static/audio/voice/game_voice/{scenario_id}_{node['id']}.wav"
+        if voice_exists and voice_exists(voice_url):
+            urls.append(voice_url)
+        node_assets.append(urls)
+    return node_assets
+
+
+def build_asset_lookahead(compiled, node_assets, steps):
+    """For every node, the assets needed within ``steps`` transitions along any branch.
+
+    Returns ``(urls, lookahead)`` where ``lookahead[position]`` is a list of
+    ``[url index, distance]`` pairs, nearest first. Distance 0 is the node itself.
+    """
+    urls = []
+    url_index = {}
+    for assets in node_assets:
+        for url in assets:
+            if url not in url_index:
+                url_index[url] = len(urls)
+                urls.append(url)
+
+    adjacency = compiled['adjacency']
+    lookahead = []
+    for position in range(len(adjacency)):
+        nearest = {}
+        seen = {position}
+        frontier = [position]
+        for distance in range(steps + 1):
+            next_frontier = []
+            for current in frontier:
+                for url in node_assets[current]:
+                    nearest.setdefault(url_index[url], distance)
+                for target in adjacency[current]:
+                    if target not in seen:
+                        seen.add(target)
+                        next_frontier.append(target)
+            frontier = next_frontier
+            if not frontier:
+                break
+        lookahead.append(sorted(([index, distance] for index, distance in nearest.items()),
+                                key=lambda item: (item[1], item[0])))
+    return urls, lookahead
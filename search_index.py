@@ -0,0 +1,270 @@
+"""Inverted index for the editors' full-text search.
+
+Indexes scenario titles, descriptions and authors, dialogue text with choice
+labels, and character names. Text is case-folded, ``ё`` is folded into ``е``
+and split on Unicode word characters, so Cyrillic and Latin are treated
+alike. A query matches documents containing every term; the last term also
+matches as a prefix (search as you type), and so does any term of four or
+more letters, which covers most Russian inflections ("ракет" finds
+"ракета", "ракеты").
+
+Documents are numbered in insertion order and postings are sorted ``array``s
+of those numbers, a few bytes per posting. When a scenario changes its old
+documents are tombstoned and new ones appended, so updates cost only the
+changed scenario; the index is rebuilt once tombstones pile up.
+"""
+import math
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+KIND_SCENARIO_TITLE = 0
+KIND_SCENARIO_DESCRIPTION = 1
+KIND_SCENARIO_AUTHOR = 2
+KIND_DIALOGUE = 3
+KIND_CHARACTER = 4
+KIND_NAMES = ('title', 'description', 'author', 'dialogue', 'character')
+KIND_WEIGHTS = (3.0, 1.0, 2.0, 1.0, 3.0)
+HIT_TYPES = {'scenarios': (0, 1, 2), 'dialogues': (3,), 'characters': (4,)}
+
+PREFIX_MIN_LENGTH = 4
+# Stop collecting after this many matches; the total is then reported as a lower bound
+MAX_MATCHES = 5000
+MAX_PREFIX_EXPANSIONS = 200
+SNIPPET_LENGTH = 160
+# Rebuild from scratch when tombstones exceed this share of the documents
+COMPACT_RATIO = 0.3
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    return text.casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    """Lowercased words of ``text``; single letters and ``_`` runs are dropped."""
+    if not isinstance(text, str) or not text:
+        return []
+    return [token for token in _WORD.findall(normalize(text))
+            if (len(token) > 1 or token.isdigit()) and token.strip('_')]
+
+
+def dialogue_text(dialogue):
+    """The searchable text of a dialogue: its line and the texts of its choices."""
+    parts = [dialogue.get('text') or '']
+    for choice in dialogue.get('choices') or []:
+        if isinstance(choice, dict):
+            parts.append(choice.get('text') or '')
+    return ' '.join(part for part in parts if isinstance(part, str))
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.stats = {'builds': 0, 'build_ms_total': 0.0, 'scenarios_reindexed': 0, 'queries': 0}
+        self._reset()
+        # Versions the index was last synced against
+        self._synced = (None, None)
+
+    def _reset(self):
+        self._postings = {}          # term -> array('I') of doc numbers
+        self._vocabulary = None      # sorted terms, rebuilt lazily for prefix lookups
+        self._kinds = array('B')     # doc -> KIND_*
+        self._owners = []            # doc -> scenario id (or character id)
+        self._items = []             # doc -> dialogue id, or None
+        self._alive = 0
+        self._scenario_docs = {}     # scenario id -> (version, [doc numbers])
+        self._character_docs = {}    # character id -> (version, [doc numbers])
+
+    def _add(self, kind, owner, item, text):
+        terms = set(tokenize(text))
+        if not terms:
+            return None
+        doc = len(self._kinds)
+        self._kinds.append(kind)
+        self._owners.append(owner)
+        self._items.append(item)
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array('I')
+                self._vocabulary = None
+            postings.append(doc)
+        self._alive += 1
+        return doc
+
+    def _remove(self, docs):
+        for doc in docs:
+            if self._owners[doc] is not None:
+                self._owners[doc] = None
+                self._alive -= 1
+
+    def _index_scenario(self, scenario_id, scenario, version):
+        previous = self._scenario_docs.pop(scenario_id, None)
+        if previous:
+            self._remove(previous[1])
+        if not isinstance(scenario, dict):
+            return
+        docs = [
+            self._add(KIND_SCENARIO_TITLE, scenario_id, None, scenario.get('title') or ''),
+            self._add(KIND_SCENARIO_DESCRIPTION, scenario_id, None, scenario.get('description') or ''),
+            self._add(KIND_SCENARIO_AUTHOR, scenario_id, None, scenario.get('author') or ''),
+        ]
+        for dialogue_id, dialogue in (scenario.get('dialogues') or {}).items():
+            if isinstance(dialogue, dict):
+                docs.append(self._add(KIND_DIALOGUE, scenario_id, dialogue_id, dialogue_text(dialogue)))
+        self._scenario_docs[scenario_id] = (version, [doc for doc in docs if doc is not None])
+        self.stats['scenarios_reindexed'] += 1
+
+    def _index_character(self, char_id, character, version):
+        previous = self._character_docs.pop(char_id, None)
+        if previous:
+            self._remove(previous[1])
+        name = character.get('name', '') if isinstance(character, dict) else ''
+        doc = self._add(KIND_CHARACTER, char_id, None, f'{char_id} {name}')
+        self._character_docs[char_id] = (version, [doc] if doc is not None else [])
+
+    def sync(self, manager):
+        """Re-indexes the scenarios and characters whose version changed in ``manager``."""
+        versions = (manager.versions['scenarios'], manager.versions['characters'])
+        if versions == self._synced:
+            return False
+        with self._lock:
+            if versions == self._synced:
+                return False
+            started = time.perf_counter()
+            scenarios, characters = manager.scenarios, manager.characters
+            scenario_meta, character_meta = manager.meta['scenarios'], manager.meta['characters']
+            tombstones = len(self._kinds) - self._alive
+            if not self._kinds or tombstones > COMPACT_RATIO * len(self._kinds):
+                self._reset()
+                self.stats['builds'] += 1
+
+            for docs_by_id, entities, meta, index in (
+                    (self._scenario_docs, scenarios, scenario_meta, self._index_scenario),
+                    (self._character_docs, characters, character_meta, self._index_character)):
+                for entity_id in list(docs_by_id):
+                    if entity_id not in entities:
+                        self._remove(docs_by_id.pop(entity_id)[1])
+                for entity_id, value in entities.items():
+                    version = meta.get(entity_id, {}).get('version')
+                    indexed = docs_by_id.get(entity_id)
+                    if indexed is None or indexed[0] != version:
+                        index(entity_id, value, version)
+
+            self._synced = versions
+            self.stats['build_ms_total'] = round(
+                self.stats['build_ms_total'] + (time.perf_counter() - started) * 1000, 3)
+            return True
+
+    def _expand(self, term, prefix):
+        """Postings of ``term`` and, for prefix terms, of the words it starts: [(postings, exact)]."""
+        matches = []
+        exact = self._postings.get(term)
+        if exact is not None:
+            matches.append((exact, True))
+        if prefix:
+            if self._vocabulary is None:
+                self._vocabulary = sorted(self._postings)
+            position = bisect_left(self._vocabulary, term)
+            for candidate in self._vocabulary[position:position + MAX_PREFIX_EXPANSIONS + 1]:
+                if not candidate.startswith(term):
+                    break
+                if candidate != term:
+                    matches.append((self._postings[candidate], False))
+        return matches
+
+    def search(self, query, hit_types=None, scenario_id=None, offset=0, limit=20, max_matches=MAX_MATCHES):
+        """Ranked hits for ``query``; returns ``(hits, total, total_exact)``.
+
+        Every term must match. A hit scores the idf of each term times the weight of
+        the field it was found in, halved for prefix matches. Collection stops after
+        ``max_matches`` hits (None for no limit); ``total_exact`` is False then.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return [], 0, True
+        kinds = None
+        if hit_types:
+            kinds = {kind for hit_type in hit_types for kind in HIT_TYPES.get(hit_type, ())}
+
+        with self._lock:
+            self.stats['queries'] += 1
+            documents = len(self._kinds) or 1
+            expanded = []
+            for position, term in enumerate(terms):
+                matches = self._expand(term, position == len(terms) - 1 or len(term) >= PREFIX_MIN_LENGTH)
+                if not matches:
+                    return [], 0, True
+                frequency = sum(len(postings) for postings, _ in matches)
+                expanded.append((frequency, math.log(1 + documents / frequency), matches))
+            # Walk the rarest term's documents and look the others up by bisection
+            expanded.sort(key=lambda entry: entry[0])
+            _, first_idf, first_matches = expanded[0]
+
+            def weight_in(matches, doc):
+                best = 0.0
+                for postings, exact in matches:
+                    at = bisect_left(postings, doc)
+                    if at < len(postings) and postings[at] == doc:
+                        if exact:
+                            return 1.0
+                        best = 0.5
+                return best
+
+            scores = {}
+            complete = True
+            for postings, exact in first_matches:
+                for doc in postings:
+                    owner = self._owners[doc]
+                    if owner is None or doc in scores:
+                        continue
+                    kind = self._kinds[doc]
+                    if kinds is not None and kind not in kinds:
+                        continue
+                    if scenario_id is not None and (kind == KIND_CHARACTER or owner != scenario_id):
+                        continue
+                    score = first_idf * (1.0 if exact else 0.5)
+                    for _, idf, matches in expanded[1:]:
+                        weight = weight_in(matches, doc)
+                        if not weight:
+                            break
+                        score += idf * weight
+                    else:
+                        scores[doc] = score * KIND_WEIGHTS[kind]
+                        if max_matches is not None and len(scores) >= max_matches:
+                            complete = False
+                            break
+                if not complete:
+                    break
+
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            page = [(doc, score, self._kinds[doc], self._owners[doc], self._items[doc])
+                    for doc, score in ranked[offset:None if limit is None else offset + limit]]
+        return page, len(scores), complete
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, documents=self._alive, tombstones=len(self._kinds) - self._alive,
+                        terms=len(self._postings), postings=sum(len(postings) for postings in self._postings.values()))
+
+
+def snippet(text, query, length=SNIPPET_LENGTH):
+    """A piece of ``text`` around the first query term it contains."""
+    if not isinstance(text, str):
+        return ''
+    if len(text) <= length:
+        return text
+    folded = normalize(text)
+    start = 0
+    for term in tokenize(query):
+        found = folded.find(term)
+        if found >= 0:
+            start = max(0, found - length // 4)
+            break
+    end = min(len(text), start + length)
+    start = max(0, end - length)
+    return ('…' if start else '') + text[start:end] + ('…' if end < len(text) else '')
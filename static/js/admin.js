@@ -69,6 +69,49 @@ class AdminPanel {
         this.uploadFile('сценариев', 'scenariosFile', '/api/admin/content/upload/scenarios');
     }
 
+    // Zip bundle or many files; dryRun only validates. Lists the outcome of every file.
+    async importBundle(dryRun) {
+        const files = document.getElementById('bundleFiles').files;
+        if (!files.length) {
+            this.showUploadStatus('Выберите архив или файлы для импорта', 'error');
+            return;
+        }
+
+        const formData = new FormData();
+        for (const file of files) {
+            // Folder uploads keep the path inside the folder, which decides where the file goes
+            formData.append('files', file, file.webkitRelativePath || file.name);
+        }
+
+        try {
+            const response = await fetch(`/api/admin/content/import${dryRun ? '?dry_run=1' : ''}`, { method: 'POST', body: formData });
+            const result = await response.json();
+            this.renderImportResults(result.files || []);
+            if (result.success) {
+                const seconds = (result.timing.total_ms / 1000).toFixed(2);
+                this.showUploadStatus(`${result.message} (${seconds} с)`, 'success');
+                this.loadContentStats();
+            } else {
+                this.showUploadStatus(result.error || 'Неизвестная ошибка', 'error');
+            }
+        } catch (error) {
+            this.showUploadStatus('Критическая ошибка при импорте', 'error');
+            console.error('Import error:', error);
+        }
+    }
+
+    renderImportResults(files) {
+        const list = document.getElementById('importResults');
+        list.innerHTML = '';
+        for (const file of files) {
+            const item = document.createElement('li');
+            item.className = `import-result ${file.status}`;
+            const notes = [file.error, ...(file.warnings || [])].filter(Boolean).join('; ');
+            item.textContent = `${file.name}: ${file.status}${notes ? ' — ' + notes : ''}`;
+            list.appendChild(item);
+        }
+    }
+
     async exportContent(contentType) { try { const response = await fetch(`/api/admin/content/export/${contentType}`); const data = await response.json(); const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' }); const url = URL.createObjectURL(blob); const a = document.createElement('a'); a.href = url; a.download = `${contentType}.json`; document.body.appendChild(a); a.click(); document.body.removeChild(a); URL.revokeObjectURL(url); } catch (error) { console.error('Export error:', error); alert('Ошибка при экспорте данных'); } }
 }
 
@@ -80,4 +123,5 @@ document.addEventListener('DOMContentLoaded', () => { adminPanel = new AdminPane
 function uploadCharacters() { adminPanel.uploadCharacters(); }
 function uploadScenes() { adminPanel.uploadScenes(); }
 function uploadScenarios() { adminPanel.uploadScenarios(); }
-function exportContent(type) { adminPanel.exportContent(type); }
\ No newline at end of file
+function exportContent(type) { adminPanel.exportContent(type); }
+function importBundle(dryRun) { adminPanel.importBundle(dryRun); }
\ No newline at end of file
@@ -147,9 +147,12 @@ document.addEventListener("DOMContentLoaded", () => {
   audioPlayer.addEventListener("pause", resetAudioPlayer);
 
   // Load assets from server
-  async function loadAssets() {
+  // quiet: background refresh after a change event, without progress or toasts
+  async function loadAssets(quiet = false) {
     try {
-      showProgress("Загрузка ресурсов...");
+      if (!quiet) {
+        showProgress("Загрузка ресурсов...");
+      }
 
       const response = await fetch("/api/assets/list");
       const result = await response.json();
@@ -157,18 +160,24 @@ document.addEventListener("DOMContentLoaded", () => {
       if (result.success) {
         assetsState = result.assets;
         renderAllAssets();
-        notifications.success(
-          "Обновление завершено",
-          "Списки ресурсов обновлены",
-        );
+        if (!quiet) {
+          notifications.success(
+            "Обновление завершено",
+            "Списки ресурсов обновлены",
+          );
+        }
       } else {
         throw new Error(result.error || "Ошибка загрузки ресурсов");
       }
     } catch (error) {
       console.error("Error loading assets:", error);
-      notifications.error("Ошибка загрузки", error.message);
+      if (!quiet) {
+        notifications.error("Ошибка загрузки", error.message);
+      }
     } finally {
-      hideProgress();
+      if (!quiet) {
+        hideProgress();
+      }
     }
   }
 
@@ -287,7 +296,7 @@ document.addEventListener("DOMContentLoaded", () => {
       if (editBtn) {
         if (location.id) {
           editBtn.addEventListener("click", () =>
-            editLocationName(location.id, displayName),
+            editLocationName(location.id, displayName, location.version),
           );
         } else {
           editBtn.style.display = "none"; // Скрываем кнопку, если нет ID
@@ -308,6 +317,102 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // Files above this size go up in chunks and survive dropped connections
+  const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+  const CHUNK_RETRIES = 5;
+
+  async function uploadInChunks(file, type, onProgress) {
+    // Selecting the same file again after a failure resumes where it stopped
+    const resumeKey = `upload:${type}:${file.name}:${file.size}:${file.lastModified}`;
+    let status = null;
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+      const response = await fetch(`/api/uploads/${savedId}`);
+      if (response.ok) status = await response.json();
+    }
+    if (!status) {
+      const response = await fetch("/api/uploads", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          kind: "asset",
+          type: type,
+          filename: file.name,
+          size: file.size,
+        }),
+      });
+      status = await response.json();
+      if (!status.success) return status;
+      localStorage.setItem(resumeKey, status.upload_id);
+    }
+
+    let failures = 0;
+    while (status.offset < status.size) {
+      const index = Math.floor(status.offset / status.chunk_size);
+      const start = index * status.chunk_size;
+      const chunk = file.slice(start, Math.min(start + status.chunk_size, status.size));
+      try {
+        const response = await fetch(
+          `/api/uploads/${status.upload_id}/chunks/${index}`,
+          {
+            method: "PUT",
+            headers: { "Content-Type": "application/octet-stream" },
+            body: chunk,
+          },
+        );
+        const result = await response.json();
+        if (result.success) {
+          status = result;
+          failures = 0;
+          onProgress(status.offset / status.size);
+          continue;
+        }
+        if (response.status === 409) {
+          status.offset = result.offset;
+          continue;
+        }
+        if (response.status < 500) return result;
+      } catch (error) {
+        // Connection dropped: ask where the server stands and send from there
+      }
+      if (++failures > CHUNK_RETRIES) {
+        return {
+          success: false,
+          error: "Соединение потеряно. Выберите файл снова, чтобы продолжить загрузку",
+        };
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000 * failures));
+      try {
+        const response = await fetch(`/api/uploads/${status.upload_id}`);
+        if (response.ok) status = await response.json();
+      } catch (error) {
+        // Still offline; the next attempt will tell
+      }
+    }
+
+    const response = await fetch(`/api/uploads/${status.upload_id}/finalize`, {
+      method: "POST",
+    });
+    const result = await response.json();
+    if (response.status !== 409 && response.status !== 403) {
+      localStorage.removeItem(resumeKey);
+    }
+    return result;
+  }
+
+  function sendUpload(file, type, onProgress) {
+    if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+      return uploadInChunks(file, type, onProgress);
+    }
+    const formData = new FormData();
+    formData.append("file", file);
+    formData.append("type", type);
+    return fetch("/api/assets/upload", {
+      method: "POST",
+      body: formData,
+    }).then((response) => response.json());
+  }
+
   // Upload assets
   async function uploadAssets(files, type) {
     if (!files || files.length === 0) return;
@@ -320,19 +425,13 @@ document.addEventListener("DOMContentLoaded", () => {
 
       for (let i = 0; i < files.length; i++) {
         const file = files[i];
-        const formData = new FormData();
-        formData.append("file", file);
-        formData.append("type", type);
+        const onProgress = (fraction) =>
+          updateProgress(((i + fraction) / files.length) * 100);
 
         try {
           updateProgress((i / files.length) * 100);
 
-          const response = await fetch("/api/assets/upload", {
-            method: "POST",
-            body: formData,
-          });
-
-          const result = await response.json();
+          const result = await sendUpload(file, type, onProgress);
 
           if (result.success) {
             uploaded++;
@@ -341,11 +440,7 @@ document.addEventListener("DOMContentLoaded", () => {
             const authenticated = await auth.ensureAuthenticated();
             if (authenticated) {
               // Retry the upload after authentication
-              const retryResponse = await fetch("/api/assets/upload", {
-                method: "POST",
-                body: formData,
-              });
-              const retryResult = await retryResponse.json();
+              const retryResult = await sendUpload(file, type, onProgress);
               if (retryResult.success) {
                 uploaded++;
               } else {
@@ -439,7 +534,7 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   // Edit location name
-  async function editLocationName(locationId, currentName) {
+  async function editLocationName(locationId, currentName, version) {
     const newName = await notifications.prompt(
       "Редактирование названия локации",
       "Введите новое название локации:",
@@ -461,6 +556,7 @@ document.addEventListener("DOMContentLoaded", () => {
         body: JSON.stringify({
           location_id: locationId,
           new_name: newName.trim(),
+          expected_version: version,
         }),
       });
 
@@ -477,7 +573,7 @@ document.addEventListener("DOMContentLoaded", () => {
         const authenticated = await auth.ensureAuthenticated();
         if (authenticated) {
           // Retry the edit after authentication
-          await editLocationName(locationId, currentName);
+          await editLocationName(locationId, currentName, version);
           return;
         }
       } else {
@@ -633,5 +729,13 @@ document.addEventListener("DOMContentLoaded", () => {
   });
 
   // Initialize
+  // Files added or removed elsewhere (another admin, another worker) arrive
+  // as a burst of events; refresh once per burst
+  let refreshTimer = null;
+  contentEvents.subscribe(["assets", "scenes"], () => {
+    clearTimeout(refreshTimer);
+    refreshTimer = setTimeout(() => loadAssets(true), 300);
+  });
+
   loadAssets();
 });
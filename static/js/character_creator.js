@@ -19,6 +19,11 @@ document.addEventListener('DOMContentLoaded', () => {
         poses: {}
     };
 
+    // Version of the character as it was loaded from the server; sent back on save
+    // so that a concurrent edit is reported instead of overwritten
+    let loadedVersion = { id: null, version: null };
+    const characterVersions = {};
+
     const poseGrid = document.getElementById('pose-grid');
     const idInput = document.getElementById('char-id');
     const nameInput = document.getElementById('char-name');
@@ -232,6 +237,9 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                 }
             };
+            if (loadedVersion.id === characterState.id && loadedVersion.version) {
+                characterData.expected_version = loadedVersion.version;
+            }
 
             const response = await fetch('/api/characters/save', {
                 method: 'POST',
@@ -244,6 +252,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const result = await response.json();
 
             if (result.success) {
+                loadedVersion = { id: characterState.id, version: result.version };
                 notifications.success('Успешно', result.message);
                 await loadCharactersList();
             } else if (result.requires_auth) {
@@ -272,6 +281,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 loadSelect.innerHTML = '<option value="">-- Загрузить персонажа --</option>';
                 
                 result.characters.forEach(char => {
+                    characterVersions[char.id] = char.version;
                     const option = new Option(
                         `${char.name} (ID: ${char.id})`,
                         char.id
@@ -300,6 +310,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 voiceSelect.value = char.voice || '';
                 updatePreviewButtonState();
                 
+                loadedVersion = { id: characterId, version: characterVersions[characterId] || null };
                 characterState = {
                     id: characterId,
                     name: char.name || '',
@@ -352,6 +363,7 @@ document.addEventListener('DOMContentLoaded', () => {
             voiceSelect.value = '';
             updatePreviewButtonState();
             
+            loadedVersion = { id: null, version: null };
             characterState = {
                 id: '',
                 name: '',
@@ -473,6 +485,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 voiceSelect.value = loadedCharacter.voice || '';
                 updatePreviewButtonState();
                 
+                loadedVersion = { id: null, version: null };
                 characterState = {
                     id: characterId,
                     name: loadedCharacter.name || '',
@@ -569,6 +582,19 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Live updates: keep the list current and report a concurrent save of the open character
+    contentEvents.subscribe(['characters'], (change) => {
+        loadCharactersList();
+        if (change.type === 'characters' && change.id === loadedVersion.id && change.version !== loadedVersion.version) {
+            notifications.warning(
+                'Персонаж изменён',
+                change.version
+                    ? 'Этого персонажа сохранили в другом окне. Перезагрузите его перед сохранением.'
+                    : 'Этот персонаж удалён.'
+            );
+        }
+    });
+
     initializePoseSlots();
     populateVoiceDropdown();
     loadCharactersList();
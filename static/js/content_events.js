@@ -0,0 +1,54 @@
+// Live content change notifications (/api/events)
+class ContentEvents {
+    constructor() {
+        this.listeners = [];
+        this.source = null;
+    }
+
+    // Call callback({type, id, version}) for changes of the given content types;
+    // version is null when the entity was deleted. On 'reset' (too many changes
+    // were missed) the callback gets {type: 'reset'} and should reload everything.
+    subscribe(types, callback) {
+        this.listeners.push({ types: new Set(types), callback });
+        this.connect();
+    }
+
+    connect() {
+        if (this.source || typeof EventSource === 'undefined') {
+            return;
+        }
+        // The browser reconnects on its own and resends Last-Event-ID
+        this.source = new EventSource('/api/events');
+        this.source.addEventListener('change', (event) => {
+            this.dispatch(JSON.parse(event.data));
+        });
+        this.source.addEventListener('reset', () => {
+            this.dispatch({ type: 'reset', id: null, version: null });
+        });
+    }
+
+    dispatch(change) {
+        for (const listener of this.listeners) {
+            if (change.type === 'reset' || listener.types.has(change.type)) {
+                try {
+                    listener.callback(change);
+                } catch (error) {
+                    console.error('Content event handler failed:', error);
+                }
+            }
+        }
+    }
+
+    // Fetch one character, scene or scenario after a change event
+    async fetchEntity(type, id) {
+        const response = await fetch(`/api/content/${type}/${encodeURIComponent(id)}`);
+        if (!response.ok) {
+            return null;
+        }
+        const data = await response.json();
+        return { version: data.version, value: data[type][id] };
+    }
+}
+
+// Create global content events client
+const contentEvents = new ContentEvents();
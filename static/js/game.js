@@ -8,6 +8,18 @@ class AudioManager {
     this.fadeInterval = null;
     this.isUnlocked = false;
     this.actionLock = false;
+    // Voice sprite playback: the loaded sprite URL and where the current line ends
+    this.voiceSprite = null;
+    this.voiceClipEnd = null;
+    this.voicePlayer.addEventListener("timeupdate", () => {
+      if (
+        this.voiceClipEnd !== null &&
+        this.voicePlayer.currentTime >= this.voiceClipEnd
+      ) {
+        this.voicePlayer.pause();
+        this.voiceClipEnd = null;
+      }
+    });
   }
 
   playBGM(src) {
@@ -88,13 +100,29 @@ class AudioManager {
   }
 
   playVoice(src) {
+    this.voiceSprite = null;
+    this.voiceClipEnd = null;
     this.voicePlayer.src = src;
     this.voicePlayer.play().catch((e) => {});
   }
 
+  // Plays [start, start + duration) of a sprite; the file is loaded once and seeked in
+  playVoiceClip(src, start, duration) {
+    if (this.voiceSprite !== src) {
+      this.voiceSprite = src;
+      this.voicePlayer.src = src;
+    }
+    this.voicePlayer.currentTime = start;
+    this.voiceClipEnd = start + duration;
+    this.voicePlayer.play().catch((e) => {});
+  }
+
   stopVoice() {
+    this.voiceClipEnd = null;
     if (!this.voicePlayer.paused) {
       this.voicePlayer.pause();
+      // Keep a sprite loaded for the next line
+      if (this.voiceSprite) return;
       this.voicePlayer.currentTime = 0;
       this.voicePlayer.src = "";
     }
@@ -142,12 +170,27 @@ class AudioManager {
 class VisualNovelEngine {
   constructor() {
     this.gameData = { characters: {}, scenes: {}, scenarios: {} };
+    this.scenarioIndex = {};
+    this.assetLookahead = {};
+    this.prefetchedAssets = new Set();
+    this.prefetchSteps = 3;
+    this.prefetchBudget = 4 * 1024 * 1024;
+    this.imageVariants = {};
+    this.audioVariants = {};
+    this.canPlayOpus =
+      document.createElement("audio").canPlayType('audio/ogg; codecs="opus"') !==
+      "";
+    this.supportedImageFormats = ["webp"];
     this.gameState = {
       currentScenario: null,
       currentDialogue: "start",
       variables: {},
       history: [],
     };
+    // What the server already has of this playthrough: { slot, revision, length };
+    // saves only send the history entries after `length`
+    this.saveBase = null;
+    this.saveSlot = "default";
     this.settings = { textSpeed: 30, autoPlay: false, fullscreen: false };
     this.isTyping = false;
     this.currentText = "";
@@ -161,12 +204,16 @@ class VisualNovelEngine {
 
   async initializeEngine() {
     console.log("Initializing Visual Novel Engine v4.0...");
-    await this.loadContentFromServer();
+    await Promise.all([
+      this.loadContentFromServer(),
+      this.detectImageFormats(),
+    ]);
     this.setupEventListeners();
+    this.subscribeToContentChanges();
     this.loadSettings();
 
     const scenarioToStart = document.body.dataset.scenarioToStart;
-    if (scenarioToStart && this.gameData.scenarios[scenarioToStart]) {
+    if (scenarioToStart && this.scenarioIndex[scenarioToStart]) {
       console.log(
         `Found scenario '${scenarioToStart}' from URL parameter. Preparing start screen.`,
       );
@@ -211,25 +258,204 @@ class VisualNovelEngine {
     });
   }
 
+  // Scenarios edited while the game is open: refresh the menu and drop cached
+  // copies, except the one being played (it reloads on the next start).
+  // content_events.js is only included when streams are cheap (served by asgi.py)
+  subscribeToContentChanges() {
+    if (typeof contentEvents === "undefined") return;
+    contentEvents.subscribe(["scenarios"], (change) => {
+      if (change.type === "scenarios" && change.id !== this.gameState.currentScenario) {
+        delete this.gameData.scenarios[change.id];
+        delete this.assetLookahead[change.id];
+      }
+      this.loadContentFromServer();
+    });
+  }
+
   async loadContentFromServer() {
     try {
-      const [charactersResponse, scenesResponse, scenariosResponse] =
-        await Promise.all([
-          fetch("/api/content/characters"),
-          fetch("/api/content/scenes"),
-          fetch("/api/content/scenarios"),
-        ]);
-      this.gameData.characters = await charactersResponse.json();
-      this.gameData.scenes = await scenesResponse.json();
-      this.gameData.scenarios = await scenariosResponse.json();
-      console.log("Content loaded from server:", this.gameData);
+      const response = await fetch("/api/scenarios/index");
+      const result = await response.json();
+      this.scenarioIndex = {};
+      (result.scenarios || []).forEach((entry) => {
+        this.scenarioIndex[entry.id] = entry;
+      });
+      console.log("Scenario index loaded from server:", this.scenarioIndex);
     } catch (error) {
       console.error("Error loading content from server:", error);
     }
   }
 
+  async ensureScenarioLoaded(scenarioId) {
+    const entry = this.scenarioIndex[scenarioId];
+    const loaded = this.gameData.scenarios[scenarioId];
+    if (loaded && (!entry || loaded.version === entry.version)) {
+      return loaded;
+    }
+
+    try {
+      const response = await fetch(
+        `/api/scenarios/load/${encodeURIComponent(scenarioId)}?include=refs&format=compiled`,
+      );
+      if (!response.ok) return null;
+      const data = await response.json();
+      const scenario = data.scenarios && data.scenarios[scenarioId];
+      if (!scenario) return null;
+
+      Object.assign(this.gameData.characters, data.characters || {});
+      Object.assign(this.gameData.scenes, data.scenes || {});
+
+      // Compiled graph: nodes are addressed by position, edges are positions too
+      const index = {};
+      scenario.ids.forEach((dialogueId, position) => {
+        index[dialogueId] = position;
+      });
+      const voice = data.voice || { lines: [], sprite: null };
+      this.gameData.scenarios[scenarioId] = {
+        ...scenario,
+        index,
+        voiceLines: new Set(voice.lines),
+        voiceSprite: voice.sprite,
+      };
+      this.loadAssetLookahead(scenarioId);
+      this.loadImageVariants(scenarioId);
+      return this.gameData.scenarios[scenarioId];
+    } catch (error) {
+      console.error(`Error loading scenario ${scenarioId}:`, error);
+      return null;
+    }
+  }
+
+  async loadAssetLookahead(scenarioId) {
+    try {
+      const response = await fetch(
+        `/api/scenarios/lookahead/${encodeURIComponent(scenarioId)}?steps=${this.prefetchSteps}`,
+      );
+      if (!response.ok) return;
+      this.assetLookahead[scenarioId] = await response.json();
+      if (this.gameState.currentScenario === scenarioId) {
+        this.prefetchAssets(this.gameState.currentDialogue);
+      }
+    } catch (error) {
+      console.warn(`Asset lookahead unavailable for ${scenarioId}:`, error);
+    }
+  }
+
+  async detectImageFormats() {
+    const avifSample =
+      "data:image/avif;base64,AAAAIGZ0eXBhdmlmAAAAAGF2aWZtaWYxbWlhZk1BMUIAAADrbWV0YQAAAAAAAAAhaGRscgAAAAAAAAAAcGljdAAAAAAAAAAAAAAAAAAAAAAOcGl0bQAAAAAAAQAAAB5pbG9jAAAAAEQAAAEAAQAAAAEAAAETAAAAIQAAAChpaW5mAAAAAAABAAAAGmluZmUCAAAAAAEAAGF2MDFDb2xvcgAAAABqaXBycAAAAEtpcGNvAAAAFGlzcGUAAAAAAAAAAQAAAAEAAAAQcGl4aQAAAAADCAgIAAAADGF2MUOBAAwAAAAAE2NvbHJuY2x4AAEADQAGgAAAABdpcG1hAAAAAAAAAAEAAQQBAoMEAAAAKW1kYXQSAAoIGAAGiAhoNCAyExlHh4Yhh5555oAAAJBAyRxhQr4=";
+    const supported = await new Promise((resolve) => {
+      const image = new Image();
+      image.onload = () => resolve(image.width > 0);
+      image.onerror = () => resolve(false);
+      image.src = avifSample;
+    });
+    if (supported) this.supportedImageFormats = ["avif", "webp"];
+  }
+
+  async loadImageVariants(scenarioId) {
+    try {
+      const response = await fetch(
+        `/api/assets/variants?scenario=${encodeURIComponent(scenarioId)}`,
+      );
+      if (!response.ok) return;
+      const result = await response.json();
+      Object.assign(this.imageVariants, result.images || {});
+      Object.assign(this.audioVariants, result.audio || {});
+    } catch (error) {
+      console.warn(`Image variants unavailable for ${scenarioId}:`, error);
+    }
+  }
+
+  resolveImage(url, displayWidth = window.innerWidth) {
+    const variants = this.imageVariants[url];
+    if (!variants || variants.length === 0) return url;
+
+    // Smallest variant that still covers the rendered size, in the best supported format
+    const wanted = displayWidth * (window.devicePixelRatio || 1);
+    for (const format of this.supportedImageFormats) {
+      const candidates = variants
+        .filter((variant) => variant.format === format)
+        .sort((a, b) => a.width - b.width);
+      if (candidates.length === 0) continue;
+      return (
+        candidates.find((variant) => variant.width >= wanted) ||
+        candidates[candidates.length - 1]
+      ).url;
+    }
+    return url;
+  }
+
+  resolveAudio(url) {
+    const variants = this.audioVariants[url];
+    if (!this.canPlayOpus || !variants || variants.length === 0) return url;
+    return variants[0].url;
+  }
+
+  voiceSpriteUrl(sprite) {
+    if (!sprite) return null;
+    const variant = sprite.variants.find(
+      (variant) => variant.codec !== "opus" || this.canPlayOpus,
+    );
+    return variant ? variant.url : null;
+  }
+
+  // Only lines the server listed have a voice file, so the others cost no request
+  playVoiceLine(dialogueId) {
+    const scenario = this.gameData.scenarios[this.gameState.currentScenario];
+    if (!scenario.voiceLines || !scenario.voiceLines.has(dialogueId)) return;
+
+    const clip = scenario.voiceSprite && scenario.voiceSprite.lines[dialogueId];
+    const spriteUrl = clip && this.voiceSpriteUrl(scenario.voiceSprite);
+    if (spriteUrl) {
+      this.audioManager.playVoiceClip(spriteUrl, clip[0], clip[1]);
+      return;
+    }
+    const voicePath = `/static/audio/voice/game_voice/${this.gameState.currentScenario}_${dialogueId}.wav`;
+    this.audioManager.playVoice(this.resolveAudio(voicePath));
+  }
+
+  prefetchAssets(dialogueId) {
+    const manifest = this.assetLookahead[this.gameState.currentScenario];
+    if (!manifest || !manifest.nodes[dialogueId]) return;
+    const scenario = this.gameData.scenarios[this.gameState.currentScenario];
+    const sprite = scenario && scenario.voiceSprite;
+    const spriteUrl = this.voiceSpriteUrl(sprite);
+
+    // Nearest assets first; skip whatever does not fit into the per-step budget
+    let budget = this.prefetchBudget;
+    for (const [assetIndex, distance] of manifest.nodes[dialogueId]) {
+      if (distance === 0) continue;
+      const asset = manifest.assets[assetIndex];
+      if (this.prefetchedAssets.has(asset.url) || asset.size > budget) continue;
+      // Lines in the voice sprite arrive with it
+      if (spriteUrl && this.isSpriteVoice(asset.url, sprite)) continue;
+      budget -= asset.size;
+      this.prefetchedAssets.add(asset.url);
+
+      if (/\.(png|jpe?g|webp|avif|gif)$/i.test(asset.url)) {
+        const image = new Image();
+        image.src = this.resolveImage(asset.url);
+      } else {
+        const link = document.createElement("link");
+        link.rel = "prefetch";
+        link.href = this.resolveAudio(asset.url);
+        document.head.appendChild(link);
+      }
+    }
+  }
+
+  isSpriteVoice(url, sprite) {
+    const prefix = `/static/audio/voice/game_voice/${this.gameState.currentScenario}_`;
+    return (
+      url.startsWith(prefix) &&
+      url.endsWith(".wav") &&
+      sprite.lines[url.slice(prefix.length, -".wav".length)] !== undefined
+    );
+  }
+
   prepareScenarioStartScreen(scenarioId) {
-    const scenario = this.gameData.scenarios[scenarioId];
+    const scenario = this.scenarioIndex[scenarioId];
     if (!scenario) {
       this.showMainMenu();
       return;
@@ -261,7 +487,7 @@ class VisualNovelEngine {
     const scenarioList = document.getElementById("scenarioList");
     scenarioList.innerHTML = "";
 
-    const scenarios = Object.entries(this.gameData.scenarios);
+    const scenarios = Object.entries(this.scenarioIndex);
 
     if (scenarios.length === 0) {
       scenarioList.innerHTML =
@@ -293,18 +519,19 @@ class VisualNovelEngine {
     this.audioManager.unlockAudio();
     this.hideChoices();
 
-    const scenario = this.gameData.scenarios[scenarioId];
-    if (!scenario || Object.keys(scenario.dialogues).length === 0) {
+    const scenario = await this.ensureScenarioLoaded(scenarioId);
+    if (!scenario || scenario.nodes.length === 0 || scenario.start === null) {
       alert("Ошибка: Сценарий не найден или пуст!");
       return;
     }
 
     this.gameState = {
       currentScenario: scenarioId,
-      currentDialogue: scenario.start_dialogue || "start",
+      currentDialogue: scenario.ids[scenario.start],
       variables: {},
       history: [],
     };
+    this.saveBase = null;
 
     this.updateScenarioInfoDisplay(scenarioId);
 
@@ -320,9 +547,23 @@ class VisualNovelEngine {
       if (
         savedState &&
         savedState.currentScenario &&
-        savedState.currentDialogue
+        savedState.currentDialogue &&
+        (await this.ensureScenarioLoaded(savedState.currentScenario))
       ) {
-        this.gameState = savedState;
+        this.gameState = {
+          currentScenario: savedState.currentScenario,
+          currentDialogue: savedState.currentDialogue,
+          variables: savedState.variables || {},
+          history: savedState.history || [],
+        };
+        if (savedState.slot) {
+          this.saveSlot = savedState.slot;
+          this.saveBase = {
+            slot: savedState.slot,
+            revision: savedState.revision,
+            length: this.gameState.history.length,
+          };
+        }
 
         this.updateScenarioInfoDisplay(savedState.currentScenario);
 
@@ -345,33 +586,30 @@ class VisualNovelEngine {
     this.showScreen("mainMenu");
   }
 
-  checkCondition(conditionString) {
-    if (!conditionString) return true;
+  getDialogue(dialogueId) {
+    const scenario = this.gameData.scenarios[this.gameState.currentScenario];
+    if (!scenario) return null;
+    const position = scenario.index[dialogueId];
+    return position === undefined ? null : scenario.nodes[position];
+  }
 
-    const operators = /(==|!=|>=|<=|>|<)/;
-    const parts = conditionString.split(operators).map((p) => p.trim());
+  dialogueIdAt(position) {
+    if (position === null || position === undefined) return null;
+    const scenario = this.gameData.scenarios[this.gameState.currentScenario];
+    return scenario ? scenario.ids[position] : null;
+  }
 
-    if (parts.length !== 3) {
-      console.error(`Invalid condition format: "${conditionString}"`);
-      return false;
-    }
+  checkCondition(condition) {
+    // Conditions arrive pre-parsed as [variable, operator, value];
+    // malformed ones are compiled to false on the server
+    if (condition === null || condition === undefined) return true;
+    if (!Array.isArray(condition)) return false;
 
-    const [varName, operator, valueStr] = parts;
+    const [varName, operator, compareValue] = condition;
 
     let stateValue = this.gameState.variables[varName];
     if (stateValue === undefined) stateValue = 0;
 
-    let compareValue;
-    if (valueStr.toLowerCase() === "true") {
-      compareValue = true;
-    } else if (valueStr.toLowerCase() === "false") {
-      compareValue = false;
-    } else if (!isNaN(parseFloat(valueStr))) {
-      compareValue = parseFloat(valueStr);
-    } else {
-      compareValue = valueStr.replace(/^['"]|['"]$/g, "");
-    }
-
     switch (operator) {
       case "==":
         return stateValue == compareValue;
@@ -390,14 +628,10 @@ class VisualNovelEngine {
     }
   }
 
-  setVariable(key, value) {
-    if (
-      typeof value === "string" &&
-      (value.startsWith("+") || value.startsWith("-"))
-    ) {
+  applyEffect([key, operation, value]) {
+    if (operation === "add") {
       const currentVal = this.gameState.variables[key] || 0;
-      const change = parseFloat(value);
-      this.gameState.variables[key] = currentVal + change;
+      this.gameState.variables[key] = currentVal + value;
     } else {
       this.gameState.variables[key] = value;
     }
@@ -417,7 +651,7 @@ class VisualNovelEngine {
         console.error("Scenario not found");
         return;
       }
-      dialogue = scenario.dialogues[currentId];
+      dialogue = this.getDialogue(currentId);
       if (!dialogue) {
         console.error(`Dialogue not found: ${currentId}`);
         return;
@@ -426,7 +660,9 @@ class VisualNovelEngine {
       if (this.checkCondition(dialogue.condition)) {
         break;
       } else {
-        currentId = dialogue.next_if_false || dialogue.next;
+        currentId = this.dialogueIdAt(
+          dialogue.next_if_false ?? dialogue.next,
+        );
         if (!currentId) {
           this.showMainMenu();
           return;
@@ -440,14 +676,15 @@ class VisualNovelEngine {
     }
 
     if (dialogue.bgm) {
-      this.audioManager.playBGM(dialogue.bgm);
+      this.audioManager.playBGM(
+        dialogue.bgm === "stop" ? "stop" : this.resolveAudio(dialogue.bgm),
+      );
     }
     if (dialogue.sfx) {
-      this.audioManager.playSFX(dialogue.sfx);
+      this.audioManager.playSFX(this.resolveAudio(dialogue.sfx));
     }
 
-    const voicePath = `/static/audio/voice/game_voice/${this.gameState.currentScenario}_${currentId}.wav`;
-    this.audioManager.playVoice(voicePath);
+    this.playVoiceLine(currentId);
 
     if (dialogue.scene && this.gameData.scenes[dialogue.scene]) {
       this.setBackground(this.gameData.scenes[dialogue.scene].background);
@@ -469,12 +706,15 @@ class VisualNovelEngine {
       this.hideCharacterName();
     }
 
+    this.prefetchAssets(currentId);
+
     await this.typeText(dialogue.text);
 
     if (dialogue.choices && dialogue.choices.length > 0) {
       this.showChoices(dialogue.choices, dialogue.character);
-    } else if (dialogue.next) {
-      this.setNextAction(() => this.displayDialogue(dialogue.next));
+    } else if (dialogue.next !== null) {
+      const nextId = this.dialogueIdAt(dialogue.next);
+      this.setNextAction(() => this.displayDialogue(nextId));
     } else {
       this.setNextAction(() => this.showMainMenu());
     }
@@ -521,18 +761,11 @@ class VisualNovelEngine {
       });
       choicesContainer.classList.remove("hidden");
     } else {
-      if (
-        this.gameData.scenarios[this.gameState.currentScenario].dialogues[
-          this.gameState.currentDialogue
-        ].next
-      ) {
-        this.setNextAction(() =>
-          this.displayDialogue(
-            this.gameData.scenarios[this.gameState.currentScenario].dialogues[
-              this.gameState.currentDialogue
-            ].next,
-          ),
-        );
+      const nextId = this.dialogueIdAt(
+        this.getDialogue(this.gameState.currentDialogue).next,
+      );
+      if (nextId) {
+        this.setNextAction(() => this.displayDialogue(nextId));
       } else {
         this.setNextAction(() => this.showMainMenu());
       }
@@ -565,7 +798,8 @@ class VisualNovelEngine {
       timestamp: new Date().toLocaleTimeString(),
     });
   }
-  setBackground(newBackgroundUrl) {
+  setBackground(backgroundUrl) {
+    const newBackgroundUrl = this.resolveImage(backgroundUrl);
     const bgContainer = document.getElementById("backgroundContainer");
     const bg1 = document.getElementById("backgroundImage1");
     const bg2 = document.getElementById("backgroundImage2");
@@ -618,8 +852,11 @@ class VisualNovelEngine {
       if (!charData) return;
 
       const pose = charInfo.pose || "neutral";
-      const posePath = charData.poses[pose];
-      if (!posePath) return;
+      if (!charData.poses[pose]) return;
+      const posePath = this.resolveImage(
+        charData.poses[pose],
+        window.innerWidth / 2,
+      );
 
       let leftPosition;
       if (numCharacters === 1) leftPosition = 50;
@@ -692,14 +929,10 @@ class VisualNovelEngine {
     this.isTyping = false;
   }
   selectChoice(choice) {
-    if (choice.set) {
-      for (const key in choice.set) {
-        this.setVariable(key, choice.set[key]);
-      }
-    }
+    (choice.set || []).forEach((effect) => this.applyEffect(effect));
 
-    if (choice.next) {
-      this.displayDialogue(choice.next);
+    if (choice.next !== null) {
+      this.displayDialogue(this.dialogueIdAt(choice.next));
     }
     this.hideChoices();
   }
@@ -764,15 +997,46 @@ class VisualNovelEngine {
   hideHistory() {
     this.showScreen("gameScreen");
   }
-  async saveGame() {
+  async saveGame(slot = this.saveSlot, fullHistory = false) {
+    const history = this.gameState.history;
+    const base =
+      !fullHistory &&
+      this.saveBase &&
+      this.saveBase.slot === slot &&
+      this.saveBase.length <= history.length
+        ? this.saveBase
+        : null;
     try {
       const response = await fetch("/api/game/save", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(this.gameState),
+        body: JSON.stringify({
+          slot,
+          currentScenario: this.gameState.currentScenario,
+          currentDialogue: this.gameState.currentDialogue,
+          variables: this.gameState.variables,
+          history: base ? history.slice(base.length) : history,
+          history_base: base ? base.length : 0,
+          base_revision: base ? base.revision : null,
+        }),
       });
       const result = await response.json();
+      if (result.resync && !fullHistory) {
+        // The slot changed elsewhere; send the whole history once
+        await this.saveGame(slot, true);
+        return;
+      }
       if (result.success) {
+        // The server keeps only the latest entries; stay in step with what it has
+        if (result.history_trimmed) {
+          this.gameState.history.splice(0, result.history_trimmed);
+        }
+        this.saveSlot = result.slot;
+        this.saveBase = {
+          slot: result.slot,
+          revision: result.revision,
+          length: result.history_length,
+        };
         alert("💾 Игра сохранена!");
       } else {
         alert("❌ Ошибка при сохранении: " + (result.error || ""));
@@ -824,7 +1088,10 @@ function showMainMenu() {
   if (engine) engine.showMainMenu();
 }
 function showScenarioSelection() {
-  if (engine) engine.showScenarioSelection();
+  if (!engine) return;
+  // Revalidated with ETag (a 304 when nothing changed); scenarios whose version
+  // changed are reloaded when started, see ensureScenarioLoaded
+  engine.loadContentFromServer().then(() => engine.showScenarioSelection());
 }
 function startGame(id) {
   if (engine) engine.startGame(id);
@@ -12,6 +12,10 @@ document.addEventListener("DOMContentLoaded", () => {
     },
   };
 
+  // Version of the scenario as loaded from the server; sent back on save so a
+  // concurrent edit is reported instead of silently overwritten
+  let loadedVersion = { id: null, version: null };
+
   const charactersData = JSON.parse(
     document.getElementById("characters-data").textContent,
   );
@@ -27,8 +31,11 @@ document.addEventListener("DOMContentLoaded", () => {
   const loadScenarioBtn = document.getElementById("load-scenario-btn");
   const newScenarioBtn = document.getElementById("new-scenario-btn");
   const exportScenarioBtn = document.getElementById("export-scenario-btn");
+  const exportBundleBtn = document.getElementById("export-bundle-btn");
   const importScenarioBtn = document.getElementById("import-scenario-btn");
   const importScenarioInput = document.getElementById("import-scenario-input");
+  const searchInput = document.getElementById("search-input");
+  const searchResults = document.getElementById("search-results");
   const cardsContainer = document.getElementById("dialogue-cards-container");
   const cardTemplate = document.getElementById("dialogue-card-template");
   const choiceTemplate = document.getElementById("choice-row-template");
@@ -732,6 +739,12 @@ document.addEventListener("DOMContentLoaded", () => {
         },
       },
     };
+    if (
+      loadedVersion.id === scenarioState.meta.id &&
+      loadedVersion.version
+    ) {
+      finalJson.expected_version = loadedVersion.version;
+    }
 
     try {
       const response = await fetch("/api/scenarios/save", {
@@ -745,7 +758,14 @@ document.addEventListener("DOMContentLoaded", () => {
       const result = await response.json();
 
       if (result.success) {
+        loadedVersion = { id: scenarioState.meta.id, version: result.version };
         notifications.success("Успешно", result.message);
+        if (result.warnings && result.warnings.length > 0) {
+          notifications.warning(
+            "Проблемы в сценарии",
+            result.warnings.slice(0, 5).join("\n"),
+          );
+        }
         await loadScenariosList();
       } else if (result.requires_auth) {
         // Authentication required - prompt for login
@@ -809,6 +829,7 @@ document.addEventListener("DOMContentLoaded", () => {
         return;
       }
 
+      loadedVersion = { id: scenarioId, version: data.version || null };
       scenarioState.meta.id = scenarioId;
       scenarioState.meta.title = loadedScenario.title || "";
       scenarioState.meta.description = loadedScenario.description || "";
@@ -833,6 +854,7 @@ document.addEventListener("DOMContentLoaded", () => {
       "Создать новый сценарий?\n\nНесохранённые изменения будут потеряны.",
     );
     if (shouldCreate) {
+      loadedVersion = { id: null, version: null };
       scenarioState = {
         meta: {
           id: "",
@@ -861,6 +883,77 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   });
 
+  // Full-text search over all scenarios; a hit opens its scenario at the dialogue
+  let searchTimer = null;
+  let searchRequest = 0;
+
+  async function runSearch(query) {
+    const requestId = ++searchRequest;
+    if (!query) {
+      searchResults.innerHTML = "";
+      return;
+    }
+    try {
+      const params = new URLSearchParams({
+        q: query,
+        type: "scenarios,dialogues",
+        per_page: 20,
+      });
+      const response = await fetch(`/api/search?${params}`);
+      const result = await response.json();
+      if (requestId !== searchRequest) return;
+
+      searchResults.innerHTML = "";
+      if (!result.success || !result.hits.length) {
+        const empty = document.createElement("div");
+        empty.className = "search-empty";
+        empty.textContent = result.error || "Ничего не найдено";
+        searchResults.appendChild(empty);
+        return;
+      }
+      result.hits.forEach((hit) => {
+        const item = document.createElement("button");
+        item.type = "button";
+        item.className = "search-hit";
+        const title = document.createElement("strong");
+        title.textContent = hit.dialogue
+          ? `${hit.scenario_title} › ${hit.dialogue}`
+          : hit.scenario_title;
+        const snippet = document.createElement("span");
+        snippet.textContent = hit.snippet;
+        item.append(title, snippet);
+        item.addEventListener("click", () => openSearchHit(hit));
+        searchResults.appendChild(item);
+      });
+      if (result.total > result.hits.length) {
+        const more = document.createElement("div");
+        more.className = "search-empty";
+        more.textContent = `Показано ${result.hits.length} из ${result.total}${result.total_exact ? "" : "+"}`;
+        searchResults.appendChild(more);
+      }
+    } catch (error) {
+      console.error("Error searching:", error);
+    }
+  }
+
+  async function openSearchHit(hit) {
+    if (scenarioState.meta.id !== hit.scenario) {
+      await loadScenario(hit.scenario);
+    }
+    if (!hit.dialogue) return;
+    const card = cardsContainer.querySelector(
+      `[data-id="${CSS.escape(hit.dialogue)}"]`,
+    );
+    if (card) {
+      card.scrollIntoView({ behavior: "smooth", block: "center" });
+    }
+  }
+
+  searchInput.addEventListener("input", () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(() => runSearch(searchInput.value.trim()), 250);
+  });
+
   function exportScenario() {
     if (!scenarioState.meta.id) {
       notifications.error(
@@ -900,6 +993,28 @@ document.addEventListener("DOMContentLoaded", () => {
     );
   }
 
+  // The bundle is built on the server from the saved scenario, with all its assets
+  async function exportBundle() {
+    if (!loadedVersion.id || loadedVersion.id !== scenarioState.meta.id) {
+      notifications.error(
+        "Сценарий не сохранён",
+        "Сохраните или загрузите сценарий перед экспортом пакета",
+      );
+      return;
+    }
+
+    const authenticated = await auth.ensureAuthenticated();
+    if (!authenticated) {
+      return;
+    }
+
+    const a = document.createElement("a");
+    a.href = `/api/admin/content/bundle/${encodeURIComponent(loadedVersion.id)}`;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+  }
+
   function importScenario(file) {
     const reader = new FileReader();
     reader.onload = async function (e) {
@@ -961,6 +1076,7 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   exportScenarioBtn.addEventListener("click", exportScenario);
+  exportBundleBtn.addEventListener("click", exportBundle);
 
   importScenarioBtn.addEventListener("click", () => {
     importScenarioInput.click();
@@ -985,6 +1101,37 @@ document.addEventListener("DOMContentLoaded", () => {
     .querySelector(".creator-container")
     .addEventListener("click", handleClicks);
 
+  // Live updates: characters and scenes edited elsewhere show up in new
+  // dropdowns; a concurrent save of the open scenario is reported right away
+  contentEvents.subscribe(["scenarios", "characters", "scenes"], async (change) => {
+    if (change.type === "reset" || change.type === "scenarios") {
+      loadScenariosList();
+    }
+    if (
+      change.type === "scenarios" &&
+      change.id === loadedVersion.id &&
+      change.version !== loadedVersion.version
+    ) {
+      notifications.warning(
+        "Сценарий изменён",
+        change.version
+          ? "Этот сценарий сохранили в другом окне. Перезагрузите его перед сохранением."
+          : "Этот сценарий удалён.",
+      );
+    }
+    if (change.type === "characters" || change.type === "scenes") {
+      const target = change.type === "characters" ? charactersData : scenesData;
+      const entity = change.version
+        ? await contentEvents.fetchEntity(change.type, change.id)
+        : null;
+      if (entity) {
+        target[change.id] = entity.value;
+      } else {
+        delete target[change.id];
+      }
+    }
+  });
+
   renderAll();
   loadScenariosList();
 });
@@ -0,0 +1,46 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks import generate  # noqa: E402
+
+SIZES = {'scenarios': 3, 'dialogues': 12, 'characters': 4, 'scenes': 3, 'audio': 4}
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app, imported once against a small generated tree (see benchmarks.generate)."""
+    root = str(tmp_path_factory.mktemp('swvne'))
+    generate.generate(root, **SIZES)
+    # A day old, so Last-Modified of untouched content is sent and differs from any change a test makes
+    day_ago = time.time() - 24 * 3600
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            os.utime(os.path.join(dirpath, filename), (day_ago, day_ago))
+    config_path = os.path.join(root, 'config.json')
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+    # Every test sees its own writes at once
+    config['CONTENT_CACHE_CHECK_INTERVAL'] = 0
+    generate.write_json(config_path, config)
+    os.environ['SWVNE_CONFIG'] = config_path
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def admin(client):
+    with client.session_transaction() as session:
+        session['admin_logged_in'] = True
+    return client
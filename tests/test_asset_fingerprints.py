@@ -0,0 +1,52 @@
+import os
+import time
+
+import pytest
+
+import asset_fingerprints
+import audio_pipeline
+import image_pipeline
+
+
+def test_url_for_does_not_hash_new_files(tmp_path):
+    fingerprints = asset_fingerprints.create_fingerprints(str(tmp_path))
+    fingerprints.build()
+    (tmp_path / 'locations').mkdir()
+    (tmp_path / 'locations' / 'new.webp').write_bytes(b'new')
+    url = '/static/locations/new.webp'
+
+    assert fingerprints.url_for(url) == url
+    assert fingerprints.get_stats()['assets'] == 0
+    # Fingerprinted where it is written, as the upload routes and pipelines do
+    fingerprint = fingerprints.update(url)
+    assert fingerprints.url_for(url) == f'/assets/{fingerprint}/new.webp'
+
+
+def test_audio_jobs_report_their_results(tmp_path):
+    results = []
+    jobs = audio_pipeline.AudioJobQueue(str(tmp_path), encoder=None, workers=1, on_result=results.append)
+    jobs.enqueue_task('a', 'voice_sprite', lambda: {'variants': [{'url': '/static/derivatives/a.ogg'}]})
+    jobs.enqueue_task('b', 'voice_sprite', lambda: None)  # nothing to build
+    jobs.enqueue_task('c', 'voice_sprite', lambda: 1 / 0)
+    jobs.wait()
+    assert results == [{'variants': [{'url': '/static/derivatives/a.ogg'}]}]
+
+
+def test_image_derivatives_are_fingerprinted_when_written(app_module):
+    pytest.importorskip('PIL.Image')
+    static_root = app_module.app.static_folder
+    path, url = next(image_pipeline.find_sources(static_root))
+    assert app_module.schedule_image_derivatives(path, url)
+
+    deadline = time.monotonic() + 60
+    entry = None
+    while time.monotonic() < deadline:
+        entry = image_pipeline.load_manifest(static_root)['images'].get(url)
+        if entry and all(app_module.fingerprints.url_for(variant['url']) != variant['url']
+                         for variant in entry['variants']):
+            break
+        time.sleep(0.1)
+    assert entry and entry['variants']
+    for variant in entry['variants']:
+        assert os.path.isfile(app_module.static_url_to_path(variant['url']))
+        assert app_module.fingerprints.url_for(variant['url']).startswith('/assets/')
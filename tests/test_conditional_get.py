@@ -0,0 +1,87 @@
+import io
+import os
+import time
+
+from benchmarks import generate
+
+
+def get_settled(client, url):
+    """GETs ``url`` once it has a Last-Modified: within a second of a change the header is
+    left out, since a one-second date could not tell that change from the next."""
+    response = client.get(url)
+    if 'Last-Modified' not in response.headers:
+        time.sleep(1)
+        response = client.get(url)
+    assert response.status_code == 200
+    assert 'Last-Modified' in response.headers
+    return response
+
+
+def refetch(client, url, response):
+    """GETs ``url`` again with the validators of an earlier response, one at a time."""
+    by_date = client.get(url, headers={'If-Modified-Since': response.headers['Last-Modified']})
+    by_etag = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+    return by_date, by_etag
+
+
+def sfx_count(response):
+    return len(response.get_json()['assets']['sfx'])
+
+
+def test_unchanged_list_is_not_modified(client):
+    first = get_settled(client, '/api/assets/list')
+    assert first.status_code == 200
+    assert 'Last-Modified' in first.headers
+    by_date, by_etag = refetch(client, '/api/assets/list', first)
+    assert (by_date.status_code, by_etag.status_code) == (304, 304)
+
+
+def test_asset_upload_changes_the_list(admin):
+    first = get_settled(admin, '/api/assets/list')
+    uploaded = admin.post('/api/assets/upload', data={
+        'type': 'sfx', 'file': (io.BytesIO(generate.wav_bytes(99)), 'uploaded_click.wav')})
+    assert uploaded.get_json()['success']
+    by_date, by_etag = refetch(admin, '/api/assets/list', first)
+    assert (by_date.status_code, by_etag.status_code) == (200, 200)
+    assert sfx_count(by_date) == sfx_count(first) + 1
+
+
+def test_asset_deletion_changes_the_list(admin, app_module):
+    first = get_settled(admin, '/api/assets/list')
+    # A day-old file: deleting it brings no newer mtime
+    victim = first.get_json()['assets']['sfx'][0]['path']
+    deleted = admin.post('/api/assets/delete', json={'type': 'sfx', 'path': victim})
+    assert deleted.get_json()['success']
+    by_date, by_etag = refetch(admin, '/api/assets/list', first)
+    assert (by_date.status_code, by_etag.status_code) == (200, 200)
+    assert sfx_count(by_date) == sfx_count(first) - 1
+
+
+def test_fingerprint_change_moves_scenario_refs(client, app_module):
+    scenario_id = sorted(app_module.content_manager.scenarios)[0]
+    url = f'/api/scenarios/load/{scenario_id}?include=refs'
+    first = get_settled(client, url)
+    # Replace a pose image but keep its old mtime, like a copy that preserves timestamps
+    character_id = sorted(app_module.content_manager.characters)[0]
+    pose_url = f'/static/character_images/{character_id}/{generate.POSES[0]}.png'
+    path = app_module.static_url_to_path(pose_url)
+    st = os.stat(path)
+    with open(path, 'ab') as f:
+        f.write(b'\0')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    app_module.fingerprints.update(pose_url)
+    by_date, by_etag = refetch(client, url, first)
+    assert (by_date.status_code, by_etag.status_code) == (200, 200)
+
+
+def test_voice_file_moves_lookahead(client, app_module):
+    scenario_id = sorted(app_module.content_manager.scenarios)[-1]
+    url = f'/api/scenarios/lookahead/{scenario_id}'
+    first = get_settled(client, url)
+    first_node = app_module.content_manager.scenarios[scenario_id]['start_dialogue']
+    voice_url = f'/static/audio/voice/game_voice/{scenario_id}_{first_node}.wav'
+    generate.write_file(app_module.static_url_to_path(voice_url), generate.wav_bytes(7))
+    app_module.assets_index.update(voice_url)
+    by_date, by_etag = refetch(client, url, first)
+    assert (by_date.status_code, by_etag.status_code) == (200, 200)
+    assert any(asset['url'] == voice_url for asset in by_date.get_json()['assets'])
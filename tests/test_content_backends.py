@@ -0,0 +1,105 @@
+import io
+import json
+import os
+
+from werkzeug.datastructures import FileStorage
+
+import content_backends
+
+
+def write_section(path, content_type, section):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({content_type: section}, f)
+
+
+def make_backend(tmp_path):
+    folder = tmp_path / 'characters'
+    folder.mkdir()
+    for index in range(4):
+        write_section(folder / f'part_{index}.json', 'characters', {f'char_{index}': {'name': str(index)}})
+    backend = content_backends.JsonFolderBackend(str(tmp_path), batch_window=0)
+    backend.load('characters')
+    return backend
+
+
+def test_load_parses_each_file_once(tmp_path):
+    backend = make_backend(tmp_path)
+    assert backend.stats['files_parsed'] == 4
+    backend.load('characters')
+    assert backend.stats['files_parsed'] == 4
+
+
+def test_update_reparses_only_the_written_file(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.update('characters', 'char_2', lambda current: dict(current, name='two'))
+    snapshot = backend.load('characters')
+    assert snapshot.data['char_2'] == {'name': 'two'}
+    assert backend.stats['files_parsed'] == 5
+
+
+def test_delete_reparses_only_the_written_file(tmp_path):
+    backend = make_backend(tmp_path)
+    assert backend.delete('characters', ['char_1']) == ['char_1']
+    assert 'char_1' not in backend.load('characters').data
+    assert backend.stats['files_parsed'] == 5
+
+
+def test_invalidate_keeps_parsed_files(tmp_path):
+    backend = make_backend(tmp_path)
+    backend.invalidate('characters')
+    backend.load('characters')
+    assert backend.stats['files_parsed'] == 4
+
+
+def test_external_change_is_picked_up(tmp_path):
+    backend = make_backend(tmp_path)
+    revision = backend.load('characters').revision
+    path = tmp_path / 'characters' / 'part_3.json'
+    write_section(path, 'characters', {'char_3': {'name': 'changed by hand'}})
+    os.utime(path, ns=(1, 1))
+    snapshot = backend.load('characters')
+    assert snapshot.data['char_3'] == {'name': 'changed by hand'}
+    assert snapshot.revision != revision
+    assert backend.stats['files_parsed'] == 5
+
+
+def test_manager_save_reparses_one_file(app_module):
+    manager = app_module.content_manager
+    manager.refresh()
+    parsed = manager.backend.stats['files_parsed']
+    # One file per scenario, so a save must not re-read the others
+    scenario_id = sorted(manager.scenarios)[0]
+    manager.put_entity('scenarios', scenario_id, dict(manager.scenarios[scenario_id], title='Renamed'))
+    manager.refresh()
+    assert manager.scenarios[scenario_id]['title'] == 'Renamed'
+    assert manager.backend.stats['files_parsed'] == parsed + 1
+
+
+def fill(backend):
+    """Writes the same entities, in the same order, through the backend API."""
+    for scenario_id in ('middle', 'zeta', 'alpha'):
+        backend.update('scenarios', scenario_id, lambda current: {'title': scenario_id})
+    upload = json.dumps({'scenarios': {'bundle_b': {'title': 'b'}, 'bundle_a': {'title': 'a'}}}).encode('utf-8')
+    backend.import_file('scenarios', 'bundle.json', FileStorage(io.BytesIO(upload), 'bundle.json'))
+    for character_id in ('zoe', 'adam', 'mila'):
+        backend.update('characters', character_id, lambda current: {'name': character_id})
+    backend.delete('characters', ['adam'])
+    backend.update('characters', 'adam', lambda current: {'name': 'back'})
+    backend.update('characters', 'zoe', lambda current: {'name': 'renamed'})
+
+
+def test_backends_order_entities_alike(tmp_path):
+    json_backend = content_backends.create_backend('json', str(tmp_path / 'content'), None, batch_window=0)
+    sqlite_backend = content_backends.create_backend('sqlite', None, str(tmp_path / 'content.sqlite3'))
+    for backend in (json_backend, sqlite_backend):
+        for content_type in ('scenarios', 'characters'):
+            backend.load(content_type)
+        fill(backend)
+
+    # Source file name first, then the order entities were added to the file
+    assert list(json_backend.load('scenarios').data) == ['alpha', 'bundle_b', 'bundle_a', 'middle', 'zeta']
+    assert list(json_backend.load('characters').data) == ['zoe', 'mila', 'adam']
+    for content_type in ('scenarios', 'characters'):
+        assert list(sqlite_backend.load(content_type).data) == list(json_backend.load(content_type).data)
+        assert [entity[0] for entity in sqlite_backend.export_entities(content_type)] == \
+            [entity[0] for entity in json_backend.export_entities(content_type)]
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+import pytest
+
+import content_events
+
+
+class StaticManager:
+    """Just enough of VisualNovelManager for a ChangeFeed."""
+    CONTENT_TYPES = ('scenarios',)
+
+    def __init__(self):
+        self.meta = {'scenarios': {'intro': {'version': '1'}}}
+
+    def refresh(self):
+        return self
+
+
+def make_feed(**kwargs):
+    return content_events.ChangeFeed(StaticManager(), interval=0, **kwargs)
+
+
+def test_poll_publishes_changed_and_deleted_entities():
+    feed = make_feed()
+    feed.content_manager.meta['scenarios'] = {'outro': {'version': '1'}}
+    changes = feed.poll()
+    assert sorted((change['id'], change['version']) for change in changes) == [('intro', None), ('outro', '1')]
+
+
+def test_stream_yields_published_changes():
+    feed = make_feed(heartbeat=0.01, max_duration=5)
+    stream = feed.stream()
+    assert next(stream) == 'retry: 3000\n\n'
+    feed.publish([{'type': 'scenarios', 'id': 'intro', 'version': '2'}])
+    frame = next(stream)
+    assert frame.startswith('id: 1\nevent: change\n') and '"version": "2"' in frame
+    stream.close()
+
+
+def test_stale_last_event_id_gets_a_reset():
+    feed = make_feed(heartbeat=0.01, max_duration=5)
+    frames = feed._open(last_event_id=42)[0]
+    assert any('event: reset' in frame for frame in frames)
+
+
+def test_async_streams_wait_without_threads():
+    feed = make_feed(heartbeat=30, max_duration=30)
+    clients = 200
+
+    async def scenario():
+        async def first_change(stream):
+            async for frame in stream:
+                if 'event: change' in frame:
+                    await stream.aclose()
+                    return frame
+
+        baseline = threading.active_count()
+        streams = [feed.stream_async() for _ in range(clients)]
+        tasks = [asyncio.ensure_future(first_change(stream)) for stream in streams]
+        await asyncio.sleep(0.05)
+        threads = threading.active_count() - baseline
+        # Published from the watcher's thread, like poll() does
+        publisher = threading.Thread(target=feed.publish, args=([{'type': 'scenarios', 'id': 'intro', 'version': '3'}],))
+        publisher.start()
+        frames = await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        publisher.join()
+        return threads, frames
+
+    threads, frames = asyncio.run(scenario())
+    assert threads == 0
+    assert len(frames) == clients and all('"version": "3"' in frame for frame in frames)
+    assert not feed._waiters
+
+
+def test_asgi_events_release_the_slot_on_disconnect(app_module):
+    asgi = pytest.importorskip('asgi')
+    feed = app_module.change_feed
+
+    async def scenario():
+        sent = []
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/events', 'query_string': b'types=scenarios',
+                 'headers': []}
+        handler = asyncio.ensure_future(asgi.application(scope, receive, send))
+        await asyncio.sleep(0.05)
+        clients = feed.get_stats()['clients']
+        disconnect.set()
+        await asyncio.wait_for(handler, 5)
+        return sent, clients
+
+    before = feed.get_stats()['clients']
+    sent, clients = asyncio.run(scenario())
+    assert clients == before + 1
+    assert feed.get_stats()['clients'] == before
+    assert sent[0]['status'] == 200
+    assert (b'content-type', b'text/event-stream; charset=utf-8') in sent[0]['headers']
+    assert sent[1]['body'] == b'retry: 3000\n\n'
+
+
+def test_game_subscribes_only_under_asgi(client):
+    script = b'js/content_events.js'
+    assert script not in client.get('/').data
+    assert script in client.get('/', environ_overrides={'asgi.scope': {}}).data
@@ -0,0 +1,53 @@
+import pytest
+
+import content_backends
+import content_store
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def backend(request, tmp_path):
+    backend = content_backends.create_backend(request.param, str(tmp_path / 'content'),
+                                              str(tmp_path / 'content.sqlite3'), batch_window=0)
+    if request.param == 'json':
+        (tmp_path / 'content' / 'characters').mkdir(parents=True)
+    return backend
+
+
+def test_stale_version_is_rejected(backend):
+    first = backend.update('characters', 'hero', lambda current: {'name': 'Первый'})
+    second = backend.update('characters', 'hero', lambda current: {'name': 'Второй'}, first)
+    with pytest.raises(content_store.VersionConflict) as conflict:
+        backend.update('characters', 'hero', lambda current: {'name': 'Третий'}, first)
+    assert conflict.value.current == second
+    assert backend.load('characters').data['hero'] == {'name': 'Второй'}
+
+
+def listed_characters(client):
+    return {item['id']: item for item in client.get('/api/characters/list').get_json()['characters']}
+
+
+def save(client, characters, expected_version=None):
+    payload = {'characters': characters}
+    if expected_version is not None:
+        payload['expected_version'] = expected_version
+    return client.post('/api/characters/save', json=payload)
+
+
+def test_character_save_conflict(admin):
+    assert save(admin, {'conflict_hero': {'name': 'Первый'}}).status_code == 200
+    loaded = listed_characters(admin)['conflict_hero']['version']
+    # Saved in another window in the meantime
+    saved = save(admin, {'conflict_hero': {'name': 'Второй'}}, loaded)
+    assert saved.status_code == 200
+
+    stale = save(admin, {'conflict_hero': {'name': 'Третий'}}, loaded)
+    assert stale.status_code == 409
+    assert stale.get_json()['current_version'] == saved.get_json()['version']
+    assert listed_characters(admin)['conflict_hero']['name'] == 'Второй'
+
+
+def test_character_save_takes_one_character(admin):
+    response = save(admin, {'one_hero': {'name': 'Один'}, 'other_hero': {'name': 'Другой'}})
+    assert response.status_code == 400
+    listed = listed_characters(admin)
+    assert 'one_hero' not in listed and 'other_hero' not in listed
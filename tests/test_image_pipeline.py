@@ -0,0 +1,40 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import image_pipeline
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def make_source(path, canvas, box):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image = Image.new('RGBA', canvas, (0, 0, 0, 0))
+    image.paste((200, 40, 40, 255), box)
+    image.save(path)
+
+
+def test_poses_keep_their_canvas_and_locations_are_trimmed(tmp_path):
+    make_source(tmp_path / 'character_images' / 'adam' / 'angry.png', (1024, 1024), (323, 53, 717, 1001))
+    make_source(tmp_path / 'locations' / 'window.png', (800, 600), (100, 100, 700, 500))
+    report = image_pipeline.process_tree(str(tmp_path), widths=(480,), workers=1)
+    assert report['processed'] == 2 and not report['errors']
+
+    images = image_pipeline.load_manifest(str(tmp_path))['images']
+    pose = images['/static/character_images/adam/angry.png']
+    assert pose['trim'] is None
+    assert max(variant['width'] for variant in pose['variants']) == 1024
+    location = images['/static/locations/window.png']
+    assert location['trim'] == [100, 100, 700, 500]
+    assert max(variant['width'] for variant in location['variants']) == 600
+
+
+def add_entry(static_root, index):
+    image_pipeline.update_manifest(static_root, [{'source': f'/static/locations/{index}.png', 'hash': str(index),
+                                                  'variants': []}])
+
+
+def test_manifest_updates_from_several_processes_are_all_kept(tmp_path):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        list(executor.map(add_entry, [str(tmp_path)] * 32, range(32)))
+    assert len(image_pipeline.load_manifest(str(tmp_path))['images']) == 32
@@ -0,0 +1,59 @@
+import math
+
+import playthrough_explorer
+import scenario_graph
+
+
+def compile_dialogues(dialogues, start='a'):
+    return scenario_graph.compile_scenario('test', {'title': 'Тест', 'start_dialogue': start, 'dialogues': dialogues})
+
+
+def test_counter_loop_is_reported_when_truncated():
+    # Every lap adds one to the counter, so no state repeats and the search is cut off
+    compiled = compile_dialogues({
+        'a': {'text': 'Ещё раз?', 'choices': [
+            {'text': 'Да', 'next': 'a', 'set': {'laps': '+1'}},
+            {'text': 'Хватит', 'next': 'end', 'condition': 'laps < 0'},
+        ]},
+        'end': {'text': 'Конец'},
+    })
+    report = playthrough_explorer.explore(compiled, max_states=200)
+    assert report['truncated']
+    assert report['loops'] == [{'node': 'a', 'choice': None, 'reason': 'no_ending_within_limit'}]
+
+
+def test_truncated_search_does_not_report_dialogues_that_can_finish():
+    compiled = compile_dialogues({
+        'a': {'text': 'Ещё раз?', 'choices': [
+            {'text': 'Да', 'next': 'a', 'set': {'laps': '+1'}},
+            {'text': 'Хватит', 'next': 'end'},
+        ]},
+        'end': {'text': 'Конец'},
+    })
+    report = playthrough_explorer.explore(compiled, max_states=200)
+    assert report['truncated']
+    assert report['loops'] == []
+
+
+def test_nan_states_are_explored_once():
+    # Infinity - Infinity is NaN, as in the client; NaN != NaN must not make every visit a new state
+    compiled = compile_dialogues({
+        'a': {'text': 'Вперёд', 'choices': [{'text': 'Дальше', 'next': 'b', 'set': {'score': '+Infinity'}}]},
+        'b': {'text': 'Назад', 'choices': [
+            {'text': 'Снова', 'next': 'a', 'set': {'score': '-Infinity'}},
+            {'text': 'Выйти', 'next': 'end'},
+        ]},
+        'end': {'text': 'Конец'},
+    })
+    report = playthrough_explorer.explore(compiled, max_states=1000)
+    assert not report['truncated']
+    assert report['states'] == 4
+    assert report['loops'] == []
+    assert 'NaN' in report['variables']['score']['values']
+
+
+def test_freeze_round_trips_nan():
+    frozen = playthrough_explorer.freeze({'x': math.nan, 'y': [1, 2]})
+    assert frozen == playthrough_explorer.freeze({'x': float('nan'), 'y': [1, 2]})
+    thawed = playthrough_explorer.thaw(frozen)
+    assert math.isnan(thawed['x']) and thawed['y'] == [1, 2]
@@ -0,0 +1,89 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+
+import pytest
+
+import scenario_engine
+import scenario_graph
+
+GAME_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'js', 'game.js')
+
+VALUES = [None, True, False, 0, 1, 10, -2.5, 0.1, '', '5', ' 7 ', '0x10', 'abc', [], [3], [1, 2], {}]
+COMPARE_VALUES = [0, 5, 2.5, -1, '5', 'abc', '']
+OPERATORS = ['==', '!=', '>', '<', '>=', '<=']
+EFFECTS = [['x', 'add', 1], ['x', 'add', -2.5], ['x', 'add', 0.2], ['x', 'set', 'hello'], ['x', 'set', [1]]]
+
+HARNESS = '''
+const cases = JSON.parse(require("fs").readFileSync(0, "utf8"));
+console.log = () => {};
+class Engine {
+  constructor(variables) { this.gameState = { variables }; }
+%s
+%s
+}
+const encode = (value) =>
+  typeof value === "number" ? { number: String(value) } : value === undefined ? { undefined: true } : value;
+const conditions = cases.conditions.map(([variables, condition]) => new Engine(variables).checkCondition(condition));
+const effects = cases.effects.map(([variables, effect]) => {
+  const engine = new Engine(variables);
+  engine.applyEffect(effect);
+  return encode(engine.gameState.variables.x);
+});
+process.stdout.write(JSON.stringify({ conditions, effects }));
+'''
+
+
+def method_source(source, name):
+    match = re.search(r'\n  %s\(.*?\n  }\n' % name, source, re.S)
+    assert match, f'{name} not found in game.js'
+    return match.group(0)
+
+
+def encode(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {'number': scenario_engine.to_string(value)}
+    return value
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node is not installed')
+def test_conditions_and_effects_match_game_js():
+    with open(GAME_JS, encoding='utf-8') as f:
+        source = f.read()
+    harness = HARNESS % (method_source(source, 'checkCondition'), method_source(source, 'applyEffect'))
+
+    conditions = [({'x': value}, ['x', operator, compare])
+                  for value in VALUES for operator in OPERATORS for compare in COMPARE_VALUES]
+    conditions += [({}, ['x', operator, compare]) for operator in OPERATORS for compare in COMPARE_VALUES]
+    effects = [({'x': value}, effect) for value in VALUES for effect in EFFECTS] + [({}, effect) for effect in EFFECTS]
+    result = subprocess.run(['node', '-e', harness], input=json.dumps({'conditions': conditions, 'effects': effects}),
+                            capture_output=True, text=True, check=True)
+    expected = json.loads(result.stdout)
+
+    for (variables, condition), js in zip(conditions, expected['conditions']):
+        assert scenario_engine.check_condition(condition, variables) == js, (variables, condition)
+    for (variables, effect), js in zip(effects, expected['effects']):
+        after = dict(variables)
+        scenario_engine.apply_effect(after, effect)
+        assert encode(after['x']) == js, (variables, effect)
+
+
+def test_choice_without_next_stays_on_the_line():
+    compiled = scenario_graph.compile_scenario('test', {'start_dialogue': 'a', 'dialogues': {
+        'a': {'text': 'Подумай', 'choices': [
+            {'text': 'Думать', 'set': {'thought': '+1'}},
+            {'text': 'Дальше', 'next': 'b'},
+        ]},
+        'b': {'text': 'Конец'},
+    }})
+
+    def render(position):
+        return scenario_engine.render_frame('test', compiled, position, {}, {})
+
+    frame, variables = scenario_engine.step(compiled, 0, {}, 0, render)
+    assert frame == render(0)
+    assert variables == {'thought': 1}
+    frame, variables = scenario_engine.step(compiled, 0, variables, 1, render)
+    assert frame['dialogue'] == 'b' and variables == {'thought': 1}
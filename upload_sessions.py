@@ -0,0 +1,244 @@
+"""Chunked, resumable uploads for large assets.
+
+The client opens an upload with the file name and size, sends chunks of
+``chunk_size`` bytes numbered from 0, in order, and finalizes it. Each chunk
+is appended to ``<id>.part`` in the staging folder straight from the request
+stream and hashed as it goes, so a large BGM file is never held in memory.
+
+The acknowledged offset is stored with the upload's metadata after every
+chunk. After a dropped connection, or a restart, ``get`` tells the client
+where to resume, and bytes written past that offset by an interrupted chunk
+are discarded. Re-sending an acknowledged chunk is a no-op, so a retry after
+a lost response is harmless.
+
+Uploads untouched for ``ttl`` seconds are removed.
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+import content_store
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+DEFAULT_TTL = 24 * 3600
+COPY_BUFFER_SIZE = 64 * 1024
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UnknownUpload(Exception):
+    """No such upload: never created, finalized, cancelled or expired."""
+
+
+class OffsetMismatch(Exception):
+    """A chunk that does not continue the upload; ``offset`` is where it stands."""
+
+    def __init__(self, offset):
+        super().__init__(f'upload is at offset {offset}')
+        self.offset = offset
+
+
+class InvalidChunk(ValueError):
+    pass
+
+
+class UploadIncomplete(Exception):
+    def __init__(self, offset, size):
+        super().__init__(f'received {offset} of {size} bytes')
+        self.offset = offset
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+class CompletedUpload:
+    """A fully received file; ``save`` moves it into place (``content_store.atomic_write_file``)."""
+
+    def __init__(self, path, meta, sha256):
+        self.path = path
+        self.filename = meta['filename']
+        self.size = meta['size']
+        self.info = meta['info']
+        self.sha256 = sha256
+
+    def save(self, destination):
+        try:
+            os.replace(self.path, destination)
+        except OSError:  # staging folder on another filesystem
+            shutil.move(self.path, destination)
+
+
+class UploadSessions:
+    def __init__(self, folder, chunk_size=DEFAULT_CHUNK_SIZE, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.ttl = ttl
+        # upload id -> (bytes hashed, sha256 object); per process, caught up from the file when behind
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'chunks': 0, 'chunks_repeated': 0, 'bytes': 0, 'completed': 0, 'expired': 0}
+
+    def _path(self, upload_id, suffix):
+        if not isinstance(upload_id, str) or not _UPLOAD_ID.match(upload_id):
+            raise UnknownUpload(upload_id)
+        return os.path.join(self.folder, f'{upload_id}{suffix}')
+
+    def _read_meta(self, upload_id):
+        meta = content_store.read_json(self._path(upload_id, '.json'))
+        if meta is None:
+            raise UnknownUpload(upload_id)
+        return meta
+
+    def create(self, filename, size, info=None, sha256=None):
+        """Opens an upload of ``size`` bytes; ``info`` is kept for the finalize step.
+        Returns the upload's metadata."""
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            raise ValueError('size must be a non-negative integer')
+        if size > self.max_size:
+            raise ValueError(f'larger than {self.max_size} bytes')
+        self.cleanup()
+
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        meta = {
+            'id': upload_id,
+            'filename': filename,
+            'size': size,
+            'sha256': sha256.lower() if isinstance(sha256, str) and sha256 else None,
+            'info': info or {},
+            'received': 0,
+            'chunk_size': self.chunk_size,
+            'created_at': now,
+            'updated_at': now,
+        }
+        os.makedirs(self.folder, exist_ok=True)
+        open(self._path(upload_id, '.part'), 'wb').close()
+        content_store.atomic_write_json(self._path(upload_id, '.json'), meta)
+        with self._lock:
+            self.stats['created'] += 1
+        return meta
+
+    def get(self, upload_id):
+        return self._read_meta(upload_id)
+
+    def _hash_until(self, upload_id, part_path, offset):
+        """sha256 of the first ``offset`` bytes, reading only what this process has not hashed yet."""
+        with self._lock:
+            hashed, digest = self._hashes.get(upload_id, (0, None))
+        if digest is None or hashed > offset:
+            hashed, digest = 0, hashlib.sha256()
+        else:
+            digest = digest.copy()
+        if hashed < offset:
+            with open(part_path, 'rb') as f:
+                f.seek(hashed)
+                while hashed < offset:
+                    block = f.read(min(COPY_BUFFER_SIZE, offset - hashed))
+                    if not block:
+                        raise UploadIncomplete(hashed, offset)
+                    digest.update(block)
+                    hashed += len(block)
+        return digest
+
+    def write_chunk(self, upload_id, index, stream, length=None):
+        """Appends chunk ``index`` read from ``stream``; returns the updated metadata."""
+        part_path = self._path(upload_id, '.part')
+        with content_store.FileLock(part_path):
+            meta = self._read_meta(upload_id)
+            offset = index * meta['chunk_size']
+            expected = min(meta['chunk_size'], meta['size'] - offset)
+            if index < 0 or expected <= 0:
+                raise InvalidChunk(f'chunk {index} is out of range')
+            if length is not None and length != expected:
+                raise InvalidChunk(f'chunk {index} must be {expected} bytes, got {length}')
+            if offset + expected <= meta['received']:
+                with self._lock:
+                    self.stats['chunks_repeated'] += 1
+                return meta
+            if offset != meta['received']:
+                raise OffsetMismatch(meta['received'])
+
+            digest = self._hash_until(upload_id, part_path, offset)
+            written = 0
+            with open(part_path, 'r+b') as f:
+                # Drop whatever an interrupted attempt left past the acknowledged offset
+                f.truncate(offset)
+                f.seek(offset)
+                while written < expected:
+                    block = stream.read(min(COPY_BUFFER_SIZE, expected - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    digest.update(block)
+                    written += len(block)
+                if written != expected or stream.read(1):
+                    f.truncate(offset)
+                    raise InvalidChunk(f'chunk {index} must be {expected} bytes')
+                f.flush()
+                os.fsync(f.fileno())
+
+            meta['received'] = offset + written
+            meta['updated_at'] = time.time()
+            content_store.atomic_write_json(self._path(upload_id, '.json'), meta)
+            with self._lock:
+                self._hashes[upload_id] = (meta['received'], digest)
+                self.stats['chunks'] += 1
+                self.stats['bytes'] += written
+        return meta
+
+    def complete(self, upload_id):
+        """The received file, checked against the announced size and checksum."""
+        part_path = self._path(upload_id, '.part')
+        with content_store.FileLock(part_path):
+            meta = self._read_meta(upload_id)
+            if meta['received'] != meta['size']:
+                raise UploadIncomplete(meta['received'], meta['size'])
+            sha256 = self._hash_until(upload_id, part_path, meta['size']).hexdigest()
+            if meta['sha256'] and meta['sha256'] != sha256:
+                raise ChecksumMismatch(f"expected {meta['sha256']}, got {sha256}")
+        return CompletedUpload(part_path, meta, sha256)
+
+    def discard(self, upload_id, completed=False):
+        """Removes the upload and whatever is left of its file."""
+        for suffix in ('.json', '.part', '.part' + content_store.LOCK_SUFFIX):
+            try:
+                os.remove(self._path(upload_id, suffix))
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+            if completed:
+                self.stats['completed'] += 1
+
+    def cleanup(self):
+        """Removes uploads untouched for ``ttl`` seconds."""
+        if not os.path.isdir(self.folder):
+            return 0
+        cutoff = time.time() - self.ttl
+        expired = set()
+        for entry in os.scandir(self.folder):
+            upload_id = entry.name.split('.', 1)[0]
+            if not _UPLOAD_ID.match(upload_id) or upload_id in expired:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    expired.add(upload_id)
+            except OSError:
+                continue
+        for upload_id in expired:
+            self.discard(upload_id)
+        removed = len(expired)
+        with self._lock:
+            self.stats['expired'] += removed
+        return removed
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
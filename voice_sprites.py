@@ -0,0 +1,269 @@
+"""Per-scenario voice line index and audio sprites.
+
+The game plays ``/static/audio/voice/game_voice/<scenario>_<dialogue>.wav``
+for a line when that file exists. ``find_lines`` tells which lines have one
+(from the asset index, without touching the disk), so the game only requests
+voice that is there.
+
+A sprite packs all voice lines of a scenario into one file, in dialogue order
+with a short silence between lines, plus a table of where each line starts and
+how long it is. The game loads the sprite once and seeks in it instead of
+fetching every line. The WAV sprite needs nothing but the standard library;
+with an encoder (ffmpeg) an Opus/OGG copy is made as well. Sprites are listed
+in static/derivatives/voice_sprites.json with the version of the lines they
+were built from, and a sprite whose lines changed since is not used.
+
+    python voice_sprites.py [scenario ...] [--encoder ffmpeg] [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+import wave
+from collections import Counter
+
+import asset_index
+import audio_pipeline
+import content_backends
+import scenario_graph
+
+VOICE_FOLDER = 'audio/voice/game_voice'
+SPRITE_FOLDER = 'voice_sprites'
+MANIFEST_NAME = 'voice_sprites.json'
+# Silence between lines; the player stops on timeupdate, which fires every ~250 ms
+GAP_SECONDS = 0.3
+COPY_FRAMES = 64 * 1024
+
+_manifest_lock = threading.Lock()
+
+
+def voice_url(scenario_id, dialogue_id):
+    return f'/static/{VOICE_FOLDER}/{scenario_id}_{dialogue_id}.wav'
+
+
+def find_lines(scenario_id, dialogue_ids, lookup):
+    """``{dialogue id: asset index entry}`` for the lines of a scenario that have a voice file.
+
+    ``lookup`` maps a URL to its entry, or None (``AssetIndex.get``).
+    """
+    lines = {}
+    for dialogue_id in dialogue_ids:
+        entry = lookup(voice_url(scenario_id, dialogue_id))
+        if entry is not None:
+            lines[dialogue_id] = entry
+    return lines
+
+
+def lines_version(lines):
+    """Changes whenever a line gets, loses or changes its voice file."""
+    parts = '|'.join(f"{dialogue_id}:{entry['hash']}" for dialogue_id, entry in lines.items())
+    return hashlib.sha1(parts.encode('utf-8')).hexdigest()[:16]
+
+
+def manifest_path(static_root):
+    return os.path.join(static_root, audio_pipeline.DERIVATIVES_FOLDER, MANIFEST_NAME)
+
+
+def load_manifest(static_root):
+    path = manifest_path(static_root)
+    if not os.path.exists(path):
+        return {'sprites': {}}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError) as e:
+        print(f"[ERROR] Failed to read voice sprite manifest: {e}")
+        return {'sprites': {}}
+
+
+def _remove_variant_files(static_root, entry):
+    for variant in entry['variants']:
+        path = os.path.join(static_root, *variant['url'][len('/static/'):].split('/'))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def update_manifest(static_root, scenario_id, entry):
+    """Stores the sprite of a scenario (None removes it) and deletes the files it replaces."""
+    with _manifest_lock:
+        manifest = load_manifest(static_root)
+        previous = manifest['sprites'].get(scenario_id)
+        if previous:
+            kept = {variant['url'] for variant in entry['variants']} if entry else set()
+            _remove_variant_files(static_root, dict(previous, variants=[
+                variant for variant in previous['variants'] if variant['url'] not in kept]))
+        if entry:
+            manifest['sprites'][scenario_id] = entry
+        else:
+            manifest['sprites'].pop(scenario_id, None)
+        path = manifest_path(static_root)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+        return manifest
+
+
+class SpriteManifest:
+    """The manifest as of its last change on disk; re-read only when the file changes."""
+
+    def __init__(self, static_root):
+        self.static_root = static_root
+        self._stamp = None
+        self._sprites = {}
+        # mtime of the manifest (ns) as of the last get(), 0 if there is none
+        self.modified_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, scenario_id):
+        try:
+            st = os.stat(manifest_path(self.static_root))
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        with self._lock:
+            if stamp != self._stamp:
+                self._sprites = load_manifest(self.static_root)['sprites'] if stamp else {}
+                self._stamp = stamp
+                self.modified_at = stamp[0] if stamp else 0
+            return self._sprites.get(scenario_id)
+
+
+def pack_wav(sources, output_path, gap=GAP_SECONDS):
+    """Concatenates WAV files with ``gap`` seconds of silence between them.
+
+    Only lines in the most common format (channels, sample width, rate) are
+    packed; the others keep playing from their own files. Returns
+    ``({dialogue id: [start, duration]}, skipped dialogue ids, total duration)``.
+    """
+    formats = {}
+    for dialogue_id, path in sources:
+        try:
+            with wave.open(path, 'rb') as f:
+                formats[dialogue_id] = (f.getnchannels(), f.getsampwidth(), f.getframerate())
+        except (wave.Error, EOFError, OSError) as e:
+            print(f"[WARNING] Voice line {path} is not packed: {e}")
+    if not formats:
+        return {}, [dialogue_id for dialogue_id, _ in sources], 0.0
+    common = Counter(formats.values()).most_common(1)[0][0]
+    channels, sample_width, rate = common
+    # 8-bit PCM is unsigned: silence is the middle value
+    silence = (b'\x80' if sample_width == 1 else b'\x00' * sample_width) * channels * round(gap * rate)
+
+    table = {}
+    skipped = []
+    frames = 0
+    temp_path = f'{output_path}.tmp'
+    with wave.open(temp_path, 'wb') as out:
+        out.setnchannels(channels)
+        out.setsampwidth(sample_width)
+        out.setframerate(rate)
+        for dialogue_id, path in sources:
+            if formats.get(dialogue_id) != common:
+                skipped.append(dialogue_id)
+                continue
+            if table:
+                out.writeframes(silence)
+                frames += len(silence) // (sample_width * channels)
+            with wave.open(path, 'rb') as f:
+                count = f.getnframes()
+                for _ in range(0, count, COPY_FRAMES):
+                    out.writeframes(f.readframes(COPY_FRAMES))
+            table[dialogue_id] = [round(frames / rate, 4), round(count / rate, 4)]
+            frames += count
+    os.replace(temp_path, output_path)
+    return table, skipped, round(frames / rate, 4)
+
+
+def build_sprite(static_root, scenario_id, lines, encoder=None, bitrate=audio_pipeline.DEFAULT_BITRATES['voice'],
+                 loudness=audio_pipeline.DEFAULT_LOUDNESS):
+    """Packs the voice ``lines`` of a scenario (``find_lines``) and records the sprite.
+
+    Returns the manifest entry, or None when the scenario has no voice lines.
+    """
+    started = time.perf_counter()
+    if not lines:
+        update_manifest(static_root, scenario_id, None)
+        return None
+    version = lines_version(lines)
+    folder = os.path.join(static_root, audio_pipeline.DERIVATIVES_FOLDER, *VOICE_FOLDER.split('/'), SPRITE_FOLDER)
+    url_prefix = f'/static/{audio_pipeline.DERIVATIVES_FOLDER}/{VOICE_FOLDER}/{SPRITE_FOLDER}'
+    os.makedirs(folder, exist_ok=True)
+
+    sources = [(dialogue_id, os.path.join(static_root, *entry['path'][len('/static/'):].split('/')))
+               for dialogue_id, entry in lines.items()]
+    wav_name = f'{scenario_id}.{version}.wav'
+    wav_path = os.path.join(folder, wav_name)
+    table, skipped, duration = pack_wav(sources, wav_path)
+    variants = [{'url': f'{url_prefix}/{wav_name}', 'format': 'wav', 'codec': 'pcm',
+                 'size': os.path.getsize(wav_path), 'duration': duration}]
+    if encoder and table:
+        ogg_name = f'{scenario_id}.{version}.{audio_pipeline.OUTPUT_FORMAT}'
+        ogg_path = os.path.join(folder, ogg_name)
+        audio_pipeline.transcode(encoder, wav_path, ogg_path, bitrate, loudness)
+        # Compressed first: the game takes the first variant it can play
+        variants.insert(0, {'url': f'{url_prefix}/{ogg_name}', 'format': audio_pipeline.OUTPUT_FORMAT,
+                            'codec': 'opus', 'size': os.path.getsize(ogg_path),
+                            'duration': audio_pipeline.probe_duration(ogg_path, encoder)})
+    if not table:
+        os.remove(wav_path)
+        variants = []
+
+    entry = {
+        'scenario': scenario_id,
+        'version': version,
+        'gap': GAP_SECONDS,
+        'lines': table,
+        'skipped': skipped,
+        'source_size': sum(entry['size'] for entry in lines.values()),
+        'variants': variants,
+        'process_ms': round((time.perf_counter() - started) * 1000, 3),
+    }
+    update_manifest(static_root, scenario_id, entry if variants else None)
+    return entry if variants else None
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='Pack the voice lines of each scenario into one audio sprite.')
+    parser.add_argument('scenarios', nargs='*', help='scenario ids (default: all)')
+    parser.add_argument('--content', default=os.path.join(base_dir, 'content'))
+    parser.add_argument('--static', default=os.path.join(base_dir, 'static'))
+    parser.add_argument('--backend', choices=('json', 'sqlite'), default='json')
+    parser.add_argument('--database', default=os.path.join(base_dir, 'content.sqlite3'))
+    parser.add_argument('--encoder', default='ffmpeg', help='encoder binary name or path')
+    parser.add_argument('--bitrate', default=audio_pipeline.DEFAULT_BITRATES['voice'])
+    parser.add_argument('--force', action='store_true', help='rebuild sprites whose voice lines did not change')
+    args = parser.parse_args()
+
+    backend = content_backends.create_backend(args.backend, args.content, args.database)
+    scenarios = backend.load('scenarios').data
+    missing = [scenario_id for scenario_id in args.scenarios if scenario_id not in scenarios]
+    if missing:
+        parser.error(f"unknown scenarios: {', '.join(missing)}")
+    assets = asset_index.AssetIndex(args.static)
+    assets.scan()
+    encoder = audio_pipeline.find_encoder(args.encoder)
+    if encoder is None:
+        print('[WARNING] Audio encoder was not found; building WAV sprites only')
+
+    manifest = load_manifest(args.static)['sprites']
+    report = []
+    for scenario_id in args.scenarios or sorted(scenarios):
+        compiled = scenario_graph.compile_scenario(scenario_id, scenarios[scenario_id])
+        lines = find_lines(scenario_id, compiled['ids'], assets.get)
+        current = manifest.get(scenario_id)
+        if args.force or not current or not lines or current['version'] != lines_version(lines):
+            current = build_sprite(args.static, scenario_id, lines, encoder, args.bitrate)
+        report.append({'scenario': scenario_id, 'voice_lines': len(lines),
+                       'packed': len(current['lines']) if current else 0,
+                       'not_packed': current['skipped'] if current else [],
+                       'variants': [variant['url'] for variant in current['variants']] if current else []})
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()